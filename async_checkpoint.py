@@ -0,0 +1,176 @@
+"""
+A `tf.train.Saver` that writes the checkpoints on a background thread (see `ASYNC_CHECKPOINTS`
+in the training config).
+
+`save` copies the values of the variables to host memory (a single `sess.run`) and returns. A
+background thread then writes them to a temporary checkpoint with its own graph and session, renames
+the files into place (the data files first, the index file last, so a partially written checkpoint
+is never visible) and then updates the `checkpoint` state file. The checkpoints are kept according
+to `max_to_keep` and `keep_checkpoint_every_n_hours`, like `tf.train.Saver`. Meta graphs are not
+written.
+
+`save` and `wait` may be called from several threads (e.g. the Supervisor's checkpoint thread and
+the final save of `slim.learning.train`). Once training is stopping (see `wrap_train_step_fn`),
+`save` waits for the checkpoint to be written before it returns.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+import time
+
+import tensorflow as tf
+from tensorflow.python.ops import io_ops
+
+TEMP_SUFFIX = '.tmp'
+
+
+class AsyncSaver(tf.train.Saver):
+
+    def __init__(self, var_list=None, max_to_keep=5, keep_checkpoint_every_n_hours=10000.0, **kwargs):
+        """
+        Args:
+            var_list: a list of variables to save (and restore), defaults to all of the global variables
+            max_to_keep: the maximum number of recent checkpoints to keep
+            keep_checkpoint_every_n_hours: also keep one checkpoint every N hours
+            kwargs: passed to `tf.train.Saver` (used for restoring)
+        """
+        if var_list is None:
+            var_list = tf.global_variables()
+        for var in var_list:
+            if not isinstance(var, tf.Variable):
+                raise ValueError("AsyncSaver only saves variables, got %s." % (var,))
+
+        super(AsyncSaver, self).__init__(var_list=var_list, max_to_keep=max_to_keep,
+                                         keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours, **kwargs)
+
+        self._variables = sorted(var_list, key=lambda var: var.op.name)
+        self._async_max_to_keep = max_to_keep
+        self._keep_every_n_secs = keep_checkpoint_every_n_hours * 3600
+        self._next_keep_time = time.time() + self._keep_every_n_secs
+        # (path, time) of the checkpoints that may be deleted, oldest first
+        self._async_checkpoints = []
+
+        # The writer has its own graph, so that it doesn't touch the training graph (which is
+        # finalized) or the training session.
+        self._writer_graph = tf.Graph()
+        with self._writer_graph.as_default(), tf.device('/cpu:0'):
+            self._prefix_placeholder = tf.placeholder(tf.string, [])
+            self._value_placeholders = [tf.placeholder(var.dtype.base_dtype, var.get_shape()) for var in self._variables]
+            self._write_op = io_ops.save_v2(self._prefix_placeholder,
+                                            [var.op.name for var in self._variables],
+                                            [''] * len(self._variables),
+                                            self._value_placeholders)
+        self._writer_sess = None
+
+        self._thread = None
+        self._error = None
+        # Guards `_thread` and `_error`, reentrant because `save` waits for the previous write
+        self._lock = threading.RLock()
+        # Once training is stopping, each save is written before `save` returns
+        self._synchronous = False
+
+    def save(self, sess, save_path, global_step=None, latest_filename=None, **kwargs):
+        """ Snapshot the variables and write them to `save_path`-`global_step` on a background thread.
+        If the previous checkpoint is still being written, then wait for it first.
+        Returns:
+            the path of the checkpoint that will be written
+        """
+        with self._lock:
+            self.wait()
+            checkpoint_path = self._snapshot(sess, save_path, global_step, latest_filename)
+            if self._synchronous:
+                self.wait()
+        return checkpoint_path
+
+    def _snapshot(self, sess, save_path, global_step, latest_filename):
+        """ Copy the variables to host memory and start writing them on a background thread.
+        """
+        fetch_global_step = isinstance(global_step, (tf.Tensor, tf.Variable))
+        fetches = [self._variables]
+        if fetch_global_step:
+            fetches.append(global_step)
+        outputs = sess.run(fetches)
+        values = outputs[0]
+        if global_step is not None:
+            global_step = int(outputs[1]) if fetch_global_step else int(global_step)
+            checkpoint_path = '%s-%d' % (save_path, global_step)
+        else:
+            checkpoint_path = save_path
+
+        self._thread = threading.Thread(target=self._write, args=(values, checkpoint_path, latest_filename))
+        self._thread.start()
+
+        return checkpoint_path
+
+    def wait(self):
+        """ Wait for the checkpoint that is being written (if any).
+        Raises:
+            the error of the last write, if it failed
+        """
+        with self._lock:
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            if self._error is not None:
+                error, self._error = self._error, None
+                raise error
+
+    def wrap_train_step_fn(self, train_step_fn):
+        """ Wrap a `train_step_fn` for `slim.learning.train` so that the saves after the last step
+        (the final checkpoint) are written before `save` returns.
+        """
+        def final_save_train_step_fn(sess, train_op, global_step, train_step_kwargs):
+            total_loss, should_stop = train_step_fn(sess, train_op, global_step, train_step_kwargs)
+            if should_stop:
+                self._synchronous = True
+            return total_loss, should_stop
+        return final_save_train_step_fn
+
+    def _write(self, values, checkpoint_path, latest_filename):
+        try:
+            start_time = time.time()
+
+            if self._writer_sess is None:
+                self._writer_sess = tf.Session(graph=self._writer_graph,
+                                               config=tf.ConfigProto(device_count={'GPU' : 0}))
+
+            temp_path = checkpoint_path + TEMP_SUFFIX
+            feed_dict = dict(zip(self._value_placeholders, values))
+            feed_dict[self._prefix_placeholder] = temp_path
+            self._writer_sess.run(self._write_op, feed_dict)
+
+            temp_files = tf.gfile.Glob(temp_path + '.*')
+            temp_files.sort(key=lambda filename: filename.endswith('.index'))
+            for temp_file in temp_files:
+                tf.gfile.Rename(temp_file, checkpoint_path + temp_file[len(temp_path):], overwrite=True)
+
+            self._record_checkpoint(checkpoint_path)
+            tf.train.update_checkpoint_state(os.path.dirname(checkpoint_path), checkpoint_path,
+                                             all_model_checkpoint_paths=[path for path, _ in self._async_checkpoints],
+                                             latest_filename=latest_filename)
+
+            tf.logging.info('Saved checkpoint %s in %.1f seconds' % (checkpoint_path, time.time() - start_time))
+
+        except Exception as e:
+            tf.logging.error('Failed to save checkpoint %s: %s' % (checkpoint_path, e))
+            self._error = e
+
+    def _record_checkpoint(self, checkpoint_path):
+        """ Add a checkpoint, and delete the old ones (see `tf.train.Saver`).
+        """
+        self._async_checkpoints = [(path, t) for path, t in self._async_checkpoints if path != checkpoint_path]
+        self._async_checkpoints.append((checkpoint_path, time.time()))
+
+        if not self._async_max_to_keep:
+            return
+        while len(self._async_checkpoints) > self._async_max_to_keep:
+            path, t = self._async_checkpoints.pop(0)
+            if t > self._next_keep_time:
+                self._next_keep_time += self._keep_every_n_secs
+                continue
+            for filename in tf.gfile.Glob(path + '.*'):
+                tf.gfile.Remove(filename)
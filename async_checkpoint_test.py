@@ -0,0 +1,70 @@
+"""Tests for async_checkpoint.py."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+import tensorflow as tf
+
+import async_checkpoint
+
+
+class AsyncSaverTest(tf.test.TestCase):
+
+  def testSaveAndRestore(self):
+    logdir = os.path.join(self.get_temp_dir(), 'save_and_restore')
+    tf.gfile.MakeDirs(logdir)
+    save_path = os.path.join(logdir, 'model.ckpt')
+    with tf.Graph().as_default():
+      global_step = tf.train.get_or_create_global_step()
+      var = tf.Variable([1., 2.], name='var')
+      saver = async_checkpoint.AsyncSaver(max_to_keep=1)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self.assertEqual(saver.save(sess, save_path, global_step=global_step), save_path + '-0')
+
+        # The snapshot is taken before `save` returns
+        sess.run([var.assign([3., 4.]), global_step.assign(1)])
+        saver.save(sess, save_path, global_step=global_step)
+        sess.run(var.assign([5., 6.]))
+        saver.wait()
+
+        self.assertEqual(tf.train.latest_checkpoint(logdir), save_path + '-1')
+        # The first checkpoint was deleted (max_to_keep=1) and no temporary files are left
+        self.assertEqual(tf.gfile.Glob(save_path + '-0*'), [])
+        self.assertEqual(tf.gfile.Glob(os.path.join(logdir, '*' + async_checkpoint.TEMP_SUFFIX + '*')), [])
+
+        saver.restore(sess, save_path + '-1')
+        self.assertAllClose(sess.run(var), [3., 4.])
+        self.assertEqual(sess.run(global_step), 1)
+
+  def testConcurrentAndFinalSaves(self):
+    logdir = os.path.join(self.get_temp_dir(), 'concurrent_and_final_saves')
+    tf.gfile.MakeDirs(logdir)
+    save_path = os.path.join(logdir, 'model.ckpt')
+    with tf.Graph().as_default():
+      tf.Variable([1., 2.], name='var')
+      saver = async_checkpoint.AsyncSaver(max_to_keep=10)
+      train_step_fn = saver.wrap_train_step_fn(lambda sess, train_op, global_step, kwargs: (0., True))
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        threads = [threading.Thread(target=saver.save, args=(sess, save_path, step)) for step in range(4)]
+        for thread in threads:
+          thread.start()
+        for thread in threads:
+          thread.join()
+        saver.wait()
+        self.assertEqual(len(tf.gfile.Glob(save_path + '-*.index')), 4)
+
+        # After the last step, the checkpoint is written before `save` returns
+        train_step_fn(sess, None, None, {})
+        saver.save(sess, save_path, global_step=4)
+        self.assertTrue(tf.gfile.Exists(save_path + '-4.index'))
+        self.assertEqual(tf.train.latest_checkpoint(logdir), save_path + '-4')
+
+
+if __name__ == '__main__':
+  tf.test.main()
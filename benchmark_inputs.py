@@ -0,0 +1,341 @@
+"""
+Measure the throughput of the input pipeline, without a model.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import copy
+import itertools
+import json
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from config.parse_config import parse_config_file
+from preprocessing import inputs
+from preprocessing.decode_example import decode_serialized_example
+
+def benchmark_pipeline(tfrecords, cfg, num_batches, num_warmup_batches=10, queue_sample_every=10, read_images=False):
+    """
+    Drain batches from the input pipeline and time them.
+    Returns:
+        dictionary with the images / sec, the mean time per batch, and the queue fill levels over time.
+    """
+
+    graph = tf.Graph()
+
+    with graph.as_default():
+
+        with tf.device('/cpu:0'):
+            batch_dict = inputs.input_nodes(
+                tfrecords=tfrecords,
+                cfg=cfg.IMAGE_PROCESSING,
+                num_epochs=None,
+                batch_size=cfg.BATCH_SIZE,
+                num_threads=cfg.NUM_INPUT_THREADS,
+                shuffle_batch =cfg.SHUFFLE_QUEUE,
+                random_seed=cfg.RANDOM_SEED,
+                capacity=cfg.QUEUE_CAPACITY,
+                min_after_dequeue=cfg.QUEUE_MIN,
+                add_summaries=False,
+                input_type='train',
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                region_cache_cfg=cfg.REGION_CACHE if 'REGION_CACHE' in cfg else None,
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES,
+                num_examples=cfg.NUM_TRAIN_EXAMPLES
+            )
+
+        fill_ops = inputs.queue_fill_ops(graph)
+
+        coord = tf.train.Coordinator()
+
+        session_cfg = cfg.SESSION_CONFIG if 'SESSION_CONFIG' in cfg else {}
+        sess_config = tf.ConfigProto(
+            intra_op_parallelism_threads=session_cfg.INTRA_OP_PARALLELISM_THREADS if 'INTRA_OP_PARALLELISM_THREADS' in session_cfg else None,
+            inter_op_parallelism_threads=session_cfg.INTER_OP_PARALLELISM_THREADS if 'INTER_OP_PARALLELISM_THREADS' in session_cfg else None
+        )
+        sess = tf.Session(graph=graph, config=sess_config)
+
+        with sess.as_default():
+
+            tf.global_variables_initializer().run()
+            tf.local_variables_initializer().run()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+
+            for step in range(num_warmup_batches):
+                sess.run(batch_dict)
+
+            batch_times = []
+            queue_fill = {name : [] for name in fill_ops}
+
+            start_time = time.time()
+            for step in range(num_batches):
+
+                t = time.time()
+                sess.run(batch_dict)
+                batch_times.append(time.time() - t)
+
+                if len(fill_ops) > 0 and step % queue_sample_every == 0:
+                    fills = sess.run(fill_ops)
+                    for name, fill in fills.items():
+                        queue_fill[name].append((time.time() - start_time, float(fill)))
+            total_time = time.time() - start_time
+
+            coord.request_stop()
+            coord.join(threads, stop_grace_period_secs=5)
+
+        sess.close()
+
+    return {
+        'images_per_sec' : num_batches * cfg.BATCH_SIZE / total_time,
+        'batch_ms' : float(np.mean(batch_times) * 1000),
+        'queue_fill' : queue_fill
+    }
+
+def measure_stage_latencies(tfrecords, cfg, num_examples, read_images=False):
+    """
+    Time each stage of the preprocessing for single examples. Each stage is run on its own
+    and fed the output of the previous stage, so the times don't include any overlap between
+    stages. The whole image is treated as the region.
+    Returns:
+        dictionary mapping stage name to the mean latency in milliseconds
+    """
+
+    image_cfg = cfg.IMAGE_PROCESSING
+    input_size = image_cfg.INPUT_SIZE
+
+    graph = tf.Graph()
+
+    with graph.as_default():
+
+        serialized_example = tf.placeholder(tf.string, shape=[])
+        features_to_extract = inputs.get_region_features_to_extract(
+            image_cfg, fetch_ids=False, fetch_labels=True, fetch_text_labels=False, read_filename=read_images)
+        parsed_features = decode_serialized_example(serialized_example, features_to_extract, decode_image=False)
+
+        filename = tf.placeholder(tf.string, shape=[])
+        file_contents = tf.read_file(filename)
+
+        encoded_image = tf.placeholder(tf.string, shape=[])
+        decoded_image = tf.image.decode_jpeg(encoded_image, channels=3)
+
+        image = tf.placeholder(tf.uint8, shape=[None, None, 3])
+        cropped_image = tf.image.convert_image_dtype(image, dtype=tf.float32)
+        if image_cfg.DO_RANDOM_CROP > 0:
+            rc_cfg = image_cfg.RANDOM_CROP_CFG
+            cropped_image, _ = inputs.distorted_bounding_box_crop(
+                cropped_image,
+                tf.constant([0.0, 0.0, 1.0, 1.0], dtype=tf.float32, shape=[1, 1, 4]),
+                aspect_ratio_range=(rc_cfg.MIN_ASPECT_RATIO, rc_cfg.MAX_ASPECT_RATIO),
+                area_range=(rc_cfg.MIN_AREA, rc_cfg.MAX_AREA),
+                max_attempts=rc_cfg.MAX_ATTEMPTS)
+        if image_cfg.DO_CENTRAL_CROP > 0:
+            cropped_image = tf.image.central_crop(cropped_image, image_cfg.CENTRAL_CROP_FRACTION)
+
+        crop = tf.placeholder(tf.float32, shape=[None, None, 3])
+        num_resize_cases = 1 if image_cfg.RESIZE_FAST else 4
+        resized_image = inputs.apply_with_random_selector(
+            crop,
+            lambda x, method: tf.image.resize_images(x, [input_size, input_size], method=method),
+            num_cases=num_resize_cases)
+
+        resized = tf.placeholder(tf.float32, shape=[input_size, input_size, 3])
+        distorted_image = resized
+        if image_cfg.DO_RANDOM_FLIP_LEFT_RIGHT:
+            distorted_image = tf.image.random_flip_left_right(distorted_image)
+        num_color_cases = 1 if image_cfg.COLOR_DISTORT_FAST else 4
+        distorted_image = inputs.apply_with_random_selector(
+            distorted_image,
+            lambda x, ordering: inputs.distort_color(x, ordering, fast_mode=image_cfg.COLOR_DISTORT_FAST),
+            num_cases=num_color_cases)
+
+        sess = tf.Session(graph=graph)
+
+        latencies = {stage : [] for stage in ['read', 'parse', 'decode', 'crop', 'resize', 'color']}
+
+        def timed(stage, fn):
+            t = time.time()
+            output = fn()
+            latencies[stage].append(time.time() - t)
+            return output
+
+        num_timed = 0
+        for tfrecord in tfrecords:
+            record_iterator = tf.python_io.tf_record_iterator(tfrecord)
+            while num_timed < num_examples:
+
+                # Only time the reads that return a record, the end of the file is not a read
+                t = time.time()
+                record = next(record_iterator, None)
+                if record is None:
+                    break
+                latencies['read'].append(time.time() - t)
+
+                features = timed('parse', lambda: sess.run(parsed_features, {serialized_example : record}))
+                if read_images:
+                    t = time.time()
+                    features['image'] = sess.run(file_contents, {filename : features['filename']})
+                    latencies['read'][-1] += time.time() - t
+
+                img = timed('decode', lambda: sess.run(decoded_image, {encoded_image : features['image']}))
+                img = timed('crop', lambda: sess.run(cropped_image, {image : img}))
+                img = timed('resize', lambda: sess.run(resized_image, {crop : img}))
+                timed('color', lambda: sess.run(distorted_image, {resized : img}))
+
+                num_timed += 1
+
+            if num_timed >= num_examples:
+                break
+
+        sess.close()
+
+    return {stage : float(np.mean(times) * 1000) for stage, times in latencies.items() if len(times) > 0}
+
+def run_sweep(tfrecords, cfg, num_batches, num_warmup_batches, queue_sample_every, num_threads_list,
+              queue_capacities, resize_fast_list, color_distort_fast_list, read_images=False):
+    """
+    Benchmark the input pipeline for each combination of the swept settings.
+    """
+
+    results = []
+    for num_threads, queue_capacity, resize_fast, color_distort_fast in itertools.product(
+            num_threads_list, queue_capacities, resize_fast_list, color_distort_fast_list):
+
+        run_cfg = copy.deepcopy(cfg)
+        run_cfg.NUM_INPUT_THREADS = num_threads
+        run_cfg.QUEUE_CAPACITY = queue_capacity
+        run_cfg.QUEUE_MIN = min(run_cfg.QUEUE_MIN, queue_capacity)
+        run_cfg.IMAGE_PROCESSING.RESIZE_FAST = resize_fast
+        run_cfg.IMAGE_PROCESSING.COLOR_DISTORT_FAST = color_distort_fast
+
+        settings = {
+            'NUM_INPUT_THREADS' : num_threads,
+            'QUEUE_CAPACITY' : queue_capacity,
+            'RESIZE_FAST' : resize_fast,
+            'COLOR_DISTORT_FAST' : color_distort_fast
+        }
+        print("Benchmarking %s" % (', '.join(['%s=%s' % (k, v) for k, v in sorted(settings.items())]),))
+
+        result = benchmark_pipeline(tfrecords, run_cfg, num_batches, num_warmup_batches,
+                                    queue_sample_every, read_images=read_images)
+        result['settings'] = settings
+        results.append(result)
+
+        print('Images/sec: %.1f, Time/batch (ms): %.1f' % (result['images_per_sec'], result['batch_ms']))
+        for name, fills in sorted(result['queue_fill'].items()):
+            fill_values = [fill for _, fill in fills]
+            print('  Queue %s: mean fill %.2f, min fill %.2f, final fill %.2f' % (
+                name, np.mean(fill_values), np.min(fill_values), fill_values[-1]))
+
+    return results
+
+def parse_bool(value):
+    return value.lower() in ('true', '1', 'yes')
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Measure the throughput of the input pipeline, without a model.')
+
+    parser.add_argument('--tfrecords', dest='tfrecords',
+                        help='Paths to tfrecord files.', type=str,
+                        nargs='+', required=True)
+
+    parser.add_argument('--config', dest='config_file',
+                        help='Path to the configuration file',
+                        required=True, type=str)
+
+    parser.add_argument('--batches', dest='batches',
+                        help='The number of batches to time for each setting.',
+                        required=False, type=int, default=100)
+
+    parser.add_argument('--warmup_batches', dest='warmup_batches',
+                        help='The number of batches to run before timing (e.g. to fill the queues).',
+                        required=False, type=int, default=10)
+
+    parser.add_argument('--queue_sample_every', dest='queue_sample_every',
+                        help='Sample the queue fill levels every N batches.',
+                        required=False, type=int, default=10)
+
+    parser.add_argument('--stage_examples', dest='stage_examples',
+                        help='The number of examples to use when timing the individual stages. 0 skips the per stage timing.',
+                        required=False, type=int, default=50)
+
+    parser.add_argument('--num_threads', dest='num_threads',
+                        help='Values of NUM_INPUT_THREADS to sweep. Defaults to the config value.',
+                        type=int, nargs='+', required=False, default=None)
+
+    parser.add_argument('--queue_capacities', dest='queue_capacities',
+                        help='Values of QUEUE_CAPACITY to sweep. Defaults to the config value.',
+                        type=int, nargs='+', required=False, default=None)
+
+    parser.add_argument('--resize_fast', dest='resize_fast',
+                        help='Values of RESIZE_FAST to sweep (true / false). Defaults to the config value.',
+                        type=parse_bool, nargs='+', required=False, default=None)
+
+    parser.add_argument('--color_distort_fast', dest='color_distort_fast',
+                        help='Values of COLOR_DISTORT_FAST to sweep (true / false). Defaults to the config value.',
+                        type=parse_bool, nargs='+', required=False, default=None)
+
+    parser.add_argument('--batch_size', dest='batch_size',
+                        help='The number of images in a batch.',
+                        required=False, type=int, default=None)
+
+    parser.add_argument('--read_images', dest='read_images',
+                        help='Read the images from the file system using the `filename` field rather than using the `encoded` field of the tfrecord.',
+                        action='store_true', default=False)
+
+    parser.add_argument('--save_path', dest='save_path',
+                        help='If provided, then the results are saved to this file as json.',
+                        required=False, type=str, default=None)
+
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+    cfg = parse_config_file(args.config_file)
+
+    if args.batch_size != None:
+        cfg.BATCH_SIZE = args.batch_size
+
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    stage_latencies = {}
+    if args.stage_examples > 0:
+        stage_latencies = measure_stage_latencies(args.tfrecords, cfg, args.stage_examples, read_images=args.read_images)
+        print('Per example stage latency (ms):')
+        for stage in ['read', 'parse', 'decode', 'crop', 'resize', 'color']:
+            if stage in stage_latencies:
+                print('  %s: %.2f' % (stage, stage_latencies[stage]))
+
+    results = run_sweep(
+        tfrecords=args.tfrecords,
+        cfg=cfg,
+        num_batches=args.batches,
+        num_warmup_batches=args.warmup_batches,
+        queue_sample_every=args.queue_sample_every,
+        num_threads_list=args.num_threads if args.num_threads != None else [cfg.NUM_INPUT_THREADS],
+        queue_capacities=args.queue_capacities if args.queue_capacities != None else [cfg.QUEUE_CAPACITY],
+        resize_fast_list=args.resize_fast if args.resize_fast != None else [cfg.IMAGE_PROCESSING.RESIZE_FAST],
+        color_distort_fast_list=args.color_distort_fast if args.color_distort_fast != None else [cfg.IMAGE_PROCESSING.COLOR_DISTORT_FAST],
+        read_images=args.read_images
+    )
+
+    if len(results) > 0:
+        # The batch stage is the time to dequeue a batch from the full pipeline
+        stage_latencies['batch'] = results[0]['batch_ms']
+        print('Batch (ms, first setting): %.2f' % (stage_latencies['batch'],))
+
+    if args.save_path != None:
+        with open(args.save_path, 'w') as f:
+            json.dump({'stage_latencies_ms' : stage_latencies, 'results' : results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+A memory mapped store of network features (bottlenecks) for training the final layer of a
+network without running the rest of it (see `train.train_on_cached_bottlenecks`).
+
+Each store lives in its own sub directory of `CACHE_DIR`. The name of the sub directory is a
+hash of the tfrecord files, the configuration and the values of the variables that the
+features are computed from, so changing any of them results in a new store.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import tensorflow as tf
+
+FEATURES_FILE = 'features.bin'
+LABELS_FILE = 'labels.bin'
+# Written last, so a store without it is incomplete
+INFO_FILE = 'info.json'
+
+
+def variables_read_by(tensor, variables):
+    """ Return the variables in `variables` that are used to compute `tensor`.
+    """
+    visited = set()
+    to_visit = [tensor.op]
+    while len(to_visit) > 0:
+        op = to_visit.pop()
+        if op in visited:
+            continue
+        visited.add(op)
+        to_visit.extend([t.op for t in op.inputs])
+        to_visit.extend(op.control_inputs)
+
+    return [var for var in variables if var.op in visited]
+
+def has_dropout_between(bottleneck, tensor):
+    """ Is dropout (a random op) applied between `bottleneck` and `tensor`? The ops that are only
+    reached through `bottleneck` are not considered.
+    """
+    visited = set([bottleneck.op])
+    to_visit = [tensor.op]
+    while len(to_visit) > 0:
+        op = to_visit.pop()
+        if op in visited:
+            continue
+        visited.add(op)
+        if op.type in ('RandomUniform', 'RandomStandardNormal'):
+            return True
+        to_visit.extend([t.op for t in op.inputs])
+        to_visit.extend(op.control_inputs)
+    return False
+
+def variables_digest(sess, variables):
+    """ A hash of the values of `variables`.
+    """
+    variables = sorted(variables, key=lambda var: var.op.name)
+    digest = hashlib.sha1()
+    for var, value in zip(variables, sess.run(variables)):
+        digest.update(var.op.name.encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
+def store_key(tfrecords, key_info):
+    """ A hash of the tfrecord files and `key_info` (a json serializable dict).
+    """
+    tfrecord_info = []
+    for tfrecord in sorted(tfrecords):
+        stat = os.stat(tfrecord)
+        tfrecord_info.append([os.path.abspath(tfrecord), stat.st_size, int(stat.st_mtime)])
+
+    key_info = dict(key_info, tfrecords=tfrecord_info)
+
+    return hashlib.sha1(json.dumps(key_info, sort_keys=True).encode('utf-8')).hexdigest()
+
+def is_complete(store_dir):
+    return os.path.exists(os.path.join(store_dir, INFO_FILE))
+
+def write_feature_store(store_dir, batches):
+    """ Write the features and labels to `store_dir`.
+    Args:
+        batches: an iterable of (features, labels) numpy arrays, batched along the first dimension
+    Returns:
+        the number of stored examples
+    """
+    if os.path.isdir(store_dir):
+        # A previous run stopped before finishing the store
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+
+    num_examples = 0
+    feature_shape = None
+    with open(os.path.join(store_dir, FEATURES_FILE), 'wb') as features_file, \
+         open(os.path.join(store_dir, LABELS_FILE), 'wb') as labels_file:
+        for features, labels in batches:
+            if feature_shape is None:
+                feature_shape = list(features.shape[1:])
+            features_file.write(np.ascontiguousarray(features, dtype=np.float32).tobytes())
+            labels_file.write(np.ascontiguousarray(labels, dtype=np.int64).tobytes())
+            num_examples += features.shape[0]
+
+    if num_examples == 0:
+        raise ValueError("No features were extracted for the bottleneck cache.")
+
+    with open(os.path.join(store_dir, INFO_FILE), 'w') as f:
+        json.dump({'num_examples' : num_examples, 'feature_shape' : feature_shape}, f)
+
+    return num_examples
+
+def load_feature_store(store_dir):
+    """ Memory map a store written by `write_feature_store`.
+    Returns:
+        the features, a float32 array of shape [num_examples] + feature_shape, and the labels,
+        an int64 array of shape [num_examples]
+    """
+    with open(os.path.join(store_dir, INFO_FILE)) as f:
+        info = json.load(f)
+
+    num_examples = info['num_examples']
+    features = np.memmap(os.path.join(store_dir, FEATURES_FILE), dtype=np.float32, mode='r',
+                         shape=tuple([num_examples] + info['feature_shape']))
+    labels = np.memmap(os.path.join(store_dir, LABELS_FILE), dtype=np.int64, mode='r',
+                       shape=(num_examples,))
+
+    return features, labels
+
+def random_batches(features, labels, batch_size, rng, keep_prob=1.):
+    """ Yield batches of (features, labels) forever, going through the examples in a new random
+    order every epoch. If `keep_prob` < 1, then dropout is applied to the features.
+    """
+    num_examples = features.shape[0]
+    if num_examples < batch_size:
+        raise ValueError("The bottleneck cache has fewer examples (%d) than the batch size (%d)." % (num_examples, batch_size))
+
+    while True:
+        order = rng.permutation(num_examples)
+        for start in range(0, num_examples - batch_size + 1, batch_size):
+            # Sorted indices read the memory mapped file in order
+            indices = np.sort(order[start:start + batch_size])
+            batch_features = features[indices]
+            if keep_prob < 1.:
+                batch_features = batch_features * (rng.uniform(size=batch_features.shape) < keep_prob) / keep_prob
+            yield batch_features, labels[indices]
@@ -13,8 +13,9 @@ import tensorflow.contrib.slim as slim
 from config.parse_config import parse_config_file
 from nets import nets_factory
 from preprocessing import inputs
+import profiling
 
-def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits, cfg, read_images=False):
+def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits, cfg, read_images=False, profiler=None):
     """
     Args:
         tfrecords (list)
@@ -23,6 +24,7 @@ def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits,
         max_iterations (int)
         save_logits (bool)
         cfg (EasyDict)
+        profiler (profiling.Profiler) : If provided, then trace the classification steps.
     """
     tf.logging.set_verbosity(tf.logging.DEBUG)
 
@@ -45,14 +47,20 @@ def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits,
                 min_after_dequeue=cfg.QUEUE_MIN,
                 add_summaries=False,
                 input_type='classification',
-                read_filenames=read_images
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES
             )
 
         arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME]()
 
-        with slim.arg_scope(arg_scope):
-            logits, end_points = nets_factory.networks_map[cfg.MODEL_NAME](
-                inputs=batch_dict['inputs'],
+        xla_jit_scope = 'XLA_JIT_SCOPE' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT_SCOPE
+        precision = cfg.PRECISION.DTYPE if 'PRECISION' in cfg else 'float32'
+        with slim.arg_scope(arg_scope), nets_factory.jit_scope(xla_jit_scope):
+            logits, end_points = nets_factory.precision_network(cfg.MODEL_NAME, precision)(
+                inputs=inputs.normalize_inputs(batch_dict['inputs']),
                 num_classes=cfg.NUM_CLASSES,
                 is_training=False
             )
@@ -101,6 +109,11 @@ def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits,
                 intra_op_parallelism_threads=cfg.SESSION_CONFIG.INTRA_OP_PARALLELISM_THREADS if 'INTRA_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None,
                 inter_op_parallelism_threads=cfg.SESSION_CONFIG.INTER_OP_PARALLELISM_THREADS if 'INTER_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None
             )
+
+        # Compile the graph with XLA
+        if 'XLA_JIT' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT:
+            sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
         sess = tf.Session(graph=graph, config=sess_config)
 
         with sess.as_default():
@@ -123,7 +136,11 @@ def classify(tfrecords, checkpoint_path, save_path, max_iterations, save_logits,
                 while not coord.should_stop():
 
                     t = time.time()
-                    outputs = sess.run(fetches)
+                    if profiler is not None:
+                        profiler.begin_step()
+                        outputs = profiler.run(sess, fetches)
+                    else:
+                        outputs = sess.run(fetches)
                     dt = time.time()-t
 
                     idx1 = cfg.BATCH_SIZE * step
@@ -192,6 +209,17 @@ def parse_args():
                         help='Read the images from the file system using the `filename` field rather than using the `encoded` field of the tfrecord.',
                         action='store_true', default=False)
 
+    parser.add_argument('--profile_dir', dest='profile_dir',
+                        help='If provided, then trace --profile_steps steps (after skipping --profile_start_step steps) and save the chrome timelines and the per op time and memory tables to this directory.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--profile_start_step', dest='profile_start_step',
+                        help='The number of steps to run before tracing with --profile_dir.',
+                        required=False, type=int, default=10)
+
+    parser.add_argument('--profile_steps', dest='profile_steps',
+                        help='The number of steps to trace with --profile_dir.',
+                        required=False, type=int, default=5)
 
     args = parser.parse_args()
     return args
@@ -207,6 +235,10 @@ def main():
     if args.model_name != None:
         cfg.MODEL_NAME = args.model_name
 
+    profiler = None
+    if args.profile_dir != None:
+        profiler = profiling.Profiler(args.profile_dir, start_step=args.profile_start_step, num_steps=args.profile_steps)
+
     classify(
         tfrecords=args.tfrecords,
         checkpoint_path=args.checkpoint_path,
@@ -214,7 +246,8 @@ def main():
         max_iterations=args.batches,
         save_logits=args.save_logits,
         cfg=cfg,
-        read_images=args.read_images
+        read_images=args.read_images,
+        profiler=profiler
     )
 
 if __name__ == '__main__':
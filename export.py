@@ -168,8 +168,10 @@ def export(checkpoint_path,
 
         arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME]()
 
-        with slim.arg_scope(arg_scope):
-            logits, end_points = nets_factory.networks_map[cfg.MODEL_NAME](
+        xla_jit_scope = 'SESSION_CONFIG' in cfg and 'XLA_JIT_SCOPE' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT_SCOPE
+        precision = cfg.PRECISION.DTYPE if 'PRECISION' in cfg else 'float32'
+        with slim.arg_scope(arg_scope), nets_factory.jit_scope(xla_jit_scope):
+            logits, end_points = nets_factory.precision_network(cfg.MODEL_NAME, precision)(
                 inputs=images,
                 num_classes=cfg.NUM_CLASSES,
                 is_training=False
@@ -217,6 +219,11 @@ def export(checkpoint_path,
                 per_process_gpu_memory_fraction=cfg.SESSION_CONFIG.PER_PROCESS_GPU_MEMORY_FRACTION
             )
         )
+
+        # Compile the graph with XLA
+        if 'SESSION_CONFIG' in cfg and 'XLA_JIT' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT:
+            sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
         sess = tf.Session(graph=graph, config=sess_config)
 
         if export_for_serving:
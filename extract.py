@@ -17,8 +17,9 @@ import tensorflow.contrib.slim as slim
 from config.parse_config import parse_config_file
 from nets import nets_factory
 from preprocessing import inputs
+import profiling
 
-def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, cfg, read_images=False):
+def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, cfg, read_images=False, profiler=None):
     """
     Extract and return the features
     """
@@ -44,14 +45,20 @@ def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, c
                 min_after_dequeue=cfg.QUEUE_MIN,
                 add_summaries=False,
                 input_type='classification',
-                read_filenames=read_images
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES
             )
 
         arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME]()
 
-        with slim.arg_scope(arg_scope):
-            logits, end_points = nets_factory.networks_map[cfg.MODEL_NAME](
-                inputs=batch_dict['inputs'],
+        xla_jit_scope = 'XLA_JIT_SCOPE' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT_SCOPE
+        precision = cfg.PRECISION.DTYPE if 'PRECISION' in cfg else 'float32'
+        with slim.arg_scope(arg_scope), nets_factory.jit_scope(xla_jit_scope):
+            logits, end_points = nets_factory.precision_network(cfg.MODEL_NAME, precision)(
+                inputs=inputs.normalize_inputs(batch_dict['inputs']),
                 num_classes=cfg.NUM_CLASSES,
                 is_training=False
             )
@@ -104,6 +111,10 @@ def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, c
                     per_process_gpu_memory_fraction=cfg.SESSION_CONFIG.PER_PROCESS_GPU_MEMORY_FRACTION
                 )
             )
+
+        # Compile the graph with XLA
+        if 'XLA_JIT' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT:
+            sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
         sess = tf.Session(graph=graph, config=sess_config)
 
         with sess.as_default():
@@ -126,7 +137,11 @@ def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, c
                 while not coord.should_stop():
 
                     t = time.time()
-                    outputs = sess.run(fetches)
+                    if profiler is not None:
+                        profiler.begin_step()
+                        outputs = profiler.run(sess, fetches)
+                    else:
+                        outputs = sess.run(fetches)
                     dt = time.time()-t
 
                     idx1 = cfg.BATCH_SIZE * step
@@ -152,7 +167,7 @@ def extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, c
 
         return feature_dict
 
-def extract_and_save(tfrecords, checkpoint_path, save_path, num_iterations, feature_keys, cfg, read_images=False):
+def extract_and_save(tfrecords, checkpoint_path, save_path, num_iterations, feature_keys, cfg, read_images=False, profiler=None):
     """Extract and save the features
     Args:
         tfrecords (list)
@@ -163,7 +178,7 @@ def extract_and_save(tfrecords, checkpoint_path, save_path, num_iterations, feat
         cfg (EasyDict)
     """
 
-    feature_dict = extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, cfg, read_images=read_images)
+    feature_dict = extract_features(tfrecords, checkpoint_path, num_iterations, feature_keys, cfg, read_images=read_images, profiler=profiler)
 
     # save the results
     np.savez(save_path, **feature_dict)
@@ -209,7 +224,17 @@ def parse_args():
                         help='Read the images from the file system using the `filename` field rather than using the `encoded` field of the tfrecord.',
                         action='store_true', default=False)
 
+    parser.add_argument('--profile_dir', dest='profile_dir',
+                        help='If provided, then trace --profile_steps steps (after skipping --profile_start_step steps) and save the chrome timelines and the per op time and memory tables to this directory.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--profile_start_step', dest='profile_start_step',
+                        help='The number of steps to run before tracing with --profile_dir.',
+                        required=False, type=int, default=10)
 
+    parser.add_argument('--profile_steps', dest='profile_steps',
+                        help='The number of steps to trace with --profile_dir.',
+                        required=False, type=int, default=5)
 
     args = parser.parse_args()
     return args
@@ -225,6 +250,10 @@ def main():
     if args.model_name != None:
         cfg.MODEL_NAME = args.model_name
 
+    profiler = None
+    if args.profile_dir != None:
+        profiler = profiling.Profiler(args.profile_dir, start_step=args.profile_start_step, num_steps=args.profile_steps)
+
     extract_and_save(
         tfrecords=args.tfrecords,
         checkpoint_path=args.checkpoint_path,
@@ -232,7 +261,8 @@ def main():
         num_iterations=args.batches,
         feature_keys=args.features,
         cfg=cfg,
-        read_images=args.read_images
+        read_images=args.read_images,
+        profiler=profiler
     )
 
 if __name__ == '__main__':
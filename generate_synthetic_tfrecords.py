@@ -0,0 +1,222 @@
+"""
+Write tfrecords of random images (with random labels and bounding boxes) for performance tests.
+The examples have the same format as the tfrecords produced by the Visipedia tfrecords repo.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+
+import numpy as np
+import tensorflow as tf
+
+def _int64_feature(values):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=values))
+
+def _float_feature(values):
+    return tf.train.Feature(float_list=tf.train.FloatList(value=values))
+
+def _bytes_feature(values):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[v.encode('utf-8') if not isinstance(v, bytes) else v for v in values]))
+
+def random_image(height, width, rng):
+    """ A smooth random image (a low resolution noise image that is upsampled), plus a little
+    noise. This compresses to roughly the size of a natural image, unlike pure noise.
+    """
+    low_res = rng.randint(0, 256, size=(max(1, height // 32), max(1, width // 32), 3)).astype(np.float32)
+    rows = (np.arange(height) * low_res.shape[0] // height)
+    cols = (np.arange(width) * low_res.shape[1] // width)
+    image = low_res[rows][:, cols]
+    image += rng.normal(0, 8, size=image.shape)
+    return np.clip(image, 0, 255).astype(np.uint8)
+
+def random_boxes(num_boxes, rng, min_box_size=0.1):
+    """ Returns normalized xmin, ymin, xmax, ymax arrays.
+    """
+    widths = rng.uniform(min_box_size, 1., size=num_boxes)
+    heights = rng.uniform(min_box_size, 1., size=num_boxes)
+    xmin = rng.uniform(0., 1. - widths)
+    ymin = rng.uniform(0., 1. - heights)
+    return xmin, ymin, xmin + widths, ymin + heights
+
+def create_example(image_id, encoded_image, height, width, label, num_classes, num_boxes, rng):
+
+    xmin, ymin, xmax, ymax = random_boxes(num_boxes, rng)
+    box_labels = rng.randint(0, num_classes, size=num_boxes)
+    areas = (xmax - xmin) * (ymax - ymin) * height * width
+
+    feature = {
+        'image/height' : _int64_feature([height]),
+        'image/width' : _int64_feature([width]),
+        'image/colorspace' : _bytes_feature(['RGB']),
+        'image/channels' : _int64_feature([3]),
+        'image/format' : _bytes_feature(['JPEG']),
+        'image/filename' : _bytes_feature(['%s.jpg' % (image_id,)]),
+        'image/id' : _bytes_feature([image_id]),
+        'image/encoded' : _bytes_feature([encoded_image]),
+        'image/extra' : _bytes_feature(['']),
+        'image/class/label' : _int64_feature([label]),
+        'image/class/text' : _bytes_feature(['class_%d' % (label,)]),
+        'image/class/conf' : _float_feature([1.]),
+        'image/object/bbox/xmin' : _float_feature(xmin.tolist()),
+        'image/object/bbox/xmax' : _float_feature(xmax.tolist()),
+        'image/object/bbox/ymin' : _float_feature(ymin.tolist()),
+        'image/object/bbox/ymax' : _float_feature(ymax.tolist()),
+        'image/object/bbox/label' : _int64_feature(box_labels.tolist()),
+        'image/object/bbox/text' : _bytes_feature(['class_%d' % (l,) for l in box_labels]),
+        'image/object/bbox/conf' : _float_feature([1.] * num_boxes),
+        'image/object/bbox/score' : _float_feature([1.] * num_boxes),
+        'image/object/count' : _int64_feature([num_boxes]),
+        'image/object/area' : _float_feature(areas.tolist()),
+        'image/object/id' : _bytes_feature(['%s_%d' % (image_id, b) for b in range(num_boxes)])
+    }
+
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+def generate(output_dir, prefix, num_images, num_shards, num_classes, min_size, max_size,
+             min_aspect_ratio, max_aspect_ratio, jpeg_quality, min_boxes, max_boxes, seed):
+    """
+    Write `num_images` examples to `num_shards` tfrecord files. Image sizes are sampled so that
+    the longer side is uniform in [`min_size`, `max_size`] and the aspect ratio (width / height)
+    is uniform in [`min_aspect_ratio`, `max_aspect_ratio`].
+    """
+
+    rng = np.random.RandomState(seed)
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    graph = tf.Graph()
+    with graph.as_default():
+        image_placeholder = tf.placeholder(tf.uint8, shape=[None, None, 3])
+        encoded_image = tf.image.encode_jpeg(image_placeholder, format='rgb', quality=jpeg_quality)
+
+    sess = tf.Session(graph=graph)
+
+    shard_paths = []
+    image_index = 0
+    for shard in range(num_shards):
+
+        shard_path = os.path.join(output_dir, '%s-%05d-of-%05d' % (prefix, shard, num_shards))
+        shard_paths.append(shard_path)
+
+        # Spread the images evenly over the shards
+        num_shard_images = num_images // num_shards + (1 if shard < num_images % num_shards else 0)
+
+        with tf.python_io.TFRecordWriter(shard_path) as writer:
+            for i in range(num_shard_images):
+
+                longer_side = rng.randint(min_size, max_size + 1)
+                aspect_ratio = rng.uniform(min_aspect_ratio, max_aspect_ratio)
+                if aspect_ratio >= 1:
+                    width = longer_side
+                    height = max(1, int(round(longer_side / aspect_ratio)))
+                else:
+                    height = longer_side
+                    width = max(1, int(round(longer_side * aspect_ratio)))
+
+                image = random_image(height, width, rng)
+                encoded = sess.run(encoded_image, {image_placeholder : image})
+
+                example = create_example(
+                    image_id='synthetic_%d' % (image_index,),
+                    encoded_image=encoded,
+                    height=height,
+                    width=width,
+                    label=rng.randint(0, num_classes),
+                    num_classes=num_classes,
+                    num_boxes=rng.randint(min_boxes, max_boxes + 1),
+                    rng=rng
+                )
+                writer.write(example.SerializeToString())
+                image_index += 1
+
+        print('Wrote %d images to %s' % (num_shard_images, shard_path))
+
+    sess.close()
+
+    return shard_paths
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description='Write tfrecords of random images for performance tests.')
+
+    parser.add_argument('--output_dir', dest='output_dir',
+                        help='Directory to write the tfrecord files to.', type=str,
+                        required=True)
+
+    parser.add_argument('--prefix', dest='prefix',
+                        help='File name prefix of the tfrecord files.', type=str,
+                        required=False, default='synthetic')
+
+    parser.add_argument('--num_images', dest='num_images',
+                        help='The number of images to generate.', type=int,
+                        required=False, default=1000)
+
+    parser.add_argument('--num_shards', dest='num_shards',
+                        help='The number of tfrecord files to write.', type=int,
+                        required=False, default=4)
+
+    parser.add_argument('--num_classes', dest='num_classes',
+                        help='The number of classes.', type=int,
+                        required=False, default=200)
+
+    parser.add_argument('--min_size', dest='min_size',
+                        help='Minimum length (in pixels) of the longer side of the images.', type=int,
+                        required=False, default=300)
+
+    parser.add_argument('--max_size', dest='max_size',
+                        help='Maximum length (in pixels) of the longer side of the images.', type=int,
+                        required=False, default=500)
+
+    parser.add_argument('--min_aspect_ratio', dest='min_aspect_ratio',
+                        help='Minimum aspect ratio (width / height) of the images.', type=float,
+                        required=False, default=0.75)
+
+    parser.add_argument('--max_aspect_ratio', dest='max_aspect_ratio',
+                        help='Maximum aspect ratio (width / height) of the images.', type=float,
+                        required=False, default=1.33)
+
+    parser.add_argument('--jpeg_quality', dest='jpeg_quality',
+                        help='JPEG quality, between 0 and 100.', type=int,
+                        required=False, default=90)
+
+    parser.add_argument('--min_boxes', dest='min_boxes',
+                        help='Minimum number of bounding boxes per image.', type=int,
+                        required=False, default=1)
+
+    parser.add_argument('--max_boxes', dest='max_boxes',
+                        help='Maximum number of bounding boxes per image.', type=int,
+                        required=False, default=5)
+
+    parser.add_argument('--seed', dest='seed',
+                        help='Random seed, so that the same tfrecords can be regenerated.', type=int,
+                        required=False, default=1)
+
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+
+    generate(
+        output_dir=args.output_dir,
+        prefix=args.prefix,
+        num_images=args.num_images,
+        num_shards=args.num_shards,
+        num_classes=args.num_classes,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        min_aspect_ratio=args.min_aspect_ratio,
+        max_aspect_ratio=args.max_aspect_ratio,
+        jpeg_quality=args.jpeg_quality,
+        min_boxes=args.min_boxes,
+        max_boxes=args.max_boxes,
+        seed=args.seed
+    )
+
+if __name__ == '__main__':
+    main()
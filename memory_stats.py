@@ -0,0 +1,86 @@
+"""
+Measure memory use (see `STEP_STATS.LOG_MEMORY` in the training config, and the `--memory` and
+`--find_max_batch_size` modes of `nets/net_profile.py`).
+
+Device memory comes from the allocator of each device (`tf.contrib.memory_stats`). The allocator is
+shared by every session of the process, so its peak covers everything that the process has run.
+Host memory is the resident set size of the process.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import resource
+import sys
+
+import numpy as np
+import tensorflow as tf
+
+
+def _device_name(device):
+    """ '/gpu:0' -> 'gpu_0'
+    """
+    return device.strip('/').replace('device:', '').replace(':', '_').replace('/', '_').lower()
+
+def device_memory_ops(devices):
+    """ Create ops for the allocator statistics of each device (in bytes), e.g. for the
+    `tensors_to_log` of `step_stats.StepStats`. The devices need a memory stats kernel (GPUs do).
+    Returns:
+        a dictionary from names like 'memory/gpu_0/peak_bytes_in_use' to scalar tensors
+    """
+    memory_ops = {}
+    for device in devices:
+        name = _device_name(device)
+        with tf.device(device), tf.name_scope('memory_stats/%s' % name):
+            memory_ops['memory/%s/bytes_in_use' % name] = tf.contrib.memory_stats.BytesInUse()
+            memory_ops['memory/%s/peak_bytes_in_use' % name] = tf.contrib.memory_stats.MaxBytesInUse()
+            memory_ops['memory/%s/bytes_limit' % name] = tf.contrib.memory_stats.BytesLimit()
+    return memory_ops
+
+def host_memory():
+    """ The current and the peak resident set size of this process (in bytes).
+    Returns:
+        a dictionary with 'memory/host/rss_bytes' (None if it isn't available) and
+        'memory/host/peak_rss_bytes'
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on linux, bytes on mac
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    rss = None
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * resource.getpagesize()
+
+    return {
+        'memory/host/rss_bytes' : rss,
+        'memory/host/peak_rss_bytes' : peak_rss
+    }
+
+def end_point_sizes(end_points):
+    """ The size of each end point of a network (one copy of each activation).
+    Returns:
+        a list of (name, shape, bytes) for the end points with a fully defined shape, largest first
+    """
+    sizes = []
+    for name, tensor in end_points.items():
+        shape = tensor.get_shape()
+        if not shape.is_fully_defined():
+            continue
+        sizes.append((name, shape.as_list(), int(np.prod(shape.as_list())) * tensor.dtype.base_dtype.size))
+    sizes.sort(key=lambda size: -size[2])
+    return sizes
+
+def format_bytes(num_bytes):
+    """ '123.4 MB'
+    """
+    if num_bytes is None:
+        return 'n/a'
+    for unit in ('B', 'KB', 'MB'):
+        if abs(num_bytes) < 1024.:
+            return '%.1f %s' % (num_bytes, unit)
+        num_bytes /= 1024.
+    return '%.2f GB' % (num_bytes,)
@@ -0,0 +1,37 @@
+"""Tests for memory_stats.py."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+import memory_stats
+
+
+class MemoryStatsTest(tf.test.TestCase):
+
+  def testEndPointSizes(self):
+    end_points = {
+        'Conv': tf.zeros([2, 8, 8, 4]),
+        'Logits': tf.zeros([2, 10], dtype=tf.float16),
+        'Unknown': tf.placeholder(tf.float32, [None, 10])
+    }
+    self.assertEqual(memory_stats.end_point_sizes(end_points),
+                     [('Conv', [2, 8, 8, 4], 2048), ('Logits', [2, 10], 40)])
+
+  def testHostMemory(self):
+    memory = memory_stats.host_memory()
+    self.assertGreater(memory['memory/host/peak_rss_bytes'], 0)
+    if memory['memory/host/rss_bytes'] is not None:
+      self.assertLessEqual(memory['memory/host/rss_bytes'], memory['memory/host/peak_rss_bytes'])
+
+  def testFormatBytes(self):
+    self.assertEqual(memory_stats.format_bytes(512), '512.0 B')
+    self.assertEqual(memory_stats.format_bytes(3 * 1024 ** 2), '3.0 MB')
+    self.assertEqual(memory_stats.format_bytes(5 * 1024 ** 3), '5.00 GB')
+    self.assertEqual(memory_stats.format_bytes(None), 'n/a')
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,69 @@
+"""Recomputing the activations of the network blocks in the backward pass.
+
+Normally every activation of the forward pass is kept in memory until its
+gradient has been computed. In a `checkpointing_scope`, the blocks wrapped with
+`checkpointed` (the units of `resnet_utils.stack_blocks_dense` and the repeated
+blocks of inception_resnet_v2) only keep their inputs: their activations are
+recomputed from the inputs when the gradients are computed (see
+`tf.contrib.layers.recompute_grad`). This roughly costs one more forward pass per
+step, for much less activation memory.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+import functools
+
+import tensorflow as tf
+
+_checkpointing = [False]
+
+
+@contextlib.contextmanager
+def checkpointing_scope(enabled=True):
+  """Returns a context manager where the `checkpointed` blocks recompute their activations.
+
+  Args:
+    enabled: If `False`, then the blocks keep their activations as usual.
+  """
+  previous = _checkpointing[0]
+  _checkpointing[0] = enabled
+  try:
+    yield
+  finally:
+    _checkpointing[0] = previous
+
+
+def checkpointed(block_fn):
+  """Returns `block_fn` so that it recomputes its activations in a `checkpointing_scope`.
+
+  The block is called again when the gradients are computed. The batch norm
+  update ops of the recomputation are dropped from the `UPDATE_OPS` collection,
+  so that the moving averages are updated once per step. The variables of the
+  block must be created in the block (not reused), so build a single copy of the
+  network for training.
+
+  Args:
+    block_fn: A function `outputs = block_fn(inputs, *args, **kwargs)` with a
+      single input and output tensor, and no random ops (e.g. dropout).
+  """
+  @functools.wraps(block_fn)
+  def checkpointed_block_fn(inputs, *args, **kwargs):
+    if not _checkpointing[0]:
+      return block_fn(inputs, *args, **kwargs)
+
+    num_calls = [0]
+    def recomputable_fn(block_inputs):
+      recomputing = num_calls[0] > 0
+      num_calls[0] += 1
+      update_ops = tf.get_collection_ref(tf.GraphKeys.UPDATE_OPS)
+      num_update_ops = len(update_ops)
+      outputs = block_fn(block_inputs, *args, **kwargs)
+      if recomputing:
+        del update_ops[num_update_ops:]
+      return outputs
+
+    return tf.contrib.layers.recompute_grad(recomputable_fn)(inputs)
+  return checkpointed_block_fn
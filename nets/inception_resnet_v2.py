@@ -27,6 +27,9 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+from nets import gradient_checkpointing
+from nets import mixed_precision
+
 slim = tf.contrib.slim
 
 
@@ -169,7 +172,7 @@ def inception_resnet_v2(inputs, num_classes=1001, is_training=True,
                               tower_conv2_2, tower_pool_1])
 
         end_points['Mixed_5b'] = net
-        net = slim.repeat(net, 10, block35, scale=0.17)
+        net = slim.repeat(net, 10, gradient_checkpointing.checkpointed(block35), scale=0.17)
 
         # 17 x 17 x 1024
         with tf.variable_scope('Mixed_6a'):
@@ -189,7 +192,7 @@ def inception_resnet_v2(inputs, num_classes=1001, is_training=True,
           net = tf.concat(axis=3, values=[tower_conv, tower_conv1_2, tower_pool])
 
         end_points['Mixed_6a'] = net
-        net = slim.repeat(net, 20, block17, scale=0.10)
+        net = slim.repeat(net, 20, gradient_checkpointing.checkpointed(block17), scale=0.10)
 
         # Auxillary tower
         with tf.variable_scope('AuxLogits'):
@@ -231,7 +234,7 @@ def inception_resnet_v2(inputs, num_classes=1001, is_training=True,
 
         end_points['Mixed_7a'] = net
 
-        net = slim.repeat(net, 9, block8, scale=0.20)
+        net = slim.repeat(net, 9, gradient_checkpointing.checkpointed(block8), scale=0.20)
         net = block8(net, activation_fn=None)
 
         net = slim.conv2d(net, 1536, 1, scope='Conv2d_7b_1x1')
@@ -280,6 +283,6 @@ def inception_resnet_v2_arg_scope(weight_decay=0.00004,
     }
     # Set activation_fn and parameters for batch_norm.
     with slim.arg_scope([slim.conv2d], activation_fn=tf.nn.relu,
-                        normalizer_fn=slim.batch_norm,
+                        normalizer_fn=mixed_precision.batch_norm,
                         normalizer_params=batch_norm_params) as scope:
       return scope
@@ -26,6 +26,8 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+from nets import mixed_precision
+
 slim = tf.contrib.slim
 
 
@@ -54,7 +56,7 @@ def inception_arg_scope(weight_decay=0.00004,
       'updates_collections': tf.GraphKeys.UPDATE_OPS,
   }
   if use_batch_norm:
-    normalizer_fn = slim.batch_norm
+    normalizer_fn = mixed_precision.batch_norm
     normalizer_params = batch_norm_params
   else:
     normalizer_fn = None
@@ -0,0 +1,69 @@
+"""Building the networks with reduced precision (float16 or bfloat16) compute.
+
+The variables are stored in float32 (the master weights that the optimizer updates) and cast to
+the compute dtype when they are read, so the convolutions and the activations between the layers
+are in reduced precision. Batch norm normalizes in float32 (see `batch_norm`).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import contextlib
+
+import tensorflow as tf
+
+slim = tf.contrib.slim
+
+REDUCED_PRECISION_DTYPES = (tf.float16, tf.bfloat16)
+
+
+def compute_dtype(dtype):
+  """Returns the `tf.DType` for a dtype name (e.g. 'float16') or dtype.
+
+  Raises:
+    ValueError: If the dtype is not float32, float16 or bfloat16.
+  """
+  dtype = tf.as_dtype(dtype)
+  if dtype != tf.float32 and dtype not in REDUCED_PRECISION_DTYPES:
+    raise ValueError('Unsupported compute dtype %s. Options are float32, float16 and '
+                     'bfloat16.' % dtype.name)
+  return dtype
+
+
+@contextlib.contextmanager
+def float32_variables_scope(dtype):
+  """Returns a context manager where the variables requested in `dtype` are created in float32.
+
+  The variables are cast to `dtype` when they are read. The regularization
+  losses are computed on the float32 variables.
+
+  Args:
+    dtype: The reduced precision compute dtype.
+  """
+  def float32_variable_getter(getter, name, *args, **kwargs):
+    requested_dtype = kwargs.get('dtype')
+    if requested_dtype is None or tf.as_dtype(requested_dtype).base_dtype != dtype:
+      return getter(name, *args, **kwargs)
+    kwargs['dtype'] = tf.float32
+    variable = getter(name, *args, **kwargs)
+    return tf.cast(variable, dtype)
+
+  with tf.variable_scope(tf.get_variable_scope(), custom_getter=float32_variable_getter,
+                         auxiliary_name_scope=False):
+    yield
+
+
+def batch_norm(inputs, *args, **kwargs):
+  """`slim.batch_norm` for float32 or reduced precision inputs.
+
+  The batch norm parameters and moving averages are float32 variables (the
+  moving averages are updated in place, so they can't be cast), so reduced
+  precision inputs are normalized in float32 and the outputs are cast back. The
+  `slim.batch_norm` arg scopes apply as usual.
+  """
+  dtype = inputs.dtype.base_dtype
+  if dtype == tf.float32:
+    return slim.batch_norm(inputs, *args, **kwargs)
+  outputs = slim.batch_norm(tf.cast(inputs, tf.float32), *args, **kwargs)
+  return tf.cast(outputs, dtype)
@@ -110,6 +110,8 @@ import functools
 
 import tensorflow as tf
 
+from nets import mixed_precision
+
 slim = tf.contrib.slim
 
 # Conv and DepthSepConv namedtuple define layers of the MobileNet architecture
@@ -228,7 +230,7 @@ def mobilenet_v1_base(inputs,
           end_point = end_point_base
           net = slim.conv2d(net, depth(conv_def.depth), conv_def.kernel,
                             stride=conv_def.stride,
-                            normalizer_fn=slim.batch_norm,
+                            normalizer_fn=mixed_precision.batch_norm,
                             scope=end_point)
           end_points[end_point] = net
           if end_point == final_endpoint:
@@ -243,7 +245,7 @@ def mobilenet_v1_base(inputs,
                                       depth_multiplier=1,
                                       stride=layer_stride,
                                       rate=layer_rate,
-                                      normalizer_fn=slim.batch_norm,
+                                      normalizer_fn=mixed_precision.batch_norm,
                                       scope=end_point)
 
           end_points[end_point] = net
@@ -254,7 +256,7 @@ def mobilenet_v1_base(inputs,
 
           net = slim.conv2d(net, depth(conv_def.depth), [1, 1],
                             stride=1,
-                            normalizer_fn=slim.batch_norm,
+                            normalizer_fn=mixed_precision.batch_norm,
                             scope=end_point)
 
           end_points[end_point] = net
@@ -408,7 +410,7 @@ def mobilenet_v1_arg_scope(is_training=True,
     depthwise_regularizer = None
   with slim.arg_scope([slim.conv2d, slim.separable_conv2d],
                       weights_initializer=weights_init,
-                      activation_fn=tf.nn.relu6, normalizer_fn=slim.batch_norm):
+                      activation_fn=tf.nn.relu6, normalizer_fn=mixed_precision.batch_norm):
     with slim.arg_scope([slim.batch_norm], **batch_norm_params):
       with slim.arg_scope([slim.conv2d], weights_regularizer=regularizer):
         with slim.arg_scope([slim.separable_conv2d],
@@ -3,10 +3,16 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
+import multiprocessing
+import os
+import time
 
+import numpy as np
 import tensorflow as tf
 
+import memory_stats
 from nets import nets_factory
+import profiling
 
 def profile(model_name, num_classes, image_size, batch_size):
 
@@ -40,13 +46,187 @@ def profile(model_name, num_classes, image_size, batch_size):
             tfprof_options=tf.contrib.tfprof.model_analyzer.FLOAT_OPS_OPTIONS)
 
 
+def _build_step(model_name, num_classes, image_size, batch_size, training=True, jit=False, dtype=tf.float32, recompute=False):
+    """ Build a graph with a training step (or an inference step) of the network on random inputs.
+    Returns:
+        the graph, the step op, the init op and the end points of the network
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+
+        network_fn = nets_factory.get_network_fn(model_name, num_classes=num_classes, is_training=training, jit=jit, dtype=dtype,
+                                                 recompute=recompute)
+        inputs = tf.random_uniform((batch_size, image_size, image_size, 3))
+        logits, end_points = network_fn(inputs)
+
+        if training:
+            labels = tf.random_uniform([batch_size], maxval=num_classes, dtype=tf.int32)
+            loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=logits)
+            with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+                step_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+        else:
+            step_op = logits.op
+
+        init_op = tf.global_variables_initializer()
+
+    return graph, step_op, init_op, end_points
+
+def time_step(model_name, num_classes, image_size, batch_size, xla=None, num_steps=20, num_warmup_steps=5, training=True, profiler=None, dtype=tf.float32, recompute=False):
+    """ Return the median time (in seconds) of a training step (or an inference step) on random inputs.
+    Args:
+        xla: None to not use XLA, 'global' to compile the whole graph, or 'scope' to compile the network
+            in a jit scope (see `nets_factory.jit_scope`)
+        profiler: if provided, a `profiling.Profiler` that traces the timed steps
+        dtype: the compute dtype of the network (see `nets_factory.precision_network`)
+        recompute: recompute the activations of the blocks in the backward pass (see `gradient_checkpointing`)
+    """
+
+    graph, step_op, init_op, _ = _build_step(model_name, num_classes, image_size, batch_size,
+                                             training=training, jit=xla == 'scope', dtype=dtype, recompute=recompute)
+
+    sess_config = tf.ConfigProto(allow_soft_placement=True)
+    if xla == 'global':
+        sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
+    with tf.Session(graph=graph, config=sess_config) as sess:
+        sess.run(init_op)
+
+        # The first steps include the compilation time
+        for _ in range(num_warmup_steps):
+            sess.run(step_op)
+
+        step_times = []
+        for _ in range(num_steps):
+            t = time.time()
+            if profiler is not None:
+                profiler.begin_step()
+                profiler.run(sess, step_op)
+            else:
+                sess.run(step_op)
+            step_times.append(time.time() - t)
+
+    return np.median(step_times)
+
+def compare_xla(model_names, num_classes, image_size, batch_size, num_steps=20, training=True, dtype=tf.float32):
+    """ Print the step time of each architecture without XLA, with XLA for the whole graph, and
+    with XLA for the network only.
+    """
+
+    print("%s step time (ms) for a batch of %d images of size %d" % ('Training' if training else 'Inference', batch_size, image_size))
+    print("%-24s %10s %10s %10s %10s %10s" % ('model', 'no xla', 'global', 'speedup', 'scope', 'speedup'))
+
+    for model_name in model_names:
+        no_xla_time = time_step(model_name, num_classes, image_size, batch_size, None, num_steps, training=training, dtype=dtype)
+        global_time = time_step(model_name, num_classes, image_size, batch_size, 'global', num_steps, training=training, dtype=dtype)
+        scope_time = time_step(model_name, num_classes, image_size, batch_size, 'scope', num_steps, training=training, dtype=dtype)
+        print("%-24s %10.1f %10.1f %9.2fx %10.1f %9.2fx" % (
+            model_name, no_xla_time * 1000, global_time * 1000, no_xla_time / global_time,
+            scope_time * 1000, no_xla_time / scope_time))
+
+
+def measure_memory(model_name, num_classes, image_size, batch_size, training=True, dtype=tf.float32, device='/gpu:0', recompute=False):
+    """ Run a training step (or an inference step) on random inputs and measure the peak memory.
+    The allocator peak covers everything the process has run, so call this in a fresh process
+    (see `in_subprocess`).
+    Returns:
+        a dictionary with the peak bytes in use on `device` and the peak resident set size of the
+        process, or None if the step ran out of memory
+    """
+    graph, step_op, init_op, _ = _build_step(model_name, num_classes, image_size, batch_size,
+                                             training=training, dtype=dtype, recompute=recompute)
+    with graph.as_default(), tf.device(device):
+        peak_bytes_in_use = tf.contrib.memory_stats.MaxBytesInUse()
+
+    with tf.Session(graph=graph, config=tf.ConfigProto(allow_soft_placement=True)) as sess:
+        try:
+            sess.run(init_op)
+            sess.run(step_op)
+        except tf.errors.ResourceExhaustedError:
+            return None
+        return {
+            'device_peak_bytes' : int(sess.run(peak_bytes_in_use)),
+            'host_peak_bytes' : memory_stats.host_memory()['memory/host/peak_rss_bytes']
+        }
+
+def _put_result(result_queue, fn, args, kwargs):
+    result_queue.put(fn(*args, **kwargs))
+
+def in_subprocess(fn, *args, **kwargs):
+    """ Call `fn` in a new process, so that it gets its own allocators (and a step that runs out of
+    memory doesn't affect the next one).
+    """
+    result_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_put_result, args=(result_queue, fn, args, kwargs))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("The profiling process failed with exit code %s." % (process.exitcode,))
+    return result_queue.get()
+
+def report_memory(model_names, num_classes, image_size, batch_size, dtype=tf.float32, device='/gpu:0', num_end_points=5, recompute=False):
+    """ Print the peak memory of a training step and of an inference step of each architecture, and
+    its largest activations.
+    """
+
+    print("Peak memory for a batch of %d images of size %d on %s" % (batch_size, image_size, device))
+    print("%-24s %12s %12s %12s %12s" % ('model', 'train', 'train host', 'inference', 'infer. host'))
+
+    for model_name in model_names:
+        peaks = [in_subprocess(measure_memory, model_name, num_classes, image_size, batch_size,
+                               training=training, dtype=dtype, device=device, recompute=recompute)
+                 for training in (True, False)]
+        columns = []
+        for peak in peaks:
+            if peak is None:
+                columns += ['OOM', '']
+            else:
+                columns += [memory_stats.format_bytes(peak['device_peak_bytes']), memory_stats.format_bytes(peak['host_peak_bytes'])]
+        print("%-24s %12s %12s %12s %12s" % tuple([model_name] + columns))
+
+        # The training step keeps (most of) the activations for the backward pass
+        _, _, _, end_points = _build_step(model_name, num_classes, image_size, batch_size, training=False, dtype=dtype)
+        for name, shape, num_bytes in memory_stats.end_point_sizes(end_points)[:num_end_points]:
+            print("    %-32s %-24s %12s" % (name, shape, memory_stats.format_bytes(num_bytes)))
+
+def find_max_batch_size(model_name, num_classes, image_size, training=True, dtype=tf.float32, device='/gpu:0', max_batch_size=4096,
+                        recompute=False):
+    """ Find the largest batch size whose step fits in memory: double the batch size until a step runs
+    out of memory, then binary search. Each step runs in a new process.
+    Returns:
+        the largest batch size that fits (0 if a single image doesn't) and its peak memory
+    """
+    peaks = {}
+    def fits(batch_size):
+        peaks[batch_size] = in_subprocess(measure_memory, model_name, num_classes, image_size, batch_size,
+                                          training=training, dtype=dtype, device=device, recompute=recompute)
+        return peaks[batch_size] is not None
+
+    # `low` fits and `high` doesn't
+    low, high = 0, max_batch_size + 1
+    batch_size = 1
+    while batch_size < high:
+        if not fits(batch_size):
+            high = batch_size
+            break
+        low = batch_size
+        batch_size *= 2
+
+    while high - low > 1:
+        batch_size = (low + high) // 2
+        if fits(batch_size):
+            low = batch_size
+        else:
+            high = batch_size
+
+    return low, peaks.get(low)
+
 def parse_args():
 
     parser = argparse.ArgumentParser(description='')
 
-    parser.add_argument('--model_name', dest='model_name',
-                        help='The name of the architecture to profile.', type=str,
-                        required=False, default='inception_v3')
+    parser.add_argument('--model_name', dest='model_names',
+                        help='The names of the architectures to profile.', type=str,
+                        nargs='+', required=False, default=['inception_v3'])
 
     parser.add_argument('--num_classes', dest='num_classes',
                         help='The number of classes.', type=int,
@@ -60,13 +240,85 @@ def parse_args():
                         help='The number of images in a batch.', type=int,
                         required=False, default=1)
 
+    parser.add_argument('--compare_xla', dest='compare_xla',
+                        help='Report the step time with and without XLA rather than the parameter and FLOP counts.',
+                        action='store_true', default=False)
+
+    parser.add_argument('--num_steps', dest='num_steps',
+                        help='The number of steps to time for --compare_xla, or to trace for --profile_dir.', type=int,
+                        required=False, default=20)
+
+    parser.add_argument('--inference', dest='inference',
+                        help='Time inference steps rather than training steps for --compare_xla and --profile_dir (and size them for --find_max_batch_size).',
+                        action='store_true', default=False)
+
+    parser.add_argument('--dtype', dest='dtype',
+                        help='The compute dtype of the network for --compare_xla, --profile_dir, --memory and --find_max_batch_size: float32, float16 or bfloat16.',
+                        required=False, type=str, default='float32')
+
+    parser.add_argument('--memory', dest='memory',
+                        help='Report the peak device and host memory of a training and an inference step, and the largest activations, rather than the parameter and FLOP counts.',
+                        action='store_true', default=False)
+
+    parser.add_argument('--find_max_batch_size', dest='find_max_batch_size',
+                        help='Find the largest batch size whose training step (or inference step with --inference) fits in memory.',
+                        action='store_true', default=False)
+
+    parser.add_argument('--max_batch_size', dest='max_batch_size',
+                        help='The largest batch size to try with --find_max_batch_size.', type=int,
+                        required=False, default=4096)
+
+    parser.add_argument('--device', dest='device',
+                        help='The device to measure the memory of for --memory and --find_max_batch_size.', type=str,
+                        required=False, default='/gpu:0')
+
+    parser.add_argument('--recompute', dest='recompute',
+                        help='Recompute the activations of the network blocks in the backward pass (gradient checkpointing) for --memory, --find_max_batch_size and --profile_dir.',
+                        action='store_true', default=False)
+
+    parser.add_argument('--profile_dir', dest='profile_dir',
+                        help='Trace --num_steps steps of each architecture on random inputs and save the chrome timelines and the per op time and memory tables to a sub directory of this directory, rather than reporting the parameter and FLOP counts.',
+                        required=False, type=str, default=None)
+
     args = parser.parse_args()
     return args
 
 def main():
     args = parse_args()
 
-    profile(args.model_name, args.num_classes, args.image_size, args.batch_size)
+    if args.compare_xla:
+        compare_xla(args.model_names, args.num_classes, args.image_size, args.batch_size,
+                    num_steps=args.num_steps, training=not args.inference, dtype=args.dtype)
+        return
+
+    if args.memory:
+        report_memory(args.model_names, args.num_classes, args.image_size, args.batch_size,
+                      dtype=args.dtype, device=args.device, recompute=args.recompute)
+        return
+
+    if args.find_max_batch_size:
+        for model_name in args.model_names:
+            batch_size, peak = find_max_batch_size(model_name, args.num_classes, args.image_size,
+                                                   training=not args.inference, dtype=args.dtype,
+                                                   device=args.device, max_batch_size=args.max_batch_size,
+                                                   recompute=args.recompute)
+            print("%s: the largest %s batch of %d images that fits is %d (peak %s)" % (
+                model_name, 'inference' if args.inference else 'training', args.image_size, batch_size,
+                memory_stats.format_bytes(peak['device_peak_bytes'] if peak is not None else None)))
+        return
+
+    if args.profile_dir != None:
+        for model_name in args.model_names:
+            profiler = profiling.Profiler(os.path.join(args.profile_dir, model_name), start_step=0,
+                                          num_steps=args.num_steps, trace_input_queues=False)
+            step_time = time_step(model_name, args.num_classes, args.image_size, args.batch_size,
+                                  num_steps=args.num_steps, training=not args.inference, profiler=profiler, dtype=args.dtype,
+                                  recompute=args.recompute)
+            print("%s: %.1f ms / step (traced)" % (model_name, step_time * 1000))
+        return
+
+    for model_name in args.model_names:
+        profile(model_name, args.num_classes, args.image_size, args.batch_size)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
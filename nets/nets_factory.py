@@ -17,11 +17,14 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import contextlib
 import functools
 
 import tensorflow as tf
 
+from nets import gradient_checkpointing
 from nets import inception
+from nets import mixed_precision
 from nets import mobilenet_v1
 from nets import resnet_v2
 
@@ -59,7 +62,8 @@ arg_scopes_map = {'inception_v1': inception.inception_v3_arg_scope,
                  }
 
 
-def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
+def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False, jit=False,
+                   dtype=tf.float32, recompute=False):
   """Returns a network_fn such as `logits, end_points = network_fn(images)`.
 
   Args:
@@ -68,6 +72,10 @@ def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
     weight_decay: The l2 coefficient for the model weights.
     is_training: `True` if the model is being used for training and `False`
       otherwise.
+    jit: If `True`, then the network is compiled with XLA (see `jit_scope`).
+    dtype: The compute dtype of the network (see `precision_network`).
+    recompute: If `True`, then the activations of the blocks are recomputed in
+      the backward pass (see `gradient_checkpointing`).
 
   Returns:
     network_fn: A function that applies the model to a batch of images. It has
@@ -79,12 +87,70 @@ def get_network_fn(name, num_classes, weight_decay=0.0, is_training=False):
   if name not in networks_map:
     raise ValueError('Name of network unknown %s' % name)
   arg_scope = arg_scopes_map[name](weight_decay=weight_decay)
-  func = networks_map[name]
+  func = precision_network(name, dtype)
   @functools.wraps(func)
   def network_fn(images):
-    with slim.arg_scope(arg_scope):
+    with slim.arg_scope(arg_scope), jit_scope(jit), \
+         gradient_checkpointing.checkpointing_scope(recompute):
       return func(images, num_classes, is_training=is_training)
   if hasattr(func, 'default_image_size'):
     network_fn.default_image_size = func.default_image_size
 
   return network_fn
+
+
+# The outputs that are cast back to float32 (for the losses and the predictions)
+FLOAT32_END_POINTS = ('Logits', 'AuxLogits', 'Predictions')
+
+
+def precision_network(name, dtype=tf.float32):
+  """Returns the network function of `networks_map` that computes in `dtype`.
+
+  For float16 and bfloat16, the images are cast to `dtype` and the variables
+  are stored in float32 and cast to `dtype` when they are read (see
+  `mixed_precision`). The logits and the `FLOAT32_END_POINTS` are cast back to
+  float32, the other end points are left in `dtype`. Call the returned function
+  in the arg scope of the network, like the functions of `networks_map`.
+
+  Args:
+    name: The name of the network.
+    dtype: float32, float16 or bfloat16 (a `tf.DType` or its name).
+
+  Raises:
+    ValueError: If network `name` is not recognized or the dtype is not supported.
+  """
+  if name not in networks_map:
+    raise ValueError('Name of network unknown %s' % name)
+  dtype = mixed_precision.compute_dtype(dtype)
+  func = networks_map[name]
+  if dtype == tf.float32:
+    return func
+
+  @functools.wraps(func)
+  def reduced_precision_fn(inputs, *args, **kwargs):
+    with mixed_precision.float32_variables_scope(dtype):
+      logits, end_points = func(tf.cast(inputs, dtype), *args, **kwargs)
+    for end_point in FLOAT32_END_POINTS:
+      if end_point in end_points:
+        end_points[end_point] = tf.cast(end_points[end_point], tf.float32)
+    return tf.cast(logits, tf.float32), end_points
+  return reduced_precision_fn
+
+
+@contextlib.contextmanager
+def _null_scope():
+  yield
+
+
+def jit_scope(enabled=True):
+  """Returns a context manager that marks the ops created in it for XLA compilation.
+
+  Fusing the many small ops of a network (e.g. the batch norm, relu and concat ops
+  of the inception blocks) saves memory bandwidth and kernel launches.
+
+  Args:
+    enabled: If False, then a context manager that does nothing is returned.
+  """
+  if enabled:
+    return tf.contrib.compiler.jit.experimental_jit_scope()
+  return _null_scope()
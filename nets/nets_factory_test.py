@@ -20,6 +20,7 @@ from __future__ import division
 from __future__ import print_function
 
 
+import numpy as np
 import tensorflow as tf
 
 from nets import nets_factory
@@ -42,5 +43,109 @@ class NetworksTest(tf.test.TestCase):
         self.assertEqual(logits.get_shape().as_list()[0], batch_size)
         self.assertEqual(logits.get_shape().as_list()[-1], num_classes)
 
+  def testJitScope(self):
+    with tf.Graph().as_default():
+      net_fn = nets_factory.get_network_fn('mobilenet_v1_025', 10, jit=True)
+      logits, _ = net_fn(tf.random_uniform((2, 64, 64, 3)))
+      self.assertTrue(logits.op.get_attr('_XlaCompile'))
+
+    with tf.Graph().as_default():
+      net_fn = nets_factory.get_network_fn('mobilenet_v1_025', 10)
+      logits, _ = net_fn(tf.random_uniform((2, 64, 64, 3)))
+      with self.assertRaises(ValueError):
+        logits.op.get_attr('_XlaCompile')
+
+  def testReducedPrecisionVariables(self):
+    for dtype in (tf.float16, tf.bfloat16):
+      with tf.Graph().as_default():
+        net_fn = nets_factory.get_network_fn('mobilenet_v1_025', 10, dtype=dtype)
+        logits, end_points = net_fn(tf.random_uniform((2, 64, 64, 3)))
+        self.assertEqual(logits.dtype, tf.float32)
+        self.assertEqual(end_points['Predictions'].dtype, tf.float32)
+        self.assertEqual(end_points['Conv2d_13_pointwise'].dtype, dtype)
+        for var in tf.global_variables():
+          self.assertEqual(var.dtype.base_dtype, tf.float32)
+        self.assertTrue(len(tf.losses.get_regularization_losses()) > 0)
+        for loss in tf.losses.get_regularization_losses():
+          self.assertEqual(loss.dtype, tf.float32)
+
+  def testFloat16Numerics(self):
+    with tf.Graph().as_default():
+      inputs = tf.random_uniform((2, 64, 64, 3), minval=-1., maxval=1.)
+      arg_scope = nets_factory.arg_scopes_map['mobilenet_v1_025']()
+      with tf.contrib.slim.arg_scope(arg_scope):
+        logits, _ = nets_factory.precision_network('mobilenet_v1_025')(
+            inputs, num_classes=10, is_training=False)
+        tf.get_variable_scope().reuse_variables()
+        half_logits, _ = nets_factory.precision_network('mobilenet_v1_025', 'float16')(
+            inputs, num_classes=10, is_training=False)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        logits_value, half_logits_value = sess.run([logits, half_logits])
+        self.assertAllClose(logits_value, half_logits_value, rtol=1e-2, atol=1e-2)
+
+  def _hasCpuBfloat16Conv(self):
+    """Stock TensorFlow 1.x builds only register the bfloat16 Conv2D kernel with MKL."""
+    with tf.Graph().as_default():
+      inputs = tf.zeros((1, 4, 4, 1), dtype=tf.bfloat16)
+      conv = tf.nn.conv2d(inputs, tf.zeros((1, 1, 1, 1), dtype=tf.bfloat16), [1, 1, 1, 1], 'SAME')
+      with self.test_session(use_gpu=False) as sess:
+        try:
+          sess.run(conv)
+        except (tf.errors.NotFoundError, tf.errors.InvalidArgumentError):
+          return False
+    return True
+
+  def testBfloat16NumericsOnCpu(self):
+    if not self._hasCpuBfloat16Conv():
+      self.skipTest('This TensorFlow build has no bfloat16 Conv2D kernel for the CPU')
+    with tf.Graph().as_default(), tf.device('/cpu:0'):
+      inputs = tf.random_uniform((2, 64, 64, 3), minval=-1., maxval=1.)
+      arg_scope = nets_factory.arg_scopes_map['mobilenet_v1_025']()
+      with tf.contrib.slim.arg_scope(arg_scope):
+        logits, _ = nets_factory.precision_network('mobilenet_v1_025')(
+            inputs, num_classes=10, is_training=False)
+        tf.get_variable_scope().reuse_variables()
+        bfloat16_logits, _ = nets_factory.precision_network('mobilenet_v1_025', 'bfloat16')(
+            inputs, num_classes=10, is_training=False)
+      with self.test_session(use_gpu=False) as sess:
+        sess.run(tf.global_variables_initializer())
+        logits_value, bfloat16_logits_value = sess.run([logits, bfloat16_logits])
+        # bfloat16 keeps 8 bits of precision, compared to 11 for float16
+        self.assertAllClose(logits_value, bfloat16_logits_value, rtol=5e-2, atol=5e-2)
+
+  def testUnsupportedDtype(self):
+    with self.assertRaises(ValueError):
+      nets_factory.precision_network('mobilenet_v1_025', 'float64')
+
+  def _gradients(self, recompute, variable_values=None):
+    with tf.Graph().as_default():
+      net_fn = nets_factory.get_network_fn('resnet_v2_50', 10, is_training=True, recompute=recompute)
+      inputs = tf.constant(np.random.RandomState(0).uniform(-1., 1., (2, 64, 64, 3)), tf.float32)
+      logits, _ = net_fn(inputs)
+      loss = tf.reduce_sum(logits)
+      variables = tf.trainable_variables()
+      gradients = tf.gradients(loss, variables)
+      num_update_ops = len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        if variable_values is None:
+          variable_values = dict(zip([var.op.name for var in variables], sess.run(variables)))
+        else:
+          for var in variables:
+            var.load(variable_values[var.op.name], sess)
+        gradient_values = dict(zip([var.op.name for var in variables], sess.run(gradients)))
+    return variable_values, gradient_values, num_update_ops
+
+  def testGradientCheckpointing(self):
+    variable_values, gradients, num_update_ops = self._gradients(recompute=False)
+    _, recomputed_gradients, recomputed_num_update_ops = self._gradients(
+        recompute=True, variable_values=variable_values)
+    # The moving averages are only updated by the forward pass
+    self.assertEqual(num_update_ops, recomputed_num_update_ops)
+    self.assertEqual(sorted(gradients), sorted(recomputed_gradients))
+    for name in gradients:
+      self.assertAllClose(gradients[name], recomputed_gradients[name], rtol=1e-4, atol=1e-4)
+
 if __name__ == '__main__':
   tf.test.main()
@@ -40,6 +40,9 @@ from __future__ import print_function
 import collections
 import tensorflow as tf
 
+from nets import gradient_checkpointing
+from nets import mixed_precision
+
 slim = tf.contrib.slim
 
 
@@ -172,6 +175,8 @@ def stack_blocks_dense(net, blocks, output_stride=None,
   rate = 1
 
   for block in blocks:
+    # The units recompute their activations in a gradient checkpointing scope
+    unit_fn = gradient_checkpointing.checkpointed(block.unit_fn)
     with tf.variable_scope(block.scope, 'block', [net]) as sc:
       for i, unit in enumerate(block.args):
         if output_stride is not None and current_stride > output_stride:
@@ -182,11 +187,11 @@ def stack_blocks_dense(net, blocks, output_stride=None,
           # atrous convolution with stride=1 and multiply the atrous rate by the
           # current unit's stride for use in subsequent layers.
           if output_stride is not None and current_stride == output_stride:
-            net = block.unit_fn(net, rate=rate, **dict(unit, stride=1))
+            net = unit_fn(net, rate=rate, **dict(unit, stride=1))
             rate *= unit.get('stride', 1)
 
           else:
-            net = block.unit_fn(net, rate=1, **unit)
+            net = unit_fn(net, rate=1, **unit)
             current_stride *= unit.get('stride', 1)
       net = slim.utils.collect_named_outputs(outputs_collections, sc.name, net)
 
@@ -235,7 +240,7 @@ def resnet_arg_scope(weight_decay=0.0001,
       weights_regularizer=slim.l2_regularizer(weight_decay),
       weights_initializer=slim.variance_scaling_initializer(),
       activation_fn=activation_fn,
-      normalizer_fn=slim.batch_norm if use_batch_norm else None,
+      normalizer_fn=mixed_precision.batch_norm if use_batch_norm else None,
       normalizer_params=batch_norm_params):
     with slim.arg_scope([slim.batch_norm], **batch_norm_params):
       # The following implies padding='SAME' for pool1, which makes feature
@@ -52,6 +52,7 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+from nets import mixed_precision
 from nets import resnet_utils
 
 slim = tf.contrib.slim
@@ -85,7 +86,7 @@ def bottleneck(inputs, depth, depth_bottleneck, stride, rate=1,
   """
   with tf.variable_scope(scope, 'bottleneck_v2', [inputs]) as sc:
     depth_in = slim.utils.last_dimension(inputs.get_shape(), min_rank=4)
-    preact = slim.batch_norm(inputs, activation_fn=tf.nn.relu, scope='preact')
+    preact = mixed_precision.batch_norm(inputs, activation_fn=tf.nn.relu, scope='preact')
     if depth == depth_in:
       shortcut = resnet_utils.subsample(inputs, stride, 'shortcut')
     else:
@@ -204,7 +205,7 @@ def resnet_v2(inputs,
         # This is needed because the pre-activation variant does not have batch
         # normalization or activation functions in the residual unit output. See
         # Appendix of [2].
-        net = slim.batch_norm(net, activation_fn=tf.nn.relu, scope='postnorm')
+        net = mixed_precision.batch_norm(net, activation_fn=tf.nn.relu, scope='postnorm')
         if global_pool:
           # Global average pooling.
           net = tf.reduce_mean(net, [1, 2], name='pool5', keep_dims=True)
@@ -0,0 +1,88 @@
+"""
+Optimizers that are not part of tensorflow (see `train._configure_optimizer`).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+class LARSOptimizer(tf.train.MomentumOptimizer):
+    """Layer-wise Adaptive Rate Scaling (You et al., "Large Batch Training of Convolutional Networks").
+
+    Momentum SGD where the learning rate of each variable is scaled by the trust ratio
+    `trust_coefficient * ||w|| / ||g||`, so that the size of an update is relative to the size of the
+    variable. This keeps training stable with large batches (and large learning rates). The gradients
+    should already include the weight decay (the regularization losses). Variables with fewer than 2
+    dimensions (biases and batch norm parameters) are not scaled.
+    """
+
+    def __init__(self, learning_rate, momentum=0.9, trust_coefficient=0.001, epsilon=0.,
+                 use_locking=False, name='LARS', use_nesterov=False):
+        super(LARSOptimizer, self).__init__(learning_rate, momentum, use_locking=use_locking,
+                                            name=name, use_nesterov=use_nesterov)
+        self._trust_coefficient = trust_coefficient
+        self._epsilon = epsilon
+
+    def _trust_ratio(self, grad, var):
+        var_norm = tf.norm(var)
+        grad_norm = tf.norm(grad)
+        return tf.where(
+            tf.logical_and(var_norm > 0., grad_norm > 0.),
+            self._trust_coefficient * var_norm / (grad_norm + self._epsilon),
+            tf.ones_like(var_norm)
+        )
+
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+        scaled_grads_and_vars = []
+        with tf.name_scope('lars'):
+            for grad, var in grads_and_vars:
+                if grad is not None and var.get_shape().ndims >= 2:
+                    grad = tf.convert_to_tensor(grad)
+                    grad = grad * tf.cast(self._trust_ratio(grad, var), grad.dtype.base_dtype)
+                scaled_grads_and_vars.append((grad, var))
+        return super(LARSOptimizer, self).apply_gradients(scaled_grads_and_vars, global_step=global_step, name=name)
+
+
+class LossScaleOptimizer(tf.train.Optimizer):
+    """Static loss scaling for reduced precision (float16) training (see `PRECISION` in the training config).
+
+    The loss is multiplied by `loss_scale` before the gradients are computed, so that small gradients
+    don't flush to zero in float16, and the gradients are divided by `loss_scale` before they are
+    returned. The variables (and so the gradients that are applied) are float32. Everything else is
+    delegated to the wrapped optimizer.
+    """
+
+    def __init__(self, optimizer, loss_scale, use_locking=False, name='LossScale'):
+        super(LossScaleOptimizer, self).__init__(use_locking, name)
+        self._optimizer = optimizer
+        self._loss_scale = float(loss_scale)
+
+    def compute_gradients(self, loss, var_list=None, **kwargs):
+        scaled_loss = loss * tf.cast(self._loss_scale, loss.dtype.base_dtype)
+        grads_and_vars = self._optimizer.compute_gradients(scaled_loss, var_list=var_list, **kwargs)
+        unscaled_grads_and_vars = []
+        with tf.name_scope('loss_scale'):
+            for grad, var in grads_and_vars:
+                if grad is not None:
+                    inverse_scale = tf.cast(1. / self._loss_scale, grad.dtype.base_dtype)
+                    if isinstance(grad, tf.IndexedSlices):
+                        grad = tf.IndexedSlices(grad.values * inverse_scale, grad.indices, grad.dense_shape)
+                    else:
+                        grad = grad * inverse_scale
+                unscaled_grads_and_vars.append((grad, var))
+        return unscaled_grads_and_vars
+
+    def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+        return self._optimizer.apply_gradients(grads_and_vars, global_step=global_step, name=name)
+
+    def get_slot(self, var, name):
+        return self._optimizer.get_slot(var, name)
+
+    def get_slot_names(self):
+        return self._optimizer.get_slot_names()
+
+    def variables(self):
+        return self._optimizer.variables()
@@ -0,0 +1,56 @@
+"""Tests for optimizers.py."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+import optimizers
+
+
+class LARSOptimizerTest(tf.test.TestCase):
+
+  def testTrustRatio(self):
+    with self.test_session() as sess:
+      weights = tf.Variable([[3., 4.]])
+      biases = tf.Variable([1., 1.])
+      optimizer = optimizers.LARSOptimizer(1., momentum=0., trust_coefficient=0.1)
+      train_op = optimizer.apply_gradients([(tf.constant([[0., 10.]]), weights),
+                                            (tf.constant([2., 2.]), biases)])
+      sess.run(tf.global_variables_initializer())
+      sess.run(train_op)
+      # ||weights|| = 5 and ||gradient|| = 10, so the gradient is scaled by 0.1 * 5 / 10
+      self.assertAllClose(sess.run(weights), [[3., 3.5]])
+      # Biases are not scaled
+      self.assertAllClose(sess.run(biases), [-1., -1.])
+
+  def testZeroGradient(self):
+    with self.test_session() as sess:
+      weights = tf.Variable([[3., 4.]])
+      optimizer = optimizers.LARSOptimizer(1., momentum=0.9)
+      train_op = optimizer.apply_gradients([(tf.zeros([1, 2]), weights)])
+      sess.run(tf.global_variables_initializer())
+      sess.run(train_op)
+      self.assertTrue(np.all(np.isfinite(sess.run(weights))))
+      self.assertAllClose(sess.run(weights), [[3., 4.]])
+
+
+
+class LossScaleOptimizerTest(tf.test.TestCase):
+
+  def testGradientsAreUnscaled(self):
+    with self.test_session() as sess:
+      weights = tf.Variable([1., 2.])
+      loss = tf.reduce_sum(tf.square(weights))
+      optimizer = optimizers.LossScaleOptimizer(tf.train.GradientDescentOptimizer(0.1), loss_scale=128)
+      grads_and_vars = optimizer.compute_gradients(loss)
+      train_op = optimizer.apply_gradients(grads_and_vars)
+      sess.run(tf.global_variables_initializer())
+      self.assertAllClose(sess.run(grads_and_vars[0][0]), [2., 4.])
+      sess.run(train_op)
+      self.assertAllClose(sess.run(weights), [0.8, 1.6])
+
+if __name__ == '__main__':
+  tf.test.main()
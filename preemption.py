@@ -0,0 +1,51 @@
+"""
+Stop training cleanly when the job is preempted (see `PREEMPTION` in the training config).
+
+Preemptible machines get a termination signal (SIGTERM) shortly before they are shut down. The
+`PreemptionHandler` records the signal, and the training loop stops after the current step.
+`slim.learning.train` saves a checkpoint when it stops, so at most one step is lost rather than
+everything since the last periodic checkpoint.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import signal
+
+import tensorflow as tf
+
+
+class PreemptionHandler(object):
+
+    def __init__(self, signals=('SIGTERM',)):
+        """
+        Args:
+            signals: the names of the signals that mean the job is being preempted
+        """
+        self.preempted = False
+        self._previous_handlers = {}
+        for signal_name in signals:
+            if not hasattr(signal, signal_name):
+                raise ValueError("Unknown signal: %s" % (signal_name,))
+            signum = getattr(signal, signal_name)
+            self._previous_handlers[signum] = signal.signal(signum, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        tf.logging.warn('Received signal %d, stopping after this step and saving a checkpoint.' % (signum,))
+        self.preempted = True
+
+    def uninstall(self):
+        """ Restore the previous signal handlers.
+        """
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler)
+        self._previous_handlers = {}
+
+    def wrap_train_step_fn(self, train_step_fn):
+        """ Wrap a `train_step_fn` for `slim.learning.train` so that training stops after a signal.
+        """
+        def preemptible_train_step_fn(sess, train_op, global_step, train_step_kwargs):
+            total_loss, should_stop = train_step_fn(sess, train_op, global_step, train_step_kwargs)
+            return total_loss, should_stop or self.preempted
+        return preemptible_train_step_fn
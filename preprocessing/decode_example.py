@@ -4,6 +4,54 @@ from __future__ import print_function
 
 import tensorflow as tf
 
+# The features that can be stored in a tfrecord example
+FEATURE_SPECS = {
+    'image/height': tf.FixedLenFeature([], tf.int64),
+    'image/width': tf.FixedLenFeature([], tf.int64),
+    'image/colorspace': tf.FixedLenFeature([], tf.string),
+    'image/channels': tf.FixedLenFeature([], tf.int64),
+    'image/format': tf.FixedLenFeature([], tf.string),
+    'image/filename': tf.FixedLenFeature([], tf.string),
+    'image/id': tf.FixedLenFeature([], tf.string),
+    'image/encoded': tf.FixedLenFeature([], tf.string),
+    'image/extra': tf.FixedLenFeature([], tf.string),
+    'image/class/label': tf.FixedLenFeature([], tf.int64),
+    'image/class/text': tf.FixedLenFeature([], tf.string),
+    'image/class/conf':  tf.FixedLenFeature([], tf.float32),
+    'image/object/bbox/xmin': tf.VarLenFeature(dtype=tf.float32),
+    'image/object/bbox/xmax': tf.VarLenFeature(dtype=tf.float32),
+    'image/object/bbox/ymin': tf.VarLenFeature(dtype=tf.float32),
+    'image/object/bbox/ymax': tf.VarLenFeature(dtype=tf.float32),
+    'image/object/bbox/label': tf.VarLenFeature(dtype=tf.int64),
+    'image/object/bbox/text': tf.VarLenFeature(dtype=tf.string),
+    'image/object/bbox/conf': tf.VarLenFeature(dtype=tf.float32),
+    'image/object/bbox/score' : tf.VarLenFeature(dtype=tf.float32),
+    'image/object/parts/x' : tf.VarLenFeature(dtype=tf.float32),
+    'image/object/parts/y' : tf.VarLenFeature(dtype=tf.float32),
+    'image/object/parts/v' : tf.VarLenFeature(dtype=tf.int64),
+    'image/object/parts/score' : tf.VarLenFeature(dtype=tf.float32),
+    'image/object/count' : tf.FixedLenFeature([], tf.int64),
+    'image/object/area' : tf.VarLenFeature(dtype=tf.float32),
+    'image/object/id' : tf.VarLenFeature(dtype=tf.string)
+}
+
+# Parsing specs that have already been built, keyed by the tuple of feature keys
+_feature_map_cache = {}
+
+def get_feature_map(features_to_fetch):
+    """
+    Args:
+        features_to_fetch : a list of tuples (feature key, name for feature)
+    Returns:
+        dictionary : the parsing spec for the requested features
+    """
+    feature_keys = tuple(feature_key for feature_key, feature_name in features_to_fetch)
+    if feature_keys not in _feature_map_cache:
+        _feature_map_cache[feature_keys] = {
+            feature_key : FEATURE_SPECS[feature_key] for feature_key in feature_keys
+        }
+    return _feature_map_cache[feature_keys]
+
 def decode_serialized_example(serialized_example, features_to_fetch, decode_image=True):
     """
     Args:
@@ -13,103 +61,37 @@ def decode_serialized_example(serialized_example, features_to_fetch, decode_imag
         dictionary : maps name to parsed example
     """
 
-    feature_map = {}
-    for feature_key, feature_name in features_to_fetch:
-        feature_map[feature_key] = {
-            'image/height': tf.FixedLenFeature([], tf.int64),
-            'image/width': tf.FixedLenFeature([], tf.int64),
-            'image/colorspace': tf.FixedLenFeature([], tf.string),
-            'image/channels': tf.FixedLenFeature([], tf.int64),
-            'image/format': tf.FixedLenFeature([], tf.string),
-            'image/filename': tf.FixedLenFeature([], tf.string),
-            'image/id': tf.FixedLenFeature([], tf.string),
-            'image/encoded': tf.FixedLenFeature([], tf.string),
-            'image/extra': tf.FixedLenFeature([], tf.string),
-            'image/class/label': tf.FixedLenFeature([], tf.int64),
-            'image/class/text': tf.FixedLenFeature([], tf.string),
-            'image/class/conf':  tf.FixedLenFeature([], tf.float32),
-            'image/object/bbox/xmin': tf.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/xmax': tf.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/ymin': tf.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/ymax': tf.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/label': tf.VarLenFeature(dtype=tf.int64),
-            'image/object/bbox/text': tf.VarLenFeature(dtype=tf.string),
-            'image/object/bbox/conf': tf.VarLenFeature(dtype=tf.float32),
-            'image/object/bbox/score' : tf.VarLenFeature(dtype=tf.float32),
-            'image/object/parts/x' : tf.VarLenFeature(dtype=tf.float32),
-            'image/object/parts/y' : tf.VarLenFeature(dtype=tf.float32),
-            'image/object/parts/v' : tf.VarLenFeature(dtype=tf.int64),
-            'image/object/parts/score' : tf.VarLenFeature(dtype=tf.float32),
-            'image/object/count' : tf.FixedLenFeature([], tf.int64),
-            'image/object/area' : tf.VarLenFeature(dtype=tf.float32),
-            'image/object/id' : tf.VarLenFeature(dtype=tf.string)
-        }[feature_key]
-
     features = tf.parse_single_example(
       serialized_example,
-      features = feature_map
+      features = get_feature_map(features_to_fetch)
     )
 
     # return a dictionary of the features
     parsed_features = {}
 
     for feature_key, feature_name in features_to_fetch:
-        if feature_key == 'image/height':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/width':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/colorspace':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/channels':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/format':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/filename':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/id':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/encoded':
-            if decode_image:
-                parsed_features[feature_name] = tf.image.decode_jpeg(features[feature_key], channels=3)
-            else:
-                parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/extra':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/class/label':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/class/text':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/class/conf':
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/object/bbox/xmin':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/xmax':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/ymin':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/ymax':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/label':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/text':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/conf':
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/bbox/score' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/parts/x' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/parts/y' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/parts/v' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/parts/score' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/count' :
-            parsed_features[feature_name] = features[feature_key]
-        elif feature_key == 'image/object/area' :
-            parsed_features[feature_name] = features[feature_key].values
-        elif feature_key == 'image/object/id' :
-            parsed_features[feature_name] = features[feature_key].values
+        feature = features[feature_key]
+        if feature_key == 'image/encoded' and decode_image:
+            feature = tf.image.decode_jpeg(feature, channels=3)
+        elif isinstance(feature, tf.SparseTensor):
+            feature = feature.values
+        parsed_features[feature_name] = feature
+
+    return parsed_features
+
+def decode_serialized_examples(serialized_examples, features_to_fetch):
+    """ Parse a batch of examples with a single op. The images are not decoded.
+    Args:
+        serialized_examples : A 1-D Tensor of tfrecord examples
+        features_to_fetch : a list of tuples (feature key, name for feature)
+    Returns:
+        dictionary : maps name to the parsed batch. Variable length features are
+            `SparseTensor`s with shape [batch_size, max number of values].
+    """
+
+    features = tf.parse_example(
+      serialized_examples,
+      features = get_feature_map(features_to_fetch)
+    )
 
-    return parsed_features
\ No newline at end of file
+    return {feature_name : features[feature_key] for feature_key, feature_name in features_to_fetch}
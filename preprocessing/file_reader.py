@@ -0,0 +1,91 @@
+"""
+Read image files from the file system (see `read_filenames` in `inputs.input_nodes`).
+
+Files on slow (e.g. network) file systems can be copied to a local directory the first time
+they are read, and the read latency can be logged.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+
+import numpy as np
+import tensorflow as tf
+
+
+class ImageFileReader(object):
+
+    def __init__(self, local_cache_dir=None, log_every_n=0):
+        """
+        Args:
+            local_cache_dir: If not None, then files are copied to this directory the first time
+                they are read, and read from here afterwards.
+            log_every_n: If > 0, then log the read latency statistics of every `log_every_n` files.
+        """
+        self.local_cache_dir = local_cache_dir
+        self.log_every_n = log_every_n
+
+        self._lock = threading.Lock()
+        self._latencies = []
+
+        if self.local_cache_dir is not None and not tf.gfile.IsDirectory(self.local_cache_dir):
+            tf.gfile.MakeDirs(self.local_cache_dir)
+
+    def _local_path(self, filename):
+        """ Copy `filename` to the local cache directory (if it is not there already).
+        """
+        _, ext = os.path.splitext(filename)
+        local_path = os.path.join(self.local_cache_dir, hashlib.sha1(filename.encode('utf-8')).hexdigest() + ext)
+        if not tf.gfile.Exists(local_path):
+            # Copy to a temporary file first so that other threads never see a partial file
+            tmp_path = local_path + '.' + uuid.uuid4().hex
+            tf.gfile.Copy(filename, tmp_path, overwrite=True)
+            tf.gfile.Rename(tmp_path, local_path, overwrite=True)
+        return local_path
+
+    def _record_latency(self, latency):
+
+        if self.log_every_n <= 0:
+            return
+
+        with self._lock:
+            self._latencies.append(latency)
+            if len(self._latencies) < self.log_every_n:
+                return
+            latencies = np.array(self._latencies) * 1000
+            self._latencies = []
+
+        tf.logging.info('Image read latency (ms) over %d files: mean %.1f, median %.1f, 90th percentile %.1f, max %.1f' % (
+            len(latencies), np.mean(latencies), np.median(latencies), np.percentile(latencies, 90), np.max(latencies)))
+
+    def read(self, filename):
+        """ Return the contents of `filename`.
+        """
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8')
+
+        t = time.time()
+        if self.local_cache_dir is not None:
+            filename = self._local_path(filename)
+        with tf.gfile.GFile(filename, 'rb') as f:
+            contents = f.read()
+        self._record_latency(time.time() - t)
+
+        return contents
+
+    def read_op(self, filename):
+        """
+        Args:
+            filename: scalar string Tensor
+        Returns:
+            scalar string Tensor with the contents of the file
+        """
+        contents = tf.py_func(self.read, [filename], tf.string, stateful=True, name='read_image_file')
+        contents.set_shape([])
+        return contents
@@ -25,9 +25,15 @@ from __future__ import print_function
 from easydict import EasyDict
 import tensorflow as tf
 from tensorflow.python.ops import control_flow_ops
+from tensorflow.python.ops import gen_data_flow_ops
+from tensorflow.python.util import nest
 
-from preprocessing.decode_example import decode_serialized_example
+from preprocessing.decode_example import decode_serialized_example, decode_serialized_examples
+from preprocessing import file_reader
+from preprocessing import region_cache
 
+# The tensors of the next batch of each tf.data input pipeline (see `profiling.Profiler`)
+BATCH_TENSORS_COLLECTION = 'input_batch_tensors'
 
 
 def apply_with_random_selector(x, func, num_cases):
@@ -98,6 +104,70 @@ def distort_color(image, color_ordering=0, fast_mode=True, scope=None):
     # The random_* ops do not necessarily clamp.
     return tf.clip_by_value(image, 0.0, 1.0)
 
+def _random_per_image(images, minval, maxval):
+  """Returns a random value for each image in a batch, broadcastable to the images."""
+  num_images = tf.shape(images)[0]
+  return tf.random_uniform([num_images, 1, 1, 1], minval=minval, maxval=maxval, dtype=tf.float32)
+
+def _adjust_saturation_and_hue(images, saturation_factor=None, hue_delta=None):
+  """Scale the saturation and shift the hue of a batch of images in [0, 1]."""
+  hsv = tf.image.rgb_to_hsv(images)
+  hue, saturation, value = tf.split(hsv, 3, axis=3)
+  if saturation_factor is not None:
+    saturation = tf.clip_by_value(saturation * saturation_factor, 0.0, 1.0)
+  if hue_delta is not None:
+    hue = tf.mod(hue + hue_delta + 1.0, 1.0)
+  return tf.image.hsv_to_rgb(tf.concat([hue, saturation, value], axis=3))
+
+def _adjust_contrast(images, contrast_factor):
+  """Scale the contrast of each image in a batch of images."""
+  means = tf.reduce_mean(images, axis=[1, 2], keep_dims=True)
+  return (images - means) * contrast_factor + means
+
+def distort_color_batched(images, color_ordering=0, fast_mode=True, scope=None):
+  """Distort the color of a batch of images, with different random values for each image.
+  This is the batched equivalent of `distort_color()`: the same color ops, with the
+  same ranges, are applied in the same orderings.
+  Args:
+    images: 4-D Tensor containing a batch of images in [0, 1].
+    color_ordering: Python int, a type of distortion (valid values: 0-3).
+    fast_mode: Avoids slower ops (random_hue and random_contrast)
+    scope: Optional scope for name_scope.
+  Returns:
+    4-D Tensor of color-distorted images on range [0, 1]
+  Raises:
+    ValueError: if color_ordering not in [0, 3]
+  """
+  with tf.name_scope(scope, 'distort_color_batched', [images]):
+
+    brightness = lambda x: x + _random_per_image(x, -32. / 255., 32. / 255.)
+    saturation = lambda x: _adjust_saturation_and_hue(x, saturation_factor=_random_per_image(x, 0.5, 1.5))
+    hue = lambda x: _adjust_saturation_and_hue(x, hue_delta=_random_per_image(x, -0.2, 0.2))
+    contrast = lambda x: _adjust_contrast(x, _random_per_image(x, 0.5, 1.5))
+
+    if fast_mode:
+      if color_ordering == 0:
+        ops = [brightness, saturation]
+      else:
+        ops = [saturation, brightness]
+    else:
+      if color_ordering == 0:
+        ops = [brightness, saturation, hue, contrast]
+      elif color_ordering == 1:
+        ops = [saturation, brightness, contrast, hue]
+      elif color_ordering == 2:
+        ops = [contrast, hue, brightness, saturation]
+      elif color_ordering == 3:
+        ops = [hue, saturation, contrast, brightness]
+      else:
+        raise ValueError('color_ordering must be in [0, 3]')
+
+    for op in ops:
+      images = op(images)
+
+    # The color ops do not necessarily clamp.
+    return tf.clip_by_value(images, 0.0, 1.0)
+
 def distorted_bounding_box_crop(image,
                                 bbox,
                                 min_object_covered=0.1,
@@ -387,21 +457,122 @@ def expand_bboxes(xmin, xmax, ymin, ymax, cfg):
 
     return tf.tuple([xmin, xmax, ymin, ymax])
 
-def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True, fetch_text_labels=True, read_filename=False):
+def decode_and_crop_image(image_buffer, cfg):
+    """Decode only the random crop / central crop of a jpeg image.
+    The crop window is sampled from the jpeg header (without decoding the image), using
+    the same `DO_RANDOM_CROP`, `RANDOM_CROP_CFG`, `DO_CENTRAL_CROP` and `CENTRAL_CROP_FRACTION`
+    configuration that `DistortedInputs` uses. Only the pixels in the window are decompressed.
+    Args:
+        image_buffer: scalar string Tensor with the jpeg bytes
+        cfg: the `IMAGE_PROCESSING` configuration
+    Returns:
+        3-D uint8 Tensor of the cropped image
     """
-    Return the image, an array of bounding boxes, and an array of ids.
+    image_shape = tf.image.extract_jpeg_shape(image_buffer)
+
+    offset_height = tf.constant(0, dtype=tf.int32)
+    offset_width = tf.constant(0, dtype=tf.int32)
+    crop_height = image_shape[0]
+    crop_width = image_shape[1]
+
+    if cfg.DO_RANDOM_CROP > 0:
+        r = tf.random_uniform([], minval=0, maxval=1, dtype=tf.float32)
+        do_crop = tf.less(r, cfg.DO_RANDOM_CROP)
+        rc_cfg = cfg.RANDOM_CROP_CFG
+        bbox_begin, bbox_size, _ = tf.image.sample_distorted_bounding_box(
+            image_shape,
+            bounding_boxes=tf.constant([0.0, 0.0, 1.0, 1.0], dtype=tf.float32, shape=[1, 1, 4]),
+            min_object_covered=0.1,
+            aspect_ratio_range=(rc_cfg.MIN_ASPECT_RATIO, rc_cfg.MAX_ASPECT_RATIO),
+            area_range=(rc_cfg.MIN_AREA, rc_cfg.MAX_AREA),
+            max_attempts=rc_cfg.MAX_ATTEMPTS,
+            use_image_if_no_bounding_boxes=True)
+        offset_height = tf.where(do_crop, bbox_begin[0], offset_height)
+        offset_width = tf.where(do_crop, bbox_begin[1], offset_width)
+        crop_height = tf.where(do_crop, bbox_size[0], crop_height)
+        crop_width = tf.where(do_crop, bbox_size[1], crop_width)
+
+    if cfg.DO_CENTRAL_CROP > 0:
+        r = tf.random_uniform([], minval=0, maxval=1, dtype=tf.float32)
+        do_crop = tf.less(r, cfg.DO_CENTRAL_CROP)
+        # Same arithmetic as tf.image.central_crop
+        margin_height = tf.to_int32((tf.to_float(crop_height) - tf.to_float(crop_height) * cfg.CENTRAL_CROP_FRACTION) / 2)
+        margin_width = tf.to_int32((tf.to_float(crop_width) - tf.to_float(crop_width) * cfg.CENTRAL_CROP_FRACTION) / 2)
+        margin_height = tf.where(do_crop, margin_height, 0)
+        margin_width = tf.where(do_crop, margin_width, 0)
+        offset_height += margin_height
+        offset_width += margin_width
+        crop_height -= 2 * margin_height
+        crop_width -= 2 * margin_width
+
+    crop_window = tf.stack([offset_height, offset_width, crop_height, crop_width])
+    return tf.image.decode_and_crop_jpeg(image_buffer, crop_window, channels=3)
+
+def decode_and_crop_regions(image_buffer, bboxes):
+    """Decode only the part of a jpeg image that is covered by the bounding boxes.
+    Args:
+        image_buffer: scalar string Tensor with the jpeg bytes
+        bboxes: 2-D float Tensor [num_bboxes, 4] arranged [xmin, ymin, xmax, ymax] and normalized
+    Returns:
+        3-D uint8 Tensor of the cropped image, and the bboxes normalized to the cropped image.
+    """
+    image_shape = tf.image.extract_jpeg_shape(image_buffer)
+    image_height = tf.to_float(image_shape[0])
+    image_width = tf.to_float(image_shape[1])
+
+    xmin, ymin, xmax, ymax = tf.unstack(bboxes, axis=1)
+
+    # The window covering all of the boxes. The extra values keep the reductions
+    # well defined when there are no boxes (in which case nothing is extracted anyway).
+    window_ymin = tf.floor(tf.reduce_min(tf.concat([ymin, [1.]], axis=0)) * image_height)
+    window_xmin = tf.floor(tf.reduce_min(tf.concat([xmin, [1.]], axis=0)) * image_width)
+    window_ymax = tf.ceil(tf.reduce_max(tf.concat([ymax, [0.]], axis=0)) * image_height)
+    window_xmax = tf.ceil(tf.reduce_max(tf.concat([xmax, [0.]], axis=0)) * image_width)
+
+    window_ymin = tf.clip_by_value(window_ymin, 0., image_height - 1.)
+    window_xmin = tf.clip_by_value(window_xmin, 0., image_width - 1.)
+    window_ymax = tf.clip_by_value(window_ymax, window_ymin + 1., image_height)
+    window_xmax = tf.clip_by_value(window_xmax, window_xmin + 1., image_width)
+    window_height = window_ymax - window_ymin
+    window_width = window_xmax - window_xmin
+
+    crop_window = tf.to_int32(tf.stack([window_ymin, window_xmin, window_height, window_width]))
+    image = tf.image.decode_and_crop_jpeg(image_buffer, crop_window, channels=3)
+
+    # Express the boxes relative to the window
+    bboxes = tf.stack([
+        (xmin * image_width - window_xmin) / window_width,
+        (ymin * image_height - window_ymin) / window_height,
+        (xmax * image_width - window_xmin) / window_width,
+        (ymax * image_height - window_ymin) / window_height
+    ], axis=1)
+    bboxes = tf.clip_by_value(bboxes, 0., 1.)
+
+    return image, bboxes
+
+def crops_applied_at_decode(cfg):
+    """Returns True if the random crop and central crop are done when decoding the image."""
+    return cfg.REGION_TYPE == 'image' and 'DECODE_AND_CROP' in cfg and cfg.DECODE_AND_CROP
+
+def _distortion_cfg(cfg):
+    """Returns the configuration for `get_distorted_inputs`, without the crops that were done at decode time."""
+    if not crops_applied_at_decode(cfg):
+        return cfg
+    cfg = EasyDict(cfg)
+    cfg.DO_RANDOM_CROP = 0
+    cfg.DO_CENTRAL_CROP = 0
+    return cfg
+
+def get_region_features_to_extract(cfg, fetch_ids=True, fetch_labels=True, fetch_text_labels=True, read_filename=False):
+    """
+    Return the (feature key, name) pairs that `get_region_data` needs from a tfrecord example.
     """
-
-    feature_dict = {}
 
     if cfg.REGION_TYPE == 'bbox':
 
-        bbox_cfg = cfg.BBOX_CFG
-
         features_to_extract = [('image/object/bbox/xmin', 'xmin'),
                                ('image/object/bbox/xmax', 'xmax'),
                                ('image/object/bbox/ymin', 'ymin'),
-                               ('image/object/bbox/ymax', 'ymax'),
                                ('image/object/bbox/ymax', 'ymax')]
 
         if read_filename:
@@ -418,15 +589,103 @@ def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True,
         if fetch_text_labels:
             features_to_extract.append(('image/object/bbox/text', 'text'))
 
-        features = decode_serialized_example(serialized_example, features_to_extract)
+    elif cfg.REGION_TYPE == 'image':
+
+        features_to_extract = []
 
         if read_filename:
-            image_buffer = tf.read_file(features['filename'])
-            image = tf.image.decode_jpeg(image_buffer, channels=3)
+            features_to_extract.append(('image/filename', 'filename'))
         else:
-            image = features['image']
+            features_to_extract.append(('image/encoded', 'image'))
 
-        feature_dict['image'] = image
+        if fetch_ids:
+            features_to_extract.append(('image/id', 'id'))
+
+        if fetch_labels:
+            features_to_extract.append(('image/class/label', 'label'))
+
+        if fetch_text_labels:
+            features_to_extract.append(('image/class/text', 'text'))
+
+    else:
+        raise ValueError("Unknown REGION_TYPE: %s" % (cfg.REGION_TYPE,))
+
+    return features_to_extract
+
+def _parse_region_features(serialized_example, cfg, fetch_ids, fetch_labels, fetch_text_labels, read_filename):
+    """
+    Parse the features needed by `get_region_data`. `serialized_example` can also be a
+    dictionary of features that were already parsed (see `_dataset_batch`).
+    """
+    if isinstance(serialized_example, dict):
+        return serialized_example
+
+    features_to_extract = get_region_features_to_extract(cfg, fetch_ids, fetch_labels, fetch_text_labels, read_filename)
+    return decode_serialized_example(serialized_example, features_to_extract, decode_image=False)
+
+def _image_buffer(features):
+    """
+    Return the encoded image. This is either the `image/encoded` feature, the file contents
+    from a read stage (see `_read_image_file`), or is read here from `image/filename`.
+    """
+    if 'image' in features:
+        return features['image']
+    return tf.read_file(features['filename'])
+
+def _read_image_file(features, image_reader):
+    """
+    Replace the filename in the parsed features with the contents of the file.
+    """
+    features = dict(features)
+    features['image'] = image_reader.read_op(features.pop('filename'))
+    return features
+
+def _queue_read_stage(serialized_example, features_to_extract, image_reader, read_cfg):
+    """
+    Parse the example and read its image file using `read_cfg.NUM_THREADS` queue runner threads,
+    keeping up to `read_cfg.READ_AHEAD` examples ahead of the image decoding.
+    Returns:
+        dictionary of the parsed features, with the file contents stored under 'image'
+    """
+    features = decode_serialized_example(serialized_example, features_to_extract, decode_image=False)
+    features = _read_image_file(features, image_reader)
+
+    names = sorted(features.keys())
+    queue = tf.FIFOQueue(
+        capacity=read_cfg.READ_AHEAD,
+        dtypes=[features[name].dtype for name in names],
+        names=names,
+        name='read_queue'
+    )
+    enqueue_op = queue.enqueue(features)
+    tf.train.add_queue_runner(tf.train.QueueRunner(queue, [enqueue_op] * read_cfg.NUM_THREADS))
+
+    dequeued_features = queue.dequeue()
+    for name in names:
+        dequeued_features[name].set_shape(features[name].get_shape())
+
+    return dequeued_features
+
+def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True, fetch_text_labels=True, read_filename=False):
+    """
+    Return the image, an array of bounding boxes, and an array of ids.
+    `serialized_example` is either a tfrecord example or a dictionary of its parsed features.
+    If `DECODE_AND_CROP` is set, then only the part of the image that is needed is decoded:
+    for 'bbox' regions this is the window covering all of the boxes, and for 'image' regions
+    this is the random crop / central crop (see `crops_applied_at_decode`).
+    """
+
+    feature_dict = {}
+
+    decode_and_crop = 'DECODE_AND_CROP' in cfg and cfg.DECODE_AND_CROP
+
+    if cfg.REGION_TYPE == 'bbox':
+
+        bbox_cfg = cfg.BBOX_CFG
+
+        features = _parse_region_features(serialized_example, cfg, fetch_ids, fetch_labels, fetch_text_labels, read_filename)
+
+        image_buffer = _image_buffer(features)
 
         xmin = tf.expand_dims(features['xmin'], 0)
         ymin = tf.expand_dims(features['ymin'], 0)
@@ -450,6 +709,12 @@ def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True,
         # order the bboxes so that they have the shape: [num_bboxes, bbox_coords]
         bboxes = tf.transpose(bboxes, [1, 0])
 
+        if decode_and_crop:
+            image, bboxes = decode_and_crop_regions(image_buffer, bboxes)
+        else:
+            image = tf.image.decode_jpeg(image_buffer, channels=3)
+
+        feature_dict['image'] = image
         feature_dict['bboxes'] = bboxes
 
         if fetch_ids:
@@ -466,29 +731,14 @@ def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True,
 
     elif cfg.REGION_TYPE == 'image':
 
-        features_to_extract = []
-
-        if read_filename:
-            features_to_extract.append(('image/filename', 'filename'))
-        else:
-            features_to_extract.append(('image/encoded', 'image'))
-
-        if fetch_ids:
-            features_to_extract.append(('image/id', 'id'))
-
-        if fetch_labels:
-            features_to_extract.append(('image/class/label', 'label'))
-
-        if fetch_text_labels:
-            features_to_extract.append(('image/class/text', 'text'))
+        features = _parse_region_features(serialized_example, cfg, fetch_ids, fetch_labels, fetch_text_labels, read_filename)
 
-        features = decode_serialized_example(serialized_example, features_to_extract)
+        image_buffer = _image_buffer(features)
 
-        if read_filename:
-            image_buffer = tf.read_file(features['filename'])
-            image = tf.image.decode_jpeg(image_buffer, channels=3)
+        if decode_and_crop:
+            image = decode_and_crop_image(image_buffer, cfg)
         else:
-            image = features['image']
+            image = tf.image.decode_jpeg(image_buffer, channels=3)
 
         feature_dict['image'] = image
 
@@ -512,12 +762,209 @@ def get_region_data(serialized_example, cfg, fetch_ids=True, fetch_labels=True,
 
     return feature_dict
 
+def _sample_random_crop_boxes(region_heights, region_widths, cfg):
+    """Sample a random crop for each region, in coordinates relative to the region.
+    This mirrors `tf.image.sample_distorted_bounding_box` (with the whole region as the
+    bounding box): up to `MAX_ATTEMPTS` crops are sampled for each region and the first
+    crop that fits inside of the region is used. If no crop fits, then the whole region is used.
+    Args:
+        region_heights: 1-D float Tensor with the height, in pixels, of each region
+        region_widths: 1-D float Tensor with the width, in pixels, of each region
+        cfg: the `RANDOM_CROP_CFG` configuration
+    Returns:
+        a tuple of 1-D Tensors (ymin, xmin, ymax, xmax) relative to each region
+    """
+    num_regions = tf.shape(region_heights)[0]
+    shape = [num_regions, cfg.MAX_ATTEMPTS]
+
+    area = tf.random_uniform(shape, minval=cfg.MIN_AREA, maxval=cfg.MAX_AREA, dtype=tf.float32)
+    aspect_ratio = tf.random_uniform(shape, minval=cfg.MIN_ASPECT_RATIO, maxval=cfg.MAX_ASPECT_RATIO, dtype=tf.float32)
+
+    # Fraction of the region height and width covered by each attempt.
+    # area = h * w, aspect_ratio = w / h, both in pixels.
+    region_heights = tf.expand_dims(tf.maximum(region_heights, 1.), 1)
+    region_widths = tf.expand_dims(tf.maximum(region_widths, 1.), 1)
+    height_fraction = tf.sqrt(area * region_widths / (aspect_ratio * region_heights))
+    width_fraction = tf.sqrt(area * aspect_ratio * region_heights / region_widths)
+
+    valid = tf.logical_and(tf.less_equal(height_fraction, 1.), tf.less_equal(width_fraction, 1.))
+    first_valid = tf.one_hot(tf.argmax(tf.to_int32(valid), axis=1), cfg.MAX_ATTEMPTS, dtype=tf.float32)
+    any_valid = tf.reduce_any(valid, axis=1)
+
+    height_fraction = tf.where(any_valid, tf.reduce_sum(height_fraction * first_valid, axis=1), tf.ones([num_regions]))
+    width_fraction = tf.where(any_valid, tf.reduce_sum(width_fraction * first_valid, axis=1), tf.ones([num_regions]))
+
+    ymin = tf.random_uniform([num_regions], dtype=tf.float32) * (1. - height_fraction)
+    xmin = tf.random_uniform([num_regions], dtype=tf.float32) * (1. - width_fraction)
+
+    return ymin, xmin, ymin + height_fraction, xmin + width_fraction
+
+def _where_each(condition, x, y):
+    """Element wise tf.where over a tuple of 1-D Tensors."""
+    return tuple([tf.where(condition, a, b) for a, b in zip(x, y)])
+
+def _padding_mask(valid_rows, valid_cols, do_flip, size):
+    """A mask that zeros the padding of a batch of resized crops.
+    Args:
+        valid_rows: 1-D float Tensor with the number of rows of each crop that are not padding
+        valid_cols: 1-D float Tensor with the number of columns of each crop that are not padding
+        do_flip: 1-D bool Tensor, the padding of the flipped crops is on the left
+        size: the height and width of the crops
+    Returns:
+        4-D float Tensor [num_crops, size, size, 1]
+    """
+    index = tf.range(size, dtype=tf.float32)
+    rows = tf.less(tf.expand_dims(index, 0), tf.expand_dims(valid_rows, 1))
+    cols = tf.less(tf.expand_dims(index, 0), tf.expand_dims(valid_cols, 1))
+    cols = tf.where(do_flip, tf.reverse(cols, axis=[1]), cols)
+    mask = tf.logical_and(tf.expand_dims(rows, 2), tf.expand_dims(cols, 1))
+    return tf.expand_dims(tf.to_float(mask), 3)
+
+def get_batched_distorted_inputs(original_image, bboxes, cfg, add_summaries):
+    """Crop, resize, flip and color distort all of the regions of an image at once.
+    Rather than looping over the regions, the random crop, central crop and flip for
+    each region are computed as a box in image coordinates, and all of the regions are
+    extracted and resized with a single `tf.image.crop_and_resize`. Color distortion
+    is applied to the batch of regions with different random values for each region.
+    Crops are always resized with bilinear interpolation (`RESIZE_FAST` is ignored).
+    Args:
+        original_image: 3-D uint8 Tensor
+        bboxes: 2-D float Tensor [num_bboxes, 4] arranged [xmin, ymin, xmax, ymax] and normalized
+        cfg: the `IMAGE_PROCESSING` configuration
+        add_summaries: Add tensorboard summaries of the first region
+    Returns:
+        4-D float Tensor [num_bboxes, INPUT_SIZE, INPUT_SIZE, 3] in [0, 1]
+    """
+    with tf.name_scope('batched_distorted_inputs'):
+
+        num_bboxes = tf.shape(bboxes)[0]
+        image_shape = tf.shape(original_image)
+        image_height = tf.cast(image_shape[0], dtype=tf.float32)
+        image_width = tf.cast(image_shape[1], dtype=tf.float32)
+
+        region_xmin, region_ymin, region_xmax, region_ymax = tf.unstack(bboxes, axis=1)
+        region_height = region_ymax - region_ymin
+        region_width = region_xmax - region_xmin
+
+        # The crop for each region, relative to the region
+        whole_region = (tf.zeros([num_bboxes]), tf.zeros([num_bboxes]), tf.ones([num_bboxes]), tf.ones([num_bboxes]))
+        crop = whole_region
+
+        if cfg.DO_RANDOM_CROP > 0:
+            do_crop = tf.less(tf.random_uniform([num_bboxes], minval=0, maxval=1, dtype=tf.float32), cfg.DO_RANDOM_CROP)
+            random_crop = _sample_random_crop_boxes(region_height * image_height, region_width * image_width, cfg.RANDOM_CROP_CFG)
+            crop = _where_each(do_crop, random_crop, crop)
+
+        if cfg.DO_CENTRAL_CROP > 0:
+            do_crop = tf.less(tf.random_uniform([num_bboxes], minval=0, maxval=1, dtype=tf.float32), cfg.DO_CENTRAL_CROP)
+            crop_ymin, crop_xmin, crop_ymax, crop_xmax = crop
+            margin = (1. - cfg.CENTRAL_CROP_FRACTION) / 2.
+            y_margin = margin * (crop_ymax - crop_ymin)
+            x_margin = margin * (crop_xmax - crop_xmin)
+            central_crop = (crop_ymin + y_margin, crop_xmin + x_margin, crop_ymax - y_margin, crop_xmax - x_margin)
+            crop = _where_each(do_crop, central_crop, crop)
+
+        # Convert the crops to normalized image coordinates
+        crop_ymin, crop_xmin, crop_ymax, crop_xmax = crop
+        ymin = region_ymin + crop_ymin * region_height
+        xmin = region_xmin + crop_xmin * region_width
+        ymax = region_ymin + crop_ymax * region_height
+        xmax = region_xmin + crop_xmax * region_width
+
+        if cfg.MAINTAIN_ASPECT_RATIO:
+            # Extend the boxes past the bottom / right of the crops so that they are square.
+            # The extension samples real pixels (unless it falls outside of the image), so
+            # the part of each resized crop that is outside of the crop is zeroed below.
+            crop_height = (ymax - ymin) * image_height
+            crop_width = (xmax - xmin) * image_width
+            side = tf.maximum(crop_height, crop_width)
+            ymax = ymin + side / image_height
+            xmax = xmin + side / image_width
+            # The crop is resized to the same size as in `_largest_size_at_most`
+            full_side = tf.fill([num_bboxes], float(cfg.INPUT_SIZE))
+            valid_rows = tf.where(crop_height >= crop_width, full_side, tf.floor(crop_height * cfg.INPUT_SIZE / side))
+            valid_cols = tf.where(crop_width >= crop_height, full_side, tf.floor(crop_width * cfg.INPUT_SIZE / side))
+
+        # Flip the boxes, crop_and_resize will flip the crops when xmin > xmax
+        if cfg.DO_RANDOM_FLIP_LEFT_RIGHT > 0:
+            do_flip = tf.less(tf.random_uniform([num_bboxes], minval=0, maxval=1, dtype=tf.float32), 0.5)
+            xmin, xmax = _where_each(do_flip, (xmax, xmin), (xmin, xmax))
+        else:
+            do_flip = tf.zeros([num_bboxes], dtype=tf.bool)
+
+        boxes = tf.stack([ymin, xmin, ymax, xmax], axis=1)
+        distorted_inputs = tf.image.crop_and_resize(
+            image=tf.expand_dims(original_image, 0),
+            boxes=boxes,
+            box_ind=tf.zeros([num_bboxes], dtype=tf.int32),
+            crop_size=[cfg.INPUT_SIZE, cfg.INPUT_SIZE],
+            method='bilinear',
+            extrapolation_value=0
+        )
+        # crop_and_resize returns floats in the range of the original image dtype
+        if original_image.dtype != tf.float32:
+            distorted_inputs = distorted_inputs / original_image.dtype.max
+
+        if cfg.MAINTAIN_ASPECT_RATIO:
+            # Pad the bottom / right of each crop, which is on the left after a flip.
+            distorted_inputs = distorted_inputs * _padding_mask(valid_rows, valid_cols, do_flip, cfg.INPUT_SIZE)
+
+        if add_summaries:
+            resized_inputs = distorted_inputs
+
+        if cfg.DO_COLOR_DISTORTION > 0:
+            do_color_distortion = tf.less(tf.random_uniform([num_bboxes], minval=0, maxval=1, dtype=tf.float32), cfg.DO_COLOR_DISTORTION)
+            num_color_cases = 1 if cfg.COLOR_DISTORT_FAST else 4
+            distorted_color_inputs = apply_with_random_selector(
+              distorted_inputs,
+              lambda x, ordering: distort_color_batched(x, ordering, fast_mode=cfg.COLOR_DISTORT_FAST),
+              num_cases=num_color_cases)
+            distorted_inputs = tf.where(do_color_distortion, distorted_color_inputs, distorted_inputs)
+
+        distorted_inputs.set_shape([None, cfg.INPUT_SIZE, cfg.INPUT_SIZE, 3])
+
+        # Add summaries for the first region
+        if add_summaries:
+            region = tf.stack([region_ymin[0], region_xmin[0], region_ymax[0], region_xmax[0]])
+            region_side = tf.maximum(region_height[0] * image_height, region_width[0] * image_width)
+            region_scale_y = region_height[0] * image_height / region_side
+            region_scale_x = region_width[0] * image_width / region_side
+            # Resize the region maintaining its aspect ratio and padding the bottom / right
+            padded_region = tf.stack([region[0], region[1],
+                                      region[0] + region_side / image_height,
+                                      region[1] + region_side / image_width])
+            original_region = tf.image.crop_and_resize(
+                image=tf.expand_dims(original_image, 0),
+                boxes=tf.expand_dims(padded_region, 0),
+                box_ind=tf.zeros([1], dtype=tf.int32),
+                crop_size=[cfg.INPUT_SIZE, cfg.INPUT_SIZE]
+            )
+            if original_image.dtype != tf.float32:
+                original_region = original_region / original_image.dtype.max
+            original_region = original_region * _padding_mask(
+                tf.floor(tf.expand_dims(region_scale_y, 0) * cfg.INPUT_SIZE),
+                tf.floor(tf.expand_dims(region_scale_x, 0) * cfg.INPUT_SIZE),
+                tf.zeros([1], dtype=tf.bool), cfg.INPUT_SIZE)
+            crop_in_region = tf.stack([crop_ymin[0] * region_scale_y, crop_xmin[0] * region_scale_x,
+                                       crop_ymax[0] * region_scale_y, crop_xmax[0] * region_scale_x])
+            region_with_crop = tf.image.draw_bounding_boxes(original_region, tf.reshape(crop_in_region, [1, 1, 4]))
+
+            tf.summary.image('0.original_image', original_region)
+            tf.summary.image('1.image_with_random_crop', region_with_crop)
+            tf.summary.image('2.cropped_resized_image', resized_inputs[:1])
+            tf.summary.image('3.final_distorted_image', distorted_inputs[:1])
+
+        return distorted_inputs
+
 def bbox_crop_loop_cond(original_image, bboxes, distorted_inputs, image_summaries, current_index):
     num_bboxes = tf.shape(bboxes)[0]
     return current_index < num_bboxes
 
 def get_distorted_inputs(original_image, bboxes, cfg, add_summaries):
 
+    if 'BATCHED_REGION_CROPS' in cfg and cfg.BATCHED_REGION_CROPS:
+        return get_batched_distorted_inputs(original_image, bboxes, cfg, add_summaries)
+
     distorter = DistortedInputs(cfg, add_summaries)
     num_bboxes = tf.shape(bboxes)[0]
     distorted_inputs = tf.TensorArray(
@@ -556,7 +1003,31 @@ def get_distorted_inputs(original_image, bboxes, cfg, add_summaries):
 
     return distorted_inputs
 
-def create_training_batch(serialized_example, cfg, add_summaries, read_filenames=False):
+def _to_network_inputs(distorted_inputs):
+    """Scale images in [0, 1] to [-1, 1]."""
+    distorted_inputs = tf.subtract(distorted_inputs, 0.5)
+    distorted_inputs = tf.multiply(distorted_inputs, 2.0)
+    return distorted_inputs
+
+def _to_batch_inputs(distorted_inputs, uint8_inputs=False):
+    """The distorted inputs as they go into the batch: either scaled for the network, or as
+    uint8 to be scaled by `normalize_inputs` after batching."""
+    if uint8_inputs:
+        return tf.image.convert_image_dtype(distorted_inputs, dtype=tf.uint8, saturate=True)
+    return _to_network_inputs(distorted_inputs)
+
+def normalize_inputs(inputs):
+    """
+    Convert a batch of uint8 inputs (see `uint8_inputs` in `input_nodes`) to float32 in [-1, 1].
+    Call this on the compute device, just before the network. Float inputs are already
+    scaled and are returned unchanged.
+    """
+    if inputs.dtype == tf.float32:
+        return inputs
+    inputs = tf.image.convert_image_dtype(inputs, dtype=tf.float32)
+    return _to_network_inputs(inputs)
+
+def create_training_batch(serialized_example, cfg, add_summaries, read_filenames=False, uint8_inputs=False):
 
     features = get_region_data(serialized_example, cfg, fetch_ids=False,
                                fetch_labels=True, fetch_text_labels=False, read_filename=read_filenames)
@@ -565,10 +1036,9 @@ def create_training_batch(serialized_example, cfg, add_summaries, read_filenames
     bboxes = features['bboxes']
     labels = features['labels']
 
-    distorted_inputs = get_distorted_inputs(original_image, bboxes, cfg, add_summaries)
+    distorted_inputs = get_distorted_inputs(original_image, bboxes, _distortion_cfg(cfg), add_summaries)
 
-    distorted_inputs = tf.subtract(distorted_inputs, 0.5)
-    distorted_inputs = tf.multiply(distorted_inputs, 2.0)
+    distorted_inputs = _to_batch_inputs(distorted_inputs, uint8_inputs)
 
     names = ('inputs', 'labels')
     tensors = [distorted_inputs, labels]
@@ -588,7 +1058,7 @@ def create_visualization_batch(serialized_example, cfg, add_summaries, fetch_tex
 
     cpy_original_image = tf.identity(original_image)
 
-    distorted_inputs = get_distorted_inputs(original_image, bboxes, cfg, add_summaries)
+    distorted_inputs = get_distorted_inputs(original_image, bboxes, _distortion_cfg(cfg), add_summaries)
 
     original_image = cpy_original_image
 
@@ -617,7 +1087,7 @@ def create_visualization_batch(serialized_example, cfg, add_summaries, fetch_tex
 
     return [names, tensors]
 
-def create_classification_batch(serialized_example, cfg, add_summaries, read_filenames=False):
+def create_classification_batch(serialized_example, cfg, add_summaries, read_filenames=False, uint8_inputs=False):
 
     features = get_region_data(serialized_example, cfg, fetch_ids=True,
                                fetch_labels=False, fetch_text_labels=False, read_filename=read_filenames)
@@ -626,19 +1096,320 @@ def create_classification_batch(serialized_example, cfg, add_summaries, read_fil
     bboxes = features['bboxes']
     ids = features['ids']
 
-    distorted_inputs = get_distorted_inputs(original_image, bboxes, cfg, add_summaries)
+    distorted_inputs = get_distorted_inputs(original_image, bboxes, _distortion_cfg(cfg), add_summaries)
 
-    distorted_inputs = tf.subtract(distorted_inputs, 0.5)
-    distorted_inputs = tf.multiply(distorted_inputs, 2.0)
+    distorted_inputs = _to_batch_inputs(distorted_inputs, uint8_inputs)
 
     names = ('inputs', 'ids')
     tensors = [distorted_inputs, ids]
     return [names, tensors]
 
+def _parse_serialized_batch(serialized_examples, features_to_extract):
+    """
+    Parse a batch of serialized examples with a single op. Variable length features are
+    padded to dense tensors and their lengths are stored under `<name>/length`.
+    """
+    features = decode_serialized_examples(serialized_examples, features_to_extract)
+
+    parsed_features = {}
+    for feature_name, feature in features.items():
+        if isinstance(feature, tf.SparseTensor):
+            default_value = '' if feature.dtype == tf.string else 0
+            parsed_features[feature_name] = tf.sparse_tensor_to_dense(feature, default_value=default_value)
+            row_indices = feature.indices[:, 0]
+            parsed_features[feature_name + '/length'] = tf.to_int32(tf.unsorted_segment_sum(
+                tf.ones_like(row_indices), row_indices, num_segments=tf.shape(serialized_examples)[0]))
+        else:
+            parsed_features[feature_name] = feature
+
+    return parsed_features
+
+def _trim_parsed_features(parsed_features):
+    """
+    Undo the padding of `_parse_serialized_batch` for a single example.
+    """
+    features = {}
+    for feature_name, feature in parsed_features.items():
+        if feature_name.endswith('/length'):
+            continue
+        length_name = feature_name + '/length'
+        if length_name in parsed_features:
+            feature = feature[:parsed_features[length_name]]
+        features[feature_name] = feature
+    return features
+
+def _dataset_batch(tfrecords, create_batch_fn, num_epochs=None, batch_size=32, num_threads=2,
+                   shuffle_batch=True, random_seed=1, capacity=1000, min_after_dequeue=96,
+                   features_to_extract=None, image_reader=None, read_cfg=None, skip_files=0):
+    """
+    Build the batch using a tf.data pipeline rather than queue runners.
+    Args:
+        tfrecords: list of tfrecord file paths
+        create_batch_fn: function mapping a serialized example (or a dictionary of its parsed
+            features) to [names, tensors], where each tensor has a leading dimension of the
+            number of regions in the example.
+        features_to_extract: if provided, the records are parsed in batches with
+            `tf.parse_example` and `create_batch_fn` receives the parsed features.
+        image_reader: if provided (along with `features_to_extract` and `read_cfg`), then the image
+            files are read by a separate stage with `read_cfg.NUM_THREADS` parallel reads, up to
+            `read_cfg.READ_AHEAD` examples ahead of the image decoding.
+        skip_files: the number of tfrecord files (counting every epoch) to skip, see `input_nodes`
+    Returns:
+        a tuple of the batch keys and the batched tensors
+    """
+
+    # The batch keys are only known once the parse function has been traced.
+    batch_keys = []
+    def parse_example(serialized_example):
+        if features_to_extract is not None:
+            serialized_example = _trim_parsed_features(serialized_example)
+        names, tensors = create_batch_fn(serialized_example)
+        batch_keys.extend(names)
+        return tuple([tf.convert_to_tensor(tensor) for tensor in tensors])
+
+    dataset = tf.data.Dataset.from_tensor_slices(tfrecords)
+    if shuffle_batch:
+        dataset = dataset.shuffle(buffer_size=len(tfrecords), seed=random_seed)
+    dataset = dataset.repeat(num_epochs)
+
+    # The file order is the same as in the resumed job, so skip the files that it already read
+    if skip_files > 0:
+        dataset = dataset.skip(skip_files)
+
+    # Read from several tfrecord shards at once
+    dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=max(1, min(num_threads, len(tfrecords))),
+        sloppy=shuffle_batch
+    ))
+
+    if features_to_extract is not None:
+        # Parse a batch of records with one op, then go back to single examples for decoding
+        dataset = dataset.batch(batch_size)
+        dataset = dataset.map(lambda serialized_examples: _parse_serialized_batch(serialized_examples, features_to_extract),
+                              num_parallel_calls=num_threads)
+        dataset = dataset.flat_map(lambda features: tf.data.Dataset.from_tensor_slices(features))
+
+        if image_reader is not None:
+            dataset = dataset.map(lambda features: _read_image_file(features, image_reader),
+                                  num_parallel_calls=read_cfg.NUM_THREADS)
+            dataset = dataset.prefetch(buffer_size=read_cfg.READ_AHEAD)
+
+    dataset = dataset.map(parse_example, num_parallel_calls=num_threads)
+
+    # Each example can produce multiple regions, so split them into separate elements
+    dataset = dataset.flat_map(lambda *tensors: tf.data.Dataset.from_tensor_slices(tensors))
+
+    if shuffle_batch:
+        dataset = dataset.shuffle(buffer_size=max(capacity, min_after_dequeue + batch_size), seed=random_seed + skip_files)
+
+    batch = _batch_and_prefetch(dataset, batch_size, min_after_dequeue)
+
+    return batch_keys, batch
+
+def _batch_and_prefetch(dataset, batch_size, min_after_dequeue):
+    """
+    Batch the regions of a dataset and return the next batch.
+    """
+    # Drop the final partial batch so that the batch dimension is static (like tf.train.batch)
+    dataset = dataset.apply(tf.contrib.data.batch_and_drop_remainder(batch_size))
+    dataset = dataset.prefetch(buffer_size=max(1, min_after_dequeue // batch_size))
+
+    iterator = dataset.make_one_shot_iterator()
+    batch = iterator.get_next()
+    for tensor in nest.flatten(batch):
+        tf.add_to_collection(BATCH_TENSORS_COLLECTION, tensor)
+    return batch
+
+def _extract_region(image, bbox, max_side):
+    """
+    Crop a region out of the image and shrink it so that its longest side is at most `max_side`.
+    Args:
+        image: 3-D uint8 Tensor
+        bbox: 1-D float Tensor [xmin, ymin, xmax, ymax], normalized
+    Returns:
+        3-D uint8 Tensor
+    """
+    image_shape = tf.shape(image)
+    image_height = tf.cast(image_shape[0], dtype=tf.float32)
+    image_width = tf.cast(image_shape[1], dtype=tf.float32)
+
+    # Same arithmetic as DistortedInputs
+    xmin = tf.cast(bbox[0] * image_width, tf.int32)
+    ymin = tf.cast(bbox[1] * image_height, tf.int32)
+    xmax = tf.cast(bbox[2] * image_width, tf.int32)
+    ymax = tf.cast(bbox[3] * image_height, tf.int32)
+    region_height = ymax - ymin
+    region_width = xmax - xmin
+
+    region = tf.image.crop_to_bounding_box(
+        image=image,
+        offset_height=ymin,
+        offset_width=xmin,
+        target_height=region_height,
+        target_width=region_width
+    )
+
+    new_height, new_width = _largest_size_at_most(region_height, region_width, max_side)
+    do_shrink = tf.greater(tf.maximum(region_height, region_width), max_side)
+    region = tf.cond(do_shrink,
+        lambda: tf.saturate_cast(tf.round(tf.image.resize_images(region, [new_height, new_width],
+                                                                 method=tf.image.ResizeMethod.AREA)), tf.uint8),
+        lambda: tf.identity(region)
+    )
+    region.set_shape([None, None, 3])
+
+    return region
+
+def _cached_dataset_batch(tfrecords, cfg, cache_path, max_side, num_epochs=None, batch_size=32, num_threads=2,
+                          shuffle_batch=True, random_seed=1, capacity=1000, min_after_dequeue=96,
+                          read_filenames=False, uint8_inputs=False, random_seed_offset=0):
+    """
+    Build a training batch using a tf.data pipeline that caches the extracted regions on disk.
+    The first epoch extracts each region, shrinks it to at most `max_side` and stores it as uint8.
+    Later epochs read the regions from the cache and only do the random crop, resize, flip and
+    color distortion. The first epoch has to read every file to complete the cache, so a resumed
+    job only offsets the shuffle seed (by `random_seed_offset`) rather than skipping files.
+    Returns:
+        a tuple of the batch keys and the batched tensors
+    """
+
+    # The random crops are done on the cached regions, not when decoding
+    region_cfg = cfg
+    if crops_applied_at_decode(cfg):
+        region_cfg = EasyDict(cfg)
+        region_cfg.DECODE_AND_CROP = False
+
+    def extract_regions(serialized_example):
+        features = get_region_data(serialized_example, region_cfg, fetch_ids=False,
+                                   fetch_labels=True, fetch_text_labels=False, read_filename=read_filenames)
+        return features['image'], features['bboxes'], tf.convert_to_tensor(features['labels'])
+
+    def split_regions(image, bboxes, labels):
+        regions = tf.data.Dataset.from_tensor_slices((bboxes, labels))
+        return regions.map(lambda bbox, label: (_extract_region(image, bbox, max_side), label))
+
+    def distort_region(region, label):
+        distorted_inputs = get_distorted_inputs(region, tf.constant([[0.0, 0.0, 1.0, 1.0]]), cfg, False)
+        distorted_inputs = _to_batch_inputs(distorted_inputs, uint8_inputs)
+        return distorted_inputs[0], label
+
+    dataset = tf.data.Dataset.from_tensor_slices(tfrecords)
+    dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+        tf.data.TFRecordDataset,
+        cycle_length=max(1, min(num_threads, len(tfrecords))),
+        sloppy=shuffle_batch
+    ))
+    dataset = dataset.map(extract_regions, num_parallel_calls=num_threads)
+    dataset = dataset.flat_map(split_regions)
+
+    dataset = dataset.cache(cache_path)
+    dataset = dataset.repeat(num_epochs)
+
+    # Shuffle the (small) uint8 regions rather than the distorted inputs
+    if shuffle_batch:
+        dataset = dataset.shuffle(buffer_size=max(capacity, min_after_dequeue + batch_size), seed=random_seed + random_seed_offset)
+
+    dataset = dataset.map(distort_region, num_parallel_calls=num_threads)
+
+    batch = _batch_and_prefetch(dataset, batch_size, min_after_dequeue)
+
+    return ('inputs', 'labels'), batch
+
+def add_sampled_image_summaries(tfrecords, cfg, read_filenames=False):
+    """
+    Add the '0.original_image' ... '3.final_distorted_image' summaries for the first region of
+    an example. The example is read by a separate (small) tf.data pipeline, so this work is
+    only done when the summary op is run (e.g. every `SAVE_SUMMARY_SECS`) rather than for
+    every example that goes into a batch.
+    """
+    with tf.name_scope('image_summaries'):
+
+        def extract_regions(serialized_example):
+            features = get_region_data(serialized_example, cfg, fetch_ids=False,
+                                       fetch_labels=False, fetch_text_labels=False, read_filename=read_filenames)
+            return features['image'], features['bboxes']
+
+        dataset = tf.data.Dataset.from_tensor_slices(tfrecords)
+        dataset = dataset.shuffle(buffer_size=len(tfrecords))
+        dataset = dataset.repeat()
+        dataset = dataset.flat_map(tf.data.TFRecordDataset)
+        dataset = dataset.shuffle(buffer_size=100)
+        dataset = dataset.map(extract_regions)
+        dataset = dataset.filter(lambda image, bboxes: tf.greater(tf.shape(bboxes)[0], 0))
+
+        iterator = dataset.make_one_shot_iterator()
+        original_image, bboxes = iterator.get_next()
+
+        get_distorted_inputs(original_image, bboxes[:1], _distortion_cfg(cfg), add_summaries=True)
+
+def _batch_features_to_extract(cfg, input_type, fetch_text_labels=False, read_filenames=False):
+    """
+    Return the features that the `create_*_batch` function for `input_type` will use.
+    """
+    if input_type=='train' or input_type=='test':
+        return get_region_features_to_extract(cfg, fetch_ids=False, fetch_labels=True,
+                                              fetch_text_labels=False, read_filename=read_filenames)
+    elif input_type=='visualize':
+        return get_region_features_to_extract(cfg, fetch_ids=True, fetch_labels=True,
+                                              fetch_text_labels=fetch_text_labels, read_filename=read_filenames)
+    else:
+        return get_region_features_to_extract(cfg, fetch_ids=True, fetch_labels=False,
+                                              fetch_text_labels=False, read_filename=read_filenames)
+
+QUEUE_OP_TYPES = ('FIFOQueueV2', 'RandomShuffleQueueV2', 'PaddingFIFOQueueV2')
+
+def queue_fill_ops(graph):
+    """ Return a dictionary mapping queue names to ops that compute the fraction of the queue that is full.
+    The 'dataset' pipeline has no queues.
+    """
+    fill_ops = {}
+    for op in graph.get_operations():
+        if op.type in QUEUE_OP_TYPES:
+            capacity = op.get_attr('capacity')
+            if capacity <= 0:
+                continue
+            size = gen_data_flow_ops.queue_size_v2(op.outputs[0])
+            fill_ops[op.name] = tf.to_float(size) / capacity
+    return fill_ops
+
+def synthetic_input_nodes(batch_size, input_size, num_classes, input_type='train', uint8_inputs=False):
+    """
+    Return a batch of random inputs (and labels / ids) that skips all reading and preprocessing.
+    The values are generated once and stored in local variables, so every step returns the same
+    batch. This is useful to find the speed of the model when it is not limited by the inputs.
+    """
+    if input_type == 'visualize':
+        raise ValueError("The `synthetic` input pipeline does not support the `visualize` input type.")
+
+    def local_variable(initial_value, name):
+        return tf.Variable(initial_value, trainable=False, name=name,
+                           collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+    batch_dict = {}
+
+    if uint8_inputs:
+        random_inputs = tf.random_uniform([batch_size, input_size, input_size, 3], minval=0, maxval=256, dtype=tf.int32)
+        batch_dict['inputs'] = local_variable(tf.cast(random_inputs, tf.uint8), name='synthetic_inputs')
+    else:
+        random_inputs = tf.random_uniform([batch_size, input_size, input_size, 3], minval=-1., maxval=1., dtype=tf.float32)
+        batch_dict['inputs'] = local_variable(random_inputs, name='synthetic_inputs')
+
+    if input_type == 'train' or input_type == 'test':
+        if num_classes is None:
+            raise ValueError("`num_classes` is needed for the `synthetic` input pipeline.")
+        random_labels = tf.random_uniform([batch_size], minval=0, maxval=num_classes, dtype=tf.int64)
+        batch_dict['labels'] = local_variable(random_labels, name='synthetic_labels')
+    else:
+        batch_dict['ids'] = tf.constant(['synthetic_%d' % (i,) for i in range(batch_size)])
+
+    return batch_dict
+
 def input_nodes(tfrecords, cfg, num_epochs=None, batch_size=32, num_threads=2,
                 shuffle_batch = True, random_seed=1, capacity = 1000, min_after_dequeue = 96,
                 add_summaries=True, input_type='train', fetch_text_labels=False,
-                read_filenames=False):
+                read_filenames=False, pipeline='queue', region_cache_cfg=None, uint8_inputs=False,
+                read_cfg=None, num_classes=None, skip_files=0, num_examples=None):
     """
     Args:
         tfrecords:
@@ -649,51 +1420,149 @@ def input_nodes(tfrecords, cfg, num_epochs=None, batch_size=32, num_threads=2,
         shuffle_batch:
         capacity:
         min_after_dequeue:
-        add_summaries: Add tensorboard summaries of the images
+        add_summaries: Add tensorboard summaries of the images (for a sampled example, see
+            `add_sampled_image_summaries`)
         input_type: 'train', 'visualize', 'test', 'classification'
+        pipeline: 'queue' to use queue runners, 'dataset' to use a tf.data pipeline, 'synthetic' to
+            skip the tfrecords and use random inputs (see `synthetic_input_nodes`)
+        region_cache_cfg: the `REGION_CACHE` configuration. If enabled, then the extracted regions
+            are cached on disk (only for the 'dataset' pipeline and the 'train' input type)
+        uint8_inputs: Keep the 'inputs' as uint8 through shuffling and batching. Use
+            `normalize_inputs` to convert the batch for the network. Ignored for the 'visualize' input type.
+        read_cfg: the `READ_IMAGES_CFG` configuration. When `read_filenames` is True, the image files
+            are read by a dedicated stage with `NUM_THREADS` concurrent reads and a `READ_AHEAD`
+            window, optionally copying them to `LOCAL_CACHE_DIR`.
+        num_classes: the number of classes, used to generate labels for the 'synthetic' pipeline
+        skip_files: when resuming a job, the number of tfrecord files (counting every epoch) that it
+            has already read. The 'dataset' pipeline (without the region cache) replays the file order
+            and skips these files. The seeds of the example shuffling are offset by it for all of the
+            pipelines, so that the resumed job doesn't repeat the shuffling of the first job.
+        num_examples: the number of regions in the tfrecords, used to estimate the size of the region
+            cache before building it
     """
     with tf.name_scope('inputs'):
 
-        # A producer to generate tfrecord file paths
-        filename_queue = tf.train.string_input_producer(
-          tfrecords,
-          num_epochs=num_epochs
-        )
-
-        # Construct a Reader to read examples from the tfrecords file
-        reader = tf.TFRecordReader()
-        _, serialized_example = reader.read(filename_queue)
-
-        if input_type=='train' or input_type=='test':
-            batch_keys, data_to_batch = create_training_batch(serialized_example, cfg, add_summaries, read_filenames)
-        elif input_type=='visualize':
-            batch_keys, data_to_batch = create_visualization_batch(serialized_example, cfg, add_summaries, fetch_text_labels, read_filenames)
-        elif input_type=='classification':
-            batch_keys, data_to_batch = create_classification_batch(serialized_example, cfg, add_summaries, read_filenames)
-        else:
+        if input_type not in ('train', 'test', 'visualize', 'classification'):
             raise ValueError("Unknown input type: %s. Options are `train`, `test`, " \
                              "`visualize`, and `classification`." % (input_type,))
 
-        if shuffle_batch:
-            batch = tf.train.shuffle_batch(
-                data_to_batch,
+        if pipeline == 'synthetic':
+            return synthetic_input_nodes(batch_size, cfg.INPUT_SIZE, num_classes, input_type, uint8_inputs)
+
+        # The image summaries are built from their own examples (see `add_sampled_image_summaries`)
+        # so that the batches don't pay for them.
+        if add_summaries:
+            add_sampled_image_summaries(tfrecords, cfg, read_filenames)
+
+        def create_batch(serialized_example):
+            if input_type=='train' or input_type=='test':
+                return create_training_batch(serialized_example, cfg, False, read_filenames, uint8_inputs)
+            elif input_type=='visualize':
+                return create_visualization_batch(serialized_example, cfg, False, fetch_text_labels, read_filenames)
+            else:
+                return create_classification_batch(serialized_example, cfg, False, read_filenames, uint8_inputs)
+
+        image_reader = None
+        if read_filenames and read_cfg is not None:
+            image_reader = file_reader.ImageFileReader(
+                local_cache_dir=read_cfg.LOCAL_CACHE_DIR if 'LOCAL_CACHE_DIR' in read_cfg else None,
+                log_every_n=read_cfg.LOG_LATENCY_EVERY_N if 'LOG_LATENCY_EVERY_N' in read_cfg else 0
+            )
+
+        use_region_cache = region_cache_cfg is not None and region_cache_cfg.ENABLED
+        cache_path = None
+        if use_region_cache:
+            if pipeline != 'dataset' or input_type != 'train':
+                raise ValueError("The region cache requires the `dataset` input pipeline and the `train` input type.")
+            region_cache.check_deterministic_regions(cfg)
+            max_side = region_cache.cached_region_max_side(cfg, region_cache_cfg)
+            key = region_cache.cache_key(tfrecords, cfg, max_side, read_filenames)
+            estimated_size = region_cache.estimate_cache_size(num_examples, max_side) if num_examples else None
+            cache_path = region_cache.prepare_cache(region_cache_cfg.CACHE_DIR, key, region_cache_cfg.MAX_SIZE_GB,
+                                                    estimated_size)
+
+        if cache_path is not None:
+
+            batch_keys, batch = _cached_dataset_batch(
+                tfrecords,
+                cfg,
+                cache_path,
+                max_side,
+                num_epochs=num_epochs,
                 batch_size=batch_size,
                 num_threads=num_threads,
-                capacity= capacity,
-                min_after_dequeue= min_after_dequeue,
-                seed = random_seed,
-                enqueue_many=True
+                shuffle_batch=shuffle_batch,
+                random_seed=random_seed,
+                capacity=capacity,
+                min_after_dequeue=min_after_dequeue,
+                read_filenames=read_filenames,
+                uint8_inputs=uint8_inputs,
+                random_seed_offset=skip_files
             )
 
-        else:
-            batch = tf.train.batch(
-                data_to_batch,
+        elif pipeline == 'dataset':
+
+            batch_keys, batch = _dataset_batch(
+                tfrecords,
+                create_batch,
+                num_epochs=num_epochs,
                 batch_size=batch_size,
                 num_threads=num_threads,
-                capacity= capacity,
-                enqueue_many=True
+                shuffle_batch=shuffle_batch,
+                random_seed=random_seed,
+                capacity=capacity,
+                min_after_dequeue=min_after_dequeue,
+                features_to_extract=_batch_features_to_extract(cfg, input_type, fetch_text_labels, read_filenames),
+                image_reader=image_reader,
+                read_cfg=read_cfg,
+                skip_files=skip_files
+            )
+
+        elif pipeline == 'queue':
+
+            # A producer to generate tfrecord file paths
+            filename_queue = tf.train.string_input_producer(
+              tfrecords,
+              num_epochs=num_epochs
             )
 
+            # Construct a Reader to read examples from the tfrecords file
+            reader = tf.TFRecordReader()
+            _, serialized_example = reader.read(filename_queue)
+
+            if image_reader is not None:
+                serialized_example = _queue_read_stage(
+                    serialized_example,
+                    _batch_features_to_extract(cfg, input_type, fetch_text_labels, read_filenames),
+                    image_reader,
+                    read_cfg
+                )
+
+            batch_keys, data_to_batch = create_batch(serialized_example)
+
+            if shuffle_batch:
+                batch = tf.train.shuffle_batch(
+                    data_to_batch,
+                    batch_size=batch_size,
+                    num_threads=num_threads,
+                    capacity= capacity,
+                    min_after_dequeue= min_after_dequeue,
+                    seed = random_seed + skip_files,
+                    enqueue_many=True
+                )
+
+            else:
+                batch = tf.train.batch(
+                    data_to_batch,
+                    batch_size=batch_size,
+                    num_threads=num_threads,
+                    capacity= capacity,
+                    enqueue_many=True
+                )
+
+        else:
+            raise ValueError("Unknown input pipeline: %s. Options are `queue`, `dataset` and `synthetic`." % (pipeline,))
+
         batch_dict = {k : v for k, v in zip(batch_keys, batch)}
 
-        return batch_dict
\ No newline at end of file
+        return batch_dict
@@ -0,0 +1,53 @@
+"""Tests for the preprocessing of the training inputs."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from easydict import EasyDict
+import numpy as np
+import tensorflow as tf
+
+from preprocessing import inputs
+
+
+def _distortion_cfg(batched):
+  return EasyDict({
+    'INPUT_SIZE': 16,
+    'BATCHED_REGION_CROPS': batched,
+    'DO_RANDOM_CROP': 0,
+    'DO_CENTRAL_CROP': 0,
+    'MAINTAIN_ASPECT_RATIO': True,
+    'RESIZE_FAST': True,
+    'DO_RANDOM_FLIP_LEFT_RIGHT': False,
+    'DO_COLOR_DISTORTION': 0
+  })
+
+
+class BatchedDistortedInputsTest(tf.test.TestCase):
+
+  def testNonSquareCropMatchesPaddedResize(self):
+    # A wide region at the top of the image, so that squaring the box would reach real pixels.
+    image = tf.fill([40, 60, 3], tf.constant(200, dtype=tf.uint8))
+    bboxes = tf.constant([[0.0, 0.0, 0.5, 0.25]]) # xmin, ymin, xmax, ymax
+    batched = inputs.get_distorted_inputs(image, bboxes, _distortion_cfg(True), add_summaries=False)
+    baseline = inputs.get_distorted_inputs(image, bboxes, _distortion_cfg(False), add_summaries=False)
+    with self.test_session() as sess:
+      batched_value, baseline_value = sess.run([batched, baseline])
+    self.assertEqual(batched_value.shape, (1, 16, 16, 3))
+    # 10 x 30 pixels resized to 5 x 16, the remaining rows are padding.
+    self.assertAllEqual(batched_value[:, 5:], np.zeros([1, 11, 16, 3]))
+    self.assertAllClose(batched_value, baseline_value)
+
+  def testPaddingMaskOfFlippedCrops(self):
+    mask = inputs._padding_mask(tf.constant([4., 2.]), tf.constant([2., 3.]),
+                                tf.constant([False, True]), 4)
+    with self.test_session():
+      mask = mask.eval()[:, :, :, 0]
+    self.assertAllEqual(mask[0], [[1, 1, 0, 0]] * 4)
+    # The padding of a flipped crop is on the left
+    self.assertAllEqual(mask[1], [[0, 1, 1, 1]] * 2 + [[0, 0, 0, 0]] * 2)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,166 @@
+"""
+Bookkeeping for the on-disk cache of extracted regions (see `inputs.input_nodes`).
+
+Each cache lives in its own sub directory of `CACHE_DIR`. The name of the sub directory is
+a hash of the tfrecord files and the region extraction configuration, so changing either
+of them results in a new cache. Least recently used caches are deleted to keep `CACHE_DIR`
+under `MAX_SIZE_GB`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+
+import tensorflow as tf
+
+# The file prefix that is passed to `tf.data.Dataset.cache`
+CACHE_PREFIX = 'regions'
+
+# Written when a finished cache was larger than `MAX_SIZE_GB`
+TOO_LARGE_MARKER = 'TOO_LARGE'
+
+# An incomplete cache whose files haven't changed for this long was left behind by a run
+# that stopped, rather than being written by a live process.
+STALE_CACHE_SECONDS = 15 * 60
+
+
+def check_deterministic_regions(cfg):
+    """ The cache stores the extracted regions, so region extraction must not be random.
+    Args:
+        cfg: the `IMAGE_PROCESSING` configuration
+    """
+    if cfg.REGION_TYPE == 'bbox':
+        bbox_cfg = cfg.BBOX_CFG
+        if 'DO_EXPANSION' in bbox_cfg and bbox_cfg.DO_EXPANSION not in (0, 1):
+            raise ValueError("The region cache requires BBOX_CFG.DO_EXPANSION to be 0 or 1, " \
+                             "got %s." % (bbox_cfg.DO_EXPANSION,))
+    elif cfg.REGION_TYPE != 'image':
+        raise ValueError("Unknown REGION_TYPE: %s" % (cfg.REGION_TYPE,))
+
+def cached_region_max_side(cfg, cache_cfg):
+    """ The longest side of a cached region. By default this is large enough that the smallest
+    random crop (and the central crop) can still be resized up to `INPUT_SIZE` without
+    losing resolution.
+    Args:
+        cfg: the `IMAGE_PROCESSING` configuration
+        cache_cfg: the `REGION_CACHE` configuration
+    """
+    if 'MAX_SIDE' in cache_cfg and cache_cfg.MAX_SIDE:
+        return int(cache_cfg.MAX_SIDE)
+
+    scale = 1.
+    if cfg.DO_RANDOM_CROP > 0:
+        scale /= math.sqrt(cfg.RANDOM_CROP_CFG.MIN_AREA)
+    if cfg.DO_CENTRAL_CROP > 0:
+        scale /= cfg.CENTRAL_CROP_FRACTION
+    return int(math.ceil(cfg.INPUT_SIZE * scale))
+
+def cache_key(tfrecords, cfg, max_side, read_filenames=False):
+    """ A hash of everything that determines the contents of the cache.
+    """
+    tfrecord_info = []
+    for tfrecord in sorted(tfrecords):
+        stat = tf.gfile.Stat(tfrecord)
+        tfrecord_info.append([os.path.abspath(tfrecord), stat.length, int(stat.mtime_nsec // 10**9)])
+
+    key_info = {
+        'tfrecords' : tfrecord_info,
+        'region_type' : cfg.REGION_TYPE,
+        'bbox_cfg' : cfg.BBOX_CFG if cfg.REGION_TYPE == 'bbox' else None,
+        'decode_and_crop' : bool(cfg.REGION_TYPE == 'bbox' and 'DECODE_AND_CROP' in cfg and cfg.DECODE_AND_CROP),
+        'max_side' : max_side,
+        'read_filenames' : read_filenames
+    }
+
+    return hashlib.sha1(json.dumps(key_info, sort_keys=True).encode('utf-8')).hexdigest()
+
+def _directory_size(directory):
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            size += os.path.getsize(os.path.join(root, f))
+    return size
+
+def _last_modified(directory):
+    mtime = os.path.getmtime(directory)
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            mtime = max(mtime, os.path.getmtime(os.path.join(root, f)))
+    return mtime
+
+def _is_complete(cache_path):
+    return os.path.exists(cache_path + '.index') and not os.path.exists(cache_path + '.lockfile')
+
+def estimate_cache_size(num_examples, max_side):
+    """ An upper bound on the size, in bytes, of the cache: every region stored as uint8 at `max_side`.
+    """
+    return num_examples * max_side * max_side * 3
+
+def prepare_cache(cache_dir, key, max_size_gb, estimated_size=None):
+    """ Get the cache file prefix for `key`, evicting old caches so that `cache_dir` stays under
+    `max_size_gb`.
+    Args:
+        estimated_size: the expected size of the cache in bytes (see `estimate_cache_size`). A cache
+            that doesn't exist yet is not built if this is larger than `max_size_gb`.
+    Returns:
+        the file prefix to pass to `tf.data.Dataset.cache`, or None if the cache for `key` is too large
+            to be used or is being built by another process.
+    """
+    max_size = max_size_gb * (1024 ** 3)
+    key_dir = os.path.join(cache_dir, key)
+    cache_path = os.path.join(key_dir, CACHE_PREFIX)
+
+    if os.path.exists(os.path.join(key_dir, TOO_LARGE_MARKER)):
+        tf.logging.warn('The region cache for these tfrecords is larger than %0.1f GB, not caching.' % (max_size_gb,))
+        return None
+
+    if os.path.isdir(key_dir):
+        if _is_complete(cache_path):
+            if _directory_size(key_dir) > max_size:
+                tf.logging.warn('The region cache for these tfrecords is larger than %0.1f GB, not caching.' % (max_size_gb,))
+                shutil.rmtree(key_dir)
+                os.makedirs(key_dir)
+                open(os.path.join(key_dir, TOO_LARGE_MARKER), 'w').close()
+                return None
+        elif time.time() - _last_modified(key_dir) < STALE_CACHE_SECONDS:
+            tf.logging.warn('The region cache %s is being built by another process, not caching.' % (key_dir,))
+            return None
+        else:
+            # A previous run stopped before finishing the cache
+            tf.logging.info('Removing incomplete region cache %s' % (key_dir,))
+            shutil.rmtree(key_dir)
+
+    if not os.path.isdir(key_dir):
+        if estimated_size is not None and estimated_size > max_size:
+            tf.logging.warn('The region cache for these tfrecords would be about %0.1f GB, which is larger ' \
+                            'than %0.1f GB, not caching.' % (estimated_size / float(1024 ** 3), max_size_gb))
+            return None
+        os.makedirs(key_dir)
+
+    # Mark the cache as recently used
+    now = time.time()
+    os.utime(key_dir, (now, now))
+
+    # Evict the least recently used caches
+    other_dirs = [os.path.join(cache_dir, d) for d in os.listdir(cache_dir) if d != key]
+    other_dirs = sorted([d for d in other_dirs if os.path.isdir(d)], key=os.path.getmtime)
+    total_size = sum([_directory_size(d) for d in other_dirs]) + _directory_size(key_dir)
+    while total_size > max_size and len(other_dirs) > 0:
+        old_dir = other_dirs.pop(0)
+        tf.logging.info('Evicting region cache %s' % (old_dir,))
+        total_size -= _directory_size(old_dir)
+        shutil.rmtree(old_dir)
+
+    if _is_complete(cache_path):
+        tf.logging.info('Using region cache %s' % (key_dir,))
+    else:
+        tf.logging.info('Building region cache %s' % (key_dir,))
+
+    return cache_path
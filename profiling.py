@@ -0,0 +1,292 @@
+"""
+Trace `sess.run` calls and report where the time and memory go (see `--profile_dir` in train.py,
+test.py, classify.py and extract.py).
+
+A `Profiler` counts steps. After `start_step` steps it runs the next `num_steps` steps with full
+tracing, and for each traced step it writes:
+    * a chrome trace of the step, `timeline_step_<n>.json` (open it in chrome://tracing)
+    * a chrome trace of one run of the input pipelines, `timeline_inputs_step_<n>.json`. The
+      preprocessing ops run in the queue runner threads (or the tf.data threads), not in the step,
+      so they are traced with a dedicated run: the tensors that each queue runner enqueues are
+      fetched without enqueueing them (so a full queue doesn't block), and the next batch of each
+      tf.data pipeline in `inputs.BATCH_TENSORS_COLLECTION` is fetched. Either way the traced run
+      consumes input, e.g. one batch of each tf.data pipeline per traced step.
+    * `op_stats.tsv` and `op_stats.txt`, the time and memory of each op aggregated over the traced
+      steps, with tables by op, op type and top level name scope (e.g. the network scope vs `inputs`).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from collections import defaultdict
+import os
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from preprocessing import inputs
+
+OP_STATS_TSV = 'op_stats.tsv'
+OP_STATS_TXT = 'op_stats.txt'
+
+STEP = 'step'
+INPUTS = 'inputs'
+
+# A traced input run that is still waiting for its input (e.g. an empty upstream queue) is abandoned
+INPUT_TRACE_TIMEOUT_MS = 2000
+
+
+def _op_type(node_stats, graph):
+    try:
+        return graph.get_operation_by_name(node_stats.node_name).type
+    except (KeyError, ValueError):
+        # e.g. `name = Conv2D(...)`
+        label = node_stats.timeline_label
+        if ' = ' in label:
+            return label.split(' = ', 1)[1].split('(', 1)[0]
+        return 'unknown'
+
+def _devices_to_count(step_stats):
+    """ The gpu ops show up on the gpu device (the kernel launch) and on the gpu streams (the
+    kernels). Count the kernels on `stream:all` rather than the launches when they are available.
+    """
+    devices = [dev_stats.device for dev_stats in step_stats.dev_stats]
+    stream_devices = set(device.rsplit('/stream:', 1)[0] for device in devices if device.endswith('/stream:all'))
+    return set(device for device in devices
+               if (device.endswith('/stream:all') or '/stream:' not in device) and device not in stream_devices)
+
+
+class OpStats(object):
+    """ The time and memory of each op, aggregated over the traced runs.
+    """
+
+    def __init__(self):
+        # (kind, op name) -> [op type, count, total micros, total output bytes, peak bytes]
+        self.ops = defaultdict(lambda: [None, 0, 0, 0, 0])
+        self.num_runs = defaultdict(int)
+
+    def add(self, step_stats, graph, kind=STEP):
+        self.num_runs[kind] += 1
+        devices = _devices_to_count(step_stats)
+        for dev_stats in step_stats.dev_stats:
+            if dev_stats.device not in devices:
+                continue
+            for node_stats in dev_stats.node_stats:
+                if node_stats.node_name in ('RecvTensor', '_SOURCE', '_SINK'):
+                    continue
+                name = node_stats.node_name.split(':')[0]
+                op_stats = self.ops[(kind, name)]
+                if op_stats[0] is None:
+                    op_stats[0] = _op_type(node_stats, graph)
+                op_stats[1] += 1
+                op_stats[2] += node_stats.all_end_rel_micros
+                op_stats[3] += sum(output.tensor_description.allocation_description.requested_bytes
+                                   for output in node_stats.output)
+                op_stats[4] = max([op_stats[4]] + [memory.peak_bytes for memory in node_stats.memory])
+
+    def table(self, kind, key_fn):
+        """ Aggregate the ops of `kind` by `key_fn(name, op_type)`.
+        Returns:
+            a list of (key, count, total micros, output bytes, peak bytes), sorted by time
+        """
+        rows = defaultdict(lambda: [0, 0, 0, 0])
+        for (op_kind, name), (op_type, count, micros, output_bytes, peak_bytes) in self.ops.items():
+            if op_kind != kind:
+                continue
+            row = rows[key_fn(name, op_type)]
+            row[0] += count
+            row[1] += micros
+            row[2] += output_bytes
+            row[3] = max(row[3], peak_bytes)
+        return sorted([tuple([key] + row) for key, row in rows.items()], key=lambda row: -row[2])
+
+    def write_tsv(self, path):
+        with open(path, 'w') as f:
+            f.write('\t'.join(['kind', 'name', 'type', 'count', 'total_ms', 'ms_per_run', 'output_mb_per_run', 'peak_mb']) + '\n')
+            for (kind, name), (op_type, count, micros, output_bytes, peak_bytes) in sorted(self.ops.items(), key=lambda item: -item[1][2]):
+                num_runs = self.num_runs[kind]
+                f.write('%s\t%s\t%s\t%d\t%.3f\t%.3f\t%.3f\t%.3f\n' % (
+                    kind, name, op_type, count, micros / 1000., micros / 1000. / num_runs,
+                    output_bytes / 2.**20 / num_runs, peak_bytes / 2.**20))
+
+    def summary(self, num_rows=20):
+        """ The tables of the most expensive ops, op types and name scopes, as a string.
+        """
+        tables = [
+            ('op type', lambda name, op_type: op_type),
+            ('name scope', lambda name, op_type: name.split('/')[0]),
+            ('op', lambda name, op_type: name)
+        ]
+        lines = []
+        for kind, title in [(STEP, 'Step'), (INPUTS, 'Input pipelines')]:
+            num_runs = self.num_runs[kind]
+            if num_runs == 0:
+                continue
+            for key_name, key_fn in tables:
+                rows = self.table(kind, key_fn)
+                total_micros = sum(row[2] for row in rows)
+                lines.append('%s: time and memory per run by %s (%d traced runs)' % (title, key_name, num_runs))
+                lines.append('%-60s %8s %10s %7s %12s %10s' % (key_name, 'count', 'ms', '%', 'output MB', 'peak MB'))
+                for key, count, micros, output_bytes, peak_bytes in rows[:num_rows]:
+                    lines.append('%-60s %8d %10.2f %6.1f%% %12.2f %10.2f' % (
+                        key[-60:], count // num_runs, micros / 1000. / num_runs,
+                        100. * micros / max(total_micros, 1), output_bytes / 2.**20 / num_runs, peak_bytes / 2.**20))
+                lines.append('')
+        return '\n'.join(lines)
+
+
+class Profiler(object):
+
+    def __init__(self, output_dir, start_step=10, num_steps=5, trace_input_queues=True):
+        """
+        Args:
+            output_dir: the directory for the timelines and the op tables
+            start_step: the number of steps to run before tracing (to skip the warm up steps)
+            num_steps: the number of steps to trace
+            trace_input_queues: if True, also trace one run of the input pipelines (the queue runners and
+                the tf.data pipelines) with each traced step
+        """
+        self.output_dir = output_dir
+        self.start_step = start_step
+        self.num_steps = num_steps
+        self.trace_input_queues = trace_input_queues
+
+        if not tf.gfile.IsDirectory(self.output_dir):
+            tf.gfile.MakeDirs(self.output_dir)
+
+        self.op_stats = OpStats()
+        self.step = -1
+        self._step_stats = None
+
+    def begin_step(self):
+        """ Start the next step.
+        Returns:
+            True if the runs of the step should be traced
+        """
+        self.step += 1
+        self._step_stats = None
+        return self.is_tracing()
+
+    def is_tracing(self):
+        return self.start_step <= self.step < self.start_step + self.num_steps
+
+    def run(self, sess, fetches, feed_dict=None, options=None, run_metadata=None):
+        """ `sess.run`, with full tracing if the current step is traced.
+        """
+        if not self.is_tracing():
+            return sess.run(fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+
+        if options is None:
+            options = tf.RunOptions()
+        else:
+            options = tf.RunOptions.FromString(options.SerializeToString())
+        options.trace_level = tf.RunOptions.FULL_TRACE
+        if run_metadata is None:
+            run_metadata = tf.RunMetadata()
+
+        outputs = sess.run(fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+        self.add_run_metadata(sess, run_metadata)
+        return outputs
+
+    def add_run_metadata(self, sess, run_metadata):
+        """ Record a traced run of the current step, and write the timelines and the op tables.
+        """
+        if self._step_stats is None:
+            self._step_stats = tf.RunMetadata().step_stats
+            if self.trace_input_queues:
+                self._trace_inputs(sess)
+        self._step_stats.MergeFrom(run_metadata.step_stats)
+        self.op_stats.add(run_metadata.step_stats, sess.graph, kind=STEP)
+
+        self._write_timeline(self._step_stats, 'timeline_step_%d.json' % self.step)
+        self.write_op_stats()
+
+    def _input_fetches(self, graph):
+        """ The preprocessing subgraphs to run: the tensors that each enqueue op of the queue runners
+        enqueues (the first input of an enqueue op is the queue), and the next batch of the tf.data
+        pipelines.
+        """
+        fetches = []
+        for queue_runner in graph.get_collection(tf.GraphKeys.QUEUE_RUNNERS):
+            for enqueue_op in queue_runner.enqueue_ops:
+                fetches.append(list(enqueue_op.inputs)[1:])
+        batch_tensors = graph.get_collection(inputs.BATCH_TENSORS_COLLECTION)
+        if len(batch_tensors) > 0:
+            fetches.append(batch_tensors)
+        return [fetch for fetch in fetches if len(fetch) > 0]
+
+    def _trace_inputs(self, sess):
+        fetches = self._input_fetches(sess.graph)
+        if len(fetches) == 0:
+            return
+
+        step_stats = tf.RunMetadata().step_stats
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE, timeout_in_ms=INPUT_TRACE_TIMEOUT_MS)
+        for fetch in fetches:
+            run_metadata = tf.RunMetadata()
+            try:
+                sess.run(fetch, options=options, run_metadata=run_metadata)
+            except (tf.errors.OutOfRangeError, tf.errors.CancelledError, tf.errors.DeadlineExceededError):
+                # The input is exhausted or closed, or an upstream queue is empty.
+                continue
+            step_stats.MergeFrom(run_metadata.step_stats)
+            self.op_stats.add(run_metadata.step_stats, sess.graph, kind=INPUTS)
+        self._write_timeline(step_stats, 'timeline_inputs_step_%d.json' % self.step)
+
+    def _write_timeline(self, step_stats, filename):
+        trace = timeline.Timeline(step_stats).generate_chrome_trace_format(show_memory=True)
+        with open(os.path.join(self.output_dir, filename), 'w') as f:
+            f.write(trace)
+
+    def write_op_stats(self):
+        self.op_stats.write_tsv(os.path.join(self.output_dir, OP_STATS_TSV))
+        summary = self.op_stats.summary()
+        with open(os.path.join(self.output_dir, OP_STATS_TXT), 'w') as f:
+            f.write(summary)
+        if self.step == self.start_step + self.num_steps - 1:
+            tf.logging.info('Profile written to %s\n%s' % (self.output_dir, summary))
+
+    def session(self, sess):
+        """ Wrap `sess` so that its `run` calls are traced during the traced steps.
+        """
+        return _ProfiledSession(self, sess)
+
+    def wrap_train_step_fn(self, train_step_fn):
+        """ Wrap a `train_step_fn` for `slim.learning.train` so that each call is a step.
+        """
+        def profiled_train_step_fn(sess, train_op, global_step, train_step_kwargs):
+            if self.begin_step():
+                sess = self.session(sess)
+            return train_step_fn(sess, train_op, global_step, train_step_kwargs)
+        return profiled_train_step_fn
+
+
+class _ProfiledSession(object):
+
+    def __init__(self, profiler, sess):
+        self._profiler = profiler
+        self._sess = sess
+
+    def run(self, fetches, feed_dict=None, options=None, run_metadata=None):
+        return self._profiler.run(self._sess, fetches, feed_dict=feed_dict, options=options, run_metadata=run_metadata)
+
+    def __getattr__(self, name):
+        return getattr(self._sess, name)
+
+
+class ProfilerHook(tf.train.SessionRunHook):
+    """ Drive a `Profiler` from a `MonitoredSession` (e.g. in `slim.evaluation`), each run is a step.
+    """
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def before_run(self, run_context):
+        if self.profiler.begin_step():
+            return tf.train.SessionRunArgs(None, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE))
+        return None
+
+    def after_run(self, run_context, run_values):
+        if self.profiler.is_tracing():
+            self.profiler.add_run_metadata(run_context.session, run_values.run_metadata)
@@ -0,0 +1,98 @@
+"""Tests for profiling.py."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+
+import tensorflow as tf
+
+import profiling
+from preprocessing import inputs
+
+
+class ProfilerTest(tf.test.TestCase):
+
+  def testTracesSelectedSteps(self):
+    output_dir = os.path.join(self.get_temp_dir(), 'profile')
+    profiler = profiling.Profiler(output_dir, start_step=1, num_steps=2)
+    with tf.Graph().as_default():
+      with tf.name_scope('model'):
+        x = tf.matmul(tf.random_uniform([16, 16]), tf.random_uniform([16, 16]), name='matmul')
+      with self.test_session() as sess:
+        traced = []
+        for _ in range(4):
+          traced.append(profiler.begin_step())
+          profiler.run(sess, x)
+
+    self.assertEqual(traced, [False, True, True, False])
+    self.assertEqual(profiler.op_stats.num_runs[profiling.STEP], 2)
+    self.assertTrue(os.path.exists(os.path.join(output_dir, 'timeline_step_1.json')))
+    self.assertTrue(os.path.exists(os.path.join(output_dir, 'timeline_step_2.json')))
+    self.assertFalse(os.path.exists(os.path.join(output_dir, 'timeline_step_3.json')))
+
+    op_types = [row[0] for row in profiler.op_stats.table(profiling.STEP, lambda name, op_type: op_type)]
+    self.assertIn('MatMul', op_types)
+    scopes = [row[0] for row in profiler.op_stats.table(profiling.STEP, lambda name, op_type: name.split('/')[0])]
+    self.assertIn('model', scopes)
+    self.assertIn('MatMul', open(os.path.join(output_dir, profiling.OP_STATS_TXT)).read())
+
+  def testTracesQueueRunners(self):
+    output_dir = os.path.join(self.get_temp_dir(), 'queue_profile')
+    profiler = profiling.Profiler(output_dir, start_step=0, num_steps=1)
+    with tf.Graph().as_default():
+      with tf.name_scope('inputs'):
+        batch = tf.train.batch([tf.random_uniform([4])], batch_size=2, capacity=10)
+      with self.test_session() as sess:
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+        profiler.begin_step()
+        profiler.run(sess, batch)
+        coord.request_stop()
+        coord.join(threads)
+
+    self.assertEqual(profiler.op_stats.num_runs[profiling.INPUTS], 1)
+    self.assertTrue(os.path.exists(os.path.join(output_dir, 'timeline_inputs_step_0.json')))
+
+  def testTracesFullQueue(self):
+    output_dir = os.path.join(self.get_temp_dir(), 'full_queue_profile')
+    profiler = profiling.Profiler(output_dir, start_step=0, num_steps=1)
+    with tf.Graph().as_default():
+      with tf.name_scope('inputs'):
+        batch = tf.train.batch([tf.random_uniform([4])], batch_size=1, capacity=1)
+      queue_size = tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)[0].queue.size()
+      with self.test_session() as sess:
+        coord = tf.train.Coordinator()
+        threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+        # Nothing dequeues, so the queue stays full
+        while sess.run(queue_size) < 1:
+          time.sleep(0.01)
+        profiler.begin_step()
+        profiler.run(sess, tf.no_op())
+        coord.request_stop()
+        sess.run(batch)
+        coord.join(threads)
+
+    self.assertEqual(profiler.op_stats.num_runs[profiling.INPUTS], 1)
+    scopes = [row[0] for row in profiler.op_stats.table(profiling.INPUTS, lambda name, op_type: name.split('/')[0])]
+    self.assertIn('inputs', scopes)
+
+  def testTracesDataset(self):
+    output_dir = os.path.join(self.get_temp_dir(), 'dataset_profile')
+    profiler = profiling.Profiler(output_dir, start_step=0, num_steps=1)
+    with tf.Graph().as_default():
+      dataset = tf.data.Dataset.range(100).map(lambda x: tf.to_float(x) * 2.)
+      batch = inputs._batch_and_prefetch(dataset, batch_size=2, min_after_dequeue=4)
+      with self.test_session() as sess:
+        profiler.begin_step()
+        profiler.run(sess, batch)
+
+    self.assertEqual(profiler.op_stats.num_runs[profiling.INPUTS], 1)
+    op_types = [row[0] for row in profiler.op_stats.table(profiling.INPUTS, lambda name, op_type: op_type)]
+    self.assertIn('IteratorGetNext', op_types)
+
+
+if __name__ == '__main__':
+  tf.test.main()
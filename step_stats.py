@@ -0,0 +1,143 @@
+"""
+Record where the time of each training step goes (see `STEP_STATS` in the training config).
+
+The batch is copied into variables with its own session run (`stage_batch`) before the model is
+run on it, so that the time spent waiting for the input pipeline is measured separately from the
+time spent running the model. Every `log_every_n_steps` steps the statistics of the window are
+written as tensorboard summaries and as a line of a jsonl file.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import time
+
+import tensorflow as tf
+
+import memory_stats
+
+JSONL_FILE = 'step_stats.jsonl'
+
+
+def stage_batch(batch_dict, keys=('inputs', 'labels')):
+    """ Copy the tensors of the batch into local variables.
+    Returns:
+        the op that copies the next batch, and a copy of `batch_dict` where the tensors for `keys`
+        are replaced by the variables.
+    """
+    staged_batch_dict = dict(batch_dict)
+    assign_ops = []
+    with tf.name_scope('stage_batch'):
+        for key in keys:
+            tensor = batch_dict[key]
+            if not tensor.get_shape().is_fully_defined():
+                raise ValueError("The shape of the batch `%s` must be fully defined to stage it, got %s." % (key, tensor.get_shape()))
+            var = tf.Variable(tf.zeros(tensor.get_shape(), dtype=tensor.dtype), trainable=False,
+                              collections=[tf.GraphKeys.LOCAL_VARIABLES], name=key)
+            assign_ops.append(var.assign(tensor))
+            staged_batch_dict[key] = var.read_value()
+        stage_op = tf.group(*assign_ops, name='stage_op')
+    return stage_op, staged_batch_dict
+
+
+class StepStats(object):
+
+    def __init__(self, stage_op, examples_per_step, log_every_n_steps, output_dir, tensors_to_log=None,
+                 log_host_memory=False):
+        """
+        Args:
+            stage_op: the op returned by `stage_batch`
+            examples_per_step: the number of images in a step (all of the micro-batches)
+            log_every_n_steps: the number of steps in a window
+            output_dir: the directory for the summaries and the jsonl file
+            tensors_to_log: a dictionary of scalar tensors (e.g. the learning rate or the fraction of a
+                queue that is full) to evaluate at the end of each window
+            log_host_memory: also record the current and the peak resident set size of the process
+        """
+        self.stage_op = stage_op
+        self.examples_per_step = examples_per_step
+        self.log_every_n_steps = max(1, log_every_n_steps)
+        self.output_dir = output_dir
+        self.tensors_to_log = tensors_to_log if tensors_to_log is not None else {}
+        self.log_host_memory = log_host_memory
+
+        if not tf.gfile.IsDirectory(self.output_dir):
+            tf.gfile.MakeDirs(self.output_dir)
+        self._summary_writer = None
+
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.time()
+        self._num_steps = 0
+        self._wait_time = 0.
+        self._step_time = 0.
+
+    def stage_batch(self, sess):
+        """ Copy the next batch into the staging variables, and record the time it took.
+        """
+        t = time.time()
+        sess.run(self.stage_op)
+        self._wait_time += time.time() - t
+
+    def end_step(self, sess, global_step, step_start_time):
+        """ Record a step that started at `step_start_time`, and write the statistics at the end of a window.
+        Args:
+            global_step: the global step tensor
+        """
+        self._step_time += time.time() - step_start_time
+        self._num_steps += 1
+        if self._num_steps >= self.log_every_n_steps:
+            self.write(sess, global_step)
+
+    def write(self, sess, global_step):
+        """ Write the statistics of the current window and start a new window.
+        """
+        if self._num_steps == 0:
+            return
+
+        window_time = time.time() - self._window_start
+        compute_time = self._step_time - self._wait_time
+        global_step, logged_values = sess.run([global_step, self.tensors_to_log])
+
+        stats = {
+            'global_step' : int(global_step),
+            'time' : time.time(),
+            'examples_per_sec' : self._num_steps * self.examples_per_step / window_time,
+            'step_time_ms' : 1000. * self._step_time / self._num_steps,
+            'input_wait_time_ms' : 1000. * self._wait_time / self._num_steps,
+            'compute_time_ms' : 1000. * compute_time / self._num_steps,
+            # Time outside of the steps, e.g. saving summaries and checkpoints
+            'other_time_ms' : 1000. * (window_time - self._step_time) / self._num_steps,
+            'input_wait_fraction' : self._wait_time / self._step_time if self._step_time > 0 else 0.
+        }
+        for name, value in logged_values.items():
+            stats[name] = float(value)
+        if self.log_host_memory:
+            for name, value in memory_stats.host_memory().items():
+                if value is not None:
+                    stats[name] = float(value)
+
+        with open(os.path.join(self.output_dir, JSONL_FILE), 'a') as f:
+            f.write(json.dumps(stats, sort_keys=True) + '\n')
+
+        if self._summary_writer is None:
+            self._summary_writer = tf.summary.FileWriter(self.output_dir)
+        summary = tf.Summary()
+        for name, value in stats.items():
+            if name not in ('global_step', 'time'):
+                summary.value.add(tag='step_stats/%s' % name, simple_value=value)
+        self._summary_writer.add_summary(summary, global_step)
+        self._summary_writer.flush()
+
+        tf.logging.info('global step %d: %.1f examples/sec, %.1f ms/step (%.1f ms waiting for input, %.1f ms running the model)' % (
+            global_step, stats['examples_per_sec'], stats['step_time_ms'], stats['input_wait_time_ms'], stats['compute_time_ms']))
+        peak_memory = sorted((name, value) for name, value in stats.items() if name.startswith('memory/') and 'peak' in name)
+        if len(peak_memory) > 0:
+            tf.logging.info('global step %d: peak memory %s' % (
+                global_step, ', '.join('%s %s' % (name[len('memory/'):], memory_stats.format_bytes(value)) for name, value in peak_memory)))
+
+        self._reset_window()
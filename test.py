@@ -12,8 +12,9 @@ import tensorflow.contrib.slim as slim
 from config.parse_config import parse_config_file
 from nets import nets_factory
 from preprocessing import inputs
+import profiling
 
-def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_secs, cfg, read_images=False):
+def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_secs, cfg, read_images=False, profiler=None):
     """
     Args:
         tfrecords (list)
@@ -21,6 +22,7 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
         savedir (str)
         max_iterations (int)
         cfg (EasyDict)
+        profiler (profiling.Profiler) : If provided, then trace the evaluation steps.
     """
     tf.logging.set_verbosity(tf.logging.DEBUG)
 
@@ -43,7 +45,11 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
                 min_after_dequeue=cfg.QUEUE_MIN,
                 add_summaries=False,
                 input_type='test',
-                read_filenames=read_images
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES
             )
 
             batched_one_hot_labels = slim.one_hot_encoding(batch_dict['labels'],
@@ -51,9 +57,11 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
 
         arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME]()
 
-        with slim.arg_scope(arg_scope):
-            logits, end_points = nets_factory.networks_map[cfg.MODEL_NAME](
-                inputs=batch_dict['inputs'],
+        xla_jit_scope = 'XLA_JIT_SCOPE' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT_SCOPE
+        precision = cfg.PRECISION.DTYPE if 'PRECISION' in cfg else 'float32'
+        with slim.arg_scope(arg_scope), nets_factory.jit_scope(xla_jit_scope):
+            logits, end_points = nets_factory.precision_network(cfg.MODEL_NAME, precision)(
+                inputs=inputs.normalize_inputs(batch_dict['inputs']),
                 num_classes=cfg.NUM_CLASSES,
                 is_training=False
             )
@@ -121,6 +129,12 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
             inter_op_parallelism_threads=cfg.SESSION_CONFIG.INTER_OP_PARALLELISM_THREADS if 'INTER_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None
         )
 
+        # Compile the graph with XLA
+        if 'XLA_JIT' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT:
+            sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+
+        hooks = [profiling.ProfilerHook(profiler)] if profiler is not None else None
+
         if eval_interval_secs > 0:
 
             if not os.path.isdir(checkpoint_path):
@@ -144,7 +158,8 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
                 eval_interval_secs=eval_interval_secs,
                 max_number_of_evaluations=None,
                 session_config=sess_config,
-                timeout=None
+                timeout=None,
+                hooks=hooks
             )
 
         else:
@@ -165,7 +180,8 @@ def test(tfrecords, checkpoint_path, save_dir, max_iterations, eval_interval_sec
                 num_evals=num_batches,
                 eval_op=names_to_updates.values(),
                 variables_to_restore=variables_to_restore,
-                session_config=sess_config
+                session_config=sess_config,
+                hooks=hooks
             )
 
 def parse_args():
@@ -208,6 +224,18 @@ def parse_args():
                         help='Read the images from the file system using the `filename` field rather than using the `encoded` field of the tfrecord.',
                         action='store_true', default=False)
 
+    parser.add_argument('--profile_dir', dest='profile_dir',
+                        help='If provided, then trace --profile_steps steps (after skipping --profile_start_step steps) and save the chrome timelines and the per op time and memory tables to this directory.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--profile_start_step', dest='profile_start_step',
+                        help='The number of steps to run before tracing with --profile_dir.',
+                        required=False, type=int, default=10)
+
+    parser.add_argument('--profile_steps', dest='profile_steps',
+                        help='The number of steps to trace with --profile_dir.',
+                        required=False, type=int, default=5)
+
     args = parser.parse_args()
     return args
 
@@ -223,6 +251,10 @@ def main():
     if args.model_name != None:
         cfg.MODEL_NAME = args.model_name
 
+    profiler = None
+    if args.profile_dir != None:
+        profiler = profiling.Profiler(args.profile_dir, start_step=args.profile_start_step, num_steps=args.profile_steps)
+
     test(
         tfrecords=args.tfrecords,
         checkpoint_path=args.checkpoint_path,
@@ -230,7 +262,8 @@ def main():
         max_iterations=args.batches,
         eval_interval_secs=args.eval_interval_secs,
         cfg=cfg,
-        read_images=args.read_images
+        read_images=args.read_images,
+        profiler=profiler
     )
 
 if __name__ == '__main__':
@@ -23,53 +23,99 @@ from __future__ import print_function
 import argparse
 import copy
 import os
+import time
 
 import numpy as np
 import tensorflow as tf
 import tensorflow.contrib.slim as slim
 
+import async_checkpoint
+import bottleneck_cache
+import memory_stats
 from config.parse_config import parse_config_file
+from nets import gradient_checkpointing
 from nets import nets_factory
-from preprocessing.inputs import input_nodes
+import optimizers
+import preemption
+import profiling
+from preprocessing.inputs import input_nodes, normalize_inputs, queue_fill_ops
+import step_stats
+import validation
 
 
-def _configure_learning_rate(global_step, cfg):
+def effective_batch_size(cfg, num_replicas=1):
+    """The number of images used for each update of the variables (`BATCH_SIZE` images for each of
+    the `ACCUMULATION_STEPS` micro-batches, for each of the `num_replicas` synchronous workers).
+    """
+    accumulation_steps = cfg.ACCUMULATION_STEPS if 'ACCUMULATION_STEPS' in cfg else 1
+    return cfg.BATCH_SIZE * accumulation_steps * num_replicas
+
+def _configure_learning_rate(global_step, cfg, num_replicas=1):
     """Configures the learning rate.
     Args:
-        num_samples_per_epoch: The number of samples in each epoch of training.
         global_step: The global_step tensor.
+        num_replicas: The number of workers whose gradients are aggregated for each update.
     Returns:
         A `Tensor` representing the learning rate.
     Raises:
         ValueError: if cfg.LEARNING_RATE_DECAY_TYPE is not recognized.
     """
 
+    batch_size = effective_batch_size(cfg, num_replicas)
+    steps_per_epoch = cfg.NUM_TRAIN_EXAMPLES / batch_size
+    decay_steps = int(steps_per_epoch * cfg.NUM_EPOCHS_PER_DELAY)
 
-    decay_steps = int(cfg.NUM_TRAIN_EXAMPLES / cfg.BATCH_SIZE * cfg.NUM_EPOCHS_PER_DELAY)
+    initial_learning_rate = cfg.INITIAL_LEARNING_RATE
+    if 'SCALE_LEARNING_RATE' in cfg and cfg.SCALE_LEARNING_RATE:
+        # Linear scaling rule: the learning rate is proportional to the batch size
+        initial_learning_rate *= batch_size / cfg.BASE_BATCH_SIZE
+
+    # The decay starts after the warmup
+    warmup_steps = int(steps_per_epoch * cfg.WARMUP_EPOCHS) if 'WARMUP_EPOCHS' in cfg else 0
+    if warmup_steps > 0:
+        decay_global_step = tf.maximum(global_step - warmup_steps, 0)
+    else:
+        decay_global_step = global_step
 
     if cfg.LEARNING_RATE_DECAY_TYPE == 'exponential':
-        return tf.train.exponential_decay(cfg.INITIAL_LEARNING_RATE,
-                                          global_step,
-                                          decay_steps,
-                                          cfg.LEARNING_RATE_DECAY_FACTOR,
-                                          staircase=cfg.LEARNING_RATE_STAIRCASE,
-                                          name='exponential_decay_learning_rate')
+        learning_rate = tf.train.exponential_decay(initial_learning_rate,
+                                                   decay_global_step,
+                                                   decay_steps,
+                                                   cfg.LEARNING_RATE_DECAY_FACTOR,
+                                                   staircase=cfg.LEARNING_RATE_STAIRCASE,
+                                                   name='exponential_decay_learning_rate')
 
     elif cfg.LEARNING_RATE_DECAY_TYPE == 'fixed':
-        return tf.constant(cfg.INITIAL_LEARNING_RATE, name='fixed_learning_rate')
+        learning_rate = tf.constant(initial_learning_rate, name='fixed_learning_rate')
 
     elif cfg.LEARNING_RATE_DECAY_TYPE == 'polynomial':
-        return tf.train.polynomial_decay(cfg.INITIAL_LEARNING_RATE,
-                                         global_step,
-                                         decay_steps,
-                                         cfg.END_LEARNING_RATE,
-                                         power=1.0,
-                                         cycle=False,
-                                         name='polynomial_decay_learning_rate')
+        learning_rate = tf.train.polynomial_decay(initial_learning_rate,
+                                                  decay_global_step,
+                                                  decay_steps,
+                                                  cfg.END_LEARNING_RATE,
+                                                  power=1.0,
+                                                  cycle=False,
+                                                  name='polynomial_decay_learning_rate')
+
+    elif cfg.LEARNING_RATE_DECAY_TYPE == 'cosine':
+        # Decay to END_LEARNING_RATE over the remaining NUM_TRAIN_ITERATIONS
+        cosine_decay_steps = max(cfg.NUM_TRAIN_ITERATIONS - warmup_steps, 1)
+        progress = tf.minimum(tf.cast(decay_global_step, tf.float32) / cosine_decay_steps, 1.)
+        learning_rate = tf.add(cfg.END_LEARNING_RATE,
+                               0.5 * (initial_learning_rate - cfg.END_LEARNING_RATE) * (1. + tf.cos(np.pi * progress)),
+                               name='cosine_decay_learning_rate')
     else:
         raise ValueError('learning_rate_decay_type [%s] was not recognized',
                          cfg.LEARNING_RATE_DECAY_TYPE)
 
+    if warmup_steps > 0:
+        # Linearly increase the learning rate from 0 during the warmup
+        warmup_learning_rate = initial_learning_rate * (tf.cast(global_step, tf.float32) + 1.) / warmup_steps
+        learning_rate = tf.where(global_step < warmup_steps, warmup_learning_rate, learning_rate,
+                                 name='warmup_learning_rate')
+
+    return learning_rate
+
 
 def _configure_optimizer(learning_rate, cfg):
     """Configures the optimizer used for training.
@@ -115,8 +161,19 @@ def _configure_optimizer(learning_rate, cfg):
             epsilon=cfg.OPTIMIZER_EPSILON)
     elif cfg.OPTIMIZER == 'sgd':
         optimizer = tf.train.GradientDescentOptimizer(learning_rate)
+    elif cfg.OPTIMIZER == 'lars':
+        optimizer = optimizers.LARSOptimizer(
+            learning_rate,
+            momentum=cfg.MOMENTUM,
+            trust_coefficient=cfg.LARS_TRUST_COEFFICIENT,
+            epsilon=cfg.LARS_EPSILON)
     else:
         raise ValueError('Optimizer [%s] was not recognized', cfg.OPTIMIZER)
+
+    # Keep the small float16 gradients from flushing to zero
+    if _compute_dtype(cfg) != 'float32' and 'LOSS_SCALE' in cfg.PRECISION and cfg.PRECISION.LOSS_SCALE != 1:
+        optimizer = optimizers.LossScaleOptimizer(optimizer, loss_scale=cfg.PRECISION.LOSS_SCALE)
+
     return optimizer
 
 def get_trainable_variables(trainable_scopes):
@@ -248,7 +305,666 @@ def get_init_function(logdir, pretrained_model_path, checkpoint_exclude_scopes,
         ignore_missing_vars=False)
 
 
-def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=None, checkpoint_exclude_scopes=None, restore_variables_with_moving_averages=False, restore_moving_averages=False, read_images=False):
+def _compute_dtype(cfg):
+    return cfg.PRECISION.DTYPE if 'PRECISION' in cfg else 'float32'
+
+def build_network(inputs, cfg, is_training=True):
+    """Build the network in its arg scope, computing in `PRECISION.DTYPE`. With `GRADIENT_CHECKPOINTING`,
+    the training network recomputes the activations of its blocks in the backward pass.
+    Returns:
+        the logits and the end points of the network
+    """
+
+    arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME](
+        weight_decay=cfg.WEIGHT_DECAY,
+        batch_norm_decay=cfg.BATCHNORM_MOVING_AVERAGE_DECAY,
+        batch_norm_epsilon=cfg.BATCHNORM_EPSILON
+    )
+
+    xla_jit_scope = 'SESSION_CONFIG' in cfg and 'XLA_JIT_SCOPE' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT_SCOPE
+    recompute = is_training and 'GRADIENT_CHECKPOINTING' in cfg and cfg.GRADIENT_CHECKPOINTING
+    with slim.arg_scope(arg_scope), nets_factory.jit_scope(xla_jit_scope), gradient_checkpointing.checkpointing_scope(recompute):
+        return nets_factory.precision_network(cfg.MODEL_NAME, _compute_dtype(cfg))(
+            inputs=inputs,
+            num_classes=cfg.NUM_CLASSES,
+            dropout_keep_prob=cfg.DROPOUT_KEEP_PROB,
+            is_training=is_training
+        )
+
+def add_model_losses(inputs, one_hot_labels, cfg):
+    """Build the network and add its classification losses to the `LOSSES` collection.
+    Returns:
+        the logits and the end points of the network
+    """
+
+    logits, end_points = build_network(inputs, cfg, is_training=True)
+
+    # Add the losses
+    if 'AuxLogits' in end_points:
+        tf.losses.softmax_cross_entropy(
+            logits=end_points['AuxLogits'], onehot_labels=one_hot_labels,
+            label_smoothing=cfg.LABEL_SMOOTHING, weights=0.4, scope='aux_loss')
+
+    tf.losses.softmax_cross_entropy(
+        logits=logits, onehot_labels=one_hot_labels, label_smoothing=cfg.LABEL_SMOOTHING, weights=1.0)
+
+    return logits, end_points
+
+def _average_gradients(tower_grads):
+    """Average the gradient of each variable across the towers.
+    Args:
+        tower_grads: A list (one entry per tower) of lists of (gradient, variable) tuples.
+    Returns:
+        A list of (gradient, variable) tuples, with the gradients averaged across the towers.
+    """
+    average_grads = []
+    for grads_and_vars in zip(*tower_grads):
+        var = grads_and_vars[0][1]
+        grads = [tf.convert_to_tensor(grad) for grad, _ in grads_and_vars if grad is not None]
+        if len(grads) == 0:
+            average_grads.append((None, var))
+            continue
+        grad = tf.multiply(tf.add_n(grads), 1. / len(grads))
+        average_grads.append((grad, var))
+    return average_grads
+
+def build_towers(inputs, one_hot_labels, cfg, optimizer, num_towers, tower_device_type='gpu',
+                 param_device='/cpu:0', trainable_scopes=None):
+    """Split the batch across `num_towers` devices and build a copy of the network on each of them.
+    The towers share their variables, which are placed on `param_device`.
+    Args:
+        inputs: the batch of inputs (see `normalize_inputs`), split along the first dimension
+        one_hot_labels: the batch of one hot labels
+        tower_device_type: 'gpu' or 'cpu'. The towers are placed on /<type>:0 ... /<type>:num_towers-1
+    Returns:
+        the total loss averaged across the towers, the averaged (gradient, variable) tuples, and the
+        update ops (e.g. batch norm moving averages), which are only taken from the first tower.
+    """
+
+    batch_size = inputs.get_shape().as_list()[0]
+    if batch_size is None or batch_size % num_towers != 0:
+        raise ValueError("The batch size (%s) must be divisible by the number of towers (%d)." % (batch_size, num_towers))
+
+    tower_inputs = tf.split(inputs, num_towers, axis=0)
+    tower_labels = tf.split(one_hot_labels, num_towers, axis=0)
+
+    tower_losses = []
+    tower_grads = []
+    with tf.variable_scope(tf.get_variable_scope()):
+        for i in range(num_towers):
+            with tf.device('/%s:%d' % (tower_device_type, i)), tf.name_scope('tower_%d' % i) as scope:
+                with slim.arg_scope([slim.model_variable, slim.variable], device=param_device):
+                    add_model_losses(normalize_inputs(tower_inputs[i]), tower_labels[i], cfg)
+
+                # The other towers reuse the variables of the first tower
+                tf.get_variable_scope().reuse_variables()
+
+                # The regularization losses are only created once (with the variables), but every tower
+                # needs them so that the averaged gradient includes them.
+                losses = tf.losses.get_losses(scope=scope) + tf.losses.get_regularization_losses()
+                tower_loss = tf.add_n(losses, name='tower_loss')
+
+                if i == 0:
+                    # The batch norm statistics of the first tower are used to update the moving averages.
+                    update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS, scope)
+                    variables_to_train = get_trainable_variables(trainable_scopes)
+
+                tower_losses.append(tower_loss)
+                tower_grads.append(optimizer.compute_gradients(tower_loss, var_list=variables_to_train))
+
+    total_loss = tf.multiply(tf.add_n(tower_losses), 1. / num_towers, name='total_loss')
+    grads_and_vars = _average_gradients(tower_grads)
+
+    return total_loss, grads_and_vars, update_ops
+
+def create_train_op_from_gradients(total_loss, grads_and_vars, optimizer, global_step, update_ops, clip_gradient_norm=0):
+    """Like `slim.learning.create_train_op`, but for gradients that have already been computed.
+    Returns:
+        A `Tensor` that applies the gradients (and runs the update ops) and evaluates to the total loss.
+    """
+
+    if clip_gradient_norm > 0:
+        with tf.name_scope('clip_grads'):
+            grads_and_vars = slim.learning.clip_gradient_norms(grads_and_vars, clip_gradient_norm)
+
+    grad_updates = optimizer.apply_gradients(grads_and_vars, global_step=global_step)
+
+    with tf.name_scope('train_op'):
+        total_loss = tf.check_numerics(total_loss, 'LossTensor is inf or nan')
+        with tf.control_dependencies([grad_updates] + list(update_ops)):
+            train_op = tf.identity(total_loss)
+
+    # Add the operation used for training to the 'train_op' collection
+    train_ops = tf.get_collection_ref(tf.GraphKeys.TRAIN_OP)
+    if train_op not in train_ops:
+        train_ops.append(train_op)
+
+    return train_op
+
+def create_accumulating_train_ops(total_loss, grads_and_vars, optimizer, global_step, accumulation_steps,
+                                  update_ops, apply_update_ops=(), clip_gradient_norm=0):
+    """Sum the gradients of `accumulation_steps` micro-batches and apply their average in one update.
+    Args:
+        update_ops: ops to run for every micro-batch (e.g. the batch norm moving averages)
+        apply_update_ops: ops to run with every update of the variables (e.g. their moving averages)
+    Returns:
+        `accumulate_op`, which adds the gradients of a micro-batch to the accumulators, and `train_op`,
+        which adds the gradients of the last micro-batch, applies the averaged gradients and resets the
+        accumulators. Run `accumulate_op` `accumulation_steps - 1` times before each `train_op` (see
+        `accumulation_train_step_fn`). Both evaluate to the loss of their micro-batch.
+    """
+
+    accumulators = []
+    with tf.name_scope('gradient_accumulation'):
+        for grad, var in grads_and_vars:
+            if grad is None:
+                accumulators.append(None)
+                continue
+            # Each worker accumulates its own gradients
+            with tf.device(grad.device):
+                accumulators.append(tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+                                                trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                                name='accumulator'))
+
+        accumulate_ops = [accumulator.assign_add(tf.convert_to_tensor(grad))
+                          for (grad, _), accumulator in zip(grads_and_vars, accumulators) if accumulator is not None]
+        with tf.control_dependencies(accumulate_ops + list(update_ops)):
+            accumulate_op = tf.identity(total_loss, name='accumulate_op')
+
+        # Averaging the gradients is the same as scaling the loss of each micro-batch by 1 / accumulation_steps
+        average_grads_and_vars = []
+        for (grad, var), accumulator in zip(grads_and_vars, accumulators):
+            if accumulator is None:
+                average_grads_and_vars.append((None, var))
+            else:
+                average_grads_and_vars.append(((accumulator + tf.convert_to_tensor(grad)) / accumulation_steps, var))
+
+    apply_op = create_train_op_from_gradients(total_loss=total_loss,
+                                              grads_and_vars=average_grads_and_vars,
+                                              optimizer=optimizer,
+                                              global_step=global_step,
+                                              update_ops=list(update_ops) + list(apply_update_ops),
+                                              clip_gradient_norm=clip_gradient_norm)
+
+    with tf.control_dependencies([apply_op]):
+        reset_op = tf.group(*[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in accumulators if accumulator is not None])
+    with tf.control_dependencies([reset_op]):
+        train_op = tf.identity(apply_op, name='accumulated_train_op')
+
+    return accumulate_op, train_op
+
+def accumulation_train_step_fn(accumulate_op, accumulation_steps):
+    """A `train_step_fn` for `slim.learning.train` that runs `accumulate_op` `accumulation_steps - 1`
+    times before each train op. `global_step` counts the updates, not the micro-batches.
+    """
+    def train_step_fn(sess, train_op, global_step, train_step_kwargs):
+        for _ in range(accumulation_steps - 1):
+            sess.run(accumulate_op)
+        return slim.learning.train_step(sess, train_op, global_step, train_step_kwargs)
+    return train_step_fn
+
+def instrumented_train_step_fn(step_recorder, accumulate_op=None, accumulation_steps=1):
+    """A `train_step_fn` for `slim.learning.train` that stages each batch (and micro-batch) before running
+    the model on it, and records the step times (see `step_stats.StepStats`).
+    """
+    def train_step_fn(sess, train_op, global_step, train_step_kwargs):
+        step_start_time = time.time()
+        for _ in range(accumulation_steps - 1):
+            step_recorder.stage_batch(sess)
+            sess.run(accumulate_op)
+        step_recorder.stage_batch(sess)
+        total_loss, should_stop = slim.learning.train_step(sess, train_op, global_step, train_step_kwargs)
+        step_recorder.end_step(sess, global_step, step_start_time)
+        return total_loss, should_stop
+    return train_step_fn
+
+def shard_tfrecords(tfrecords, num_workers, task_index):
+    """Give each worker its own subset of the tfrecord files.
+    """
+    if len(tfrecords) < num_workers:
+        raise ValueError("There are fewer tfrecord files (%d) than workers (%d). Split the tfrecords " \
+                         "into more files." % (len(tfrecords), num_workers))
+    return sorted(tfrecords)[task_index::num_workers]
+
+def create_session_config(cfg):
+    """Create the session configuration from `cfg.SESSION_CONFIG`.
+    """
+    sess_config = tf.ConfigProto(
+      log_device_placement=cfg.SESSION_CONFIG.LOG_DEVICE_PLACEMENT,
+      allow_soft_placement = True,
+      gpu_options = tf.GPUOptions(
+          per_process_gpu_memory_fraction=cfg.SESSION_CONFIG.PER_PROCESS_GPU_MEMORY_FRACTION
+      ),
+      intra_op_parallelism_threads=cfg.SESSION_CONFIG.INTRA_OP_PARALLELISM_THREADS if 'INTRA_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None,
+      inter_op_parallelism_threads=cfg.SESSION_CONFIG.INTER_OP_PARALLELISM_THREADS if 'INTER_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None
+    )
+
+    # Compile the graph with XLA
+    if 'XLA_JIT' in cfg.SESSION_CONFIG and cfg.SESSION_CONFIG.XLA_JIT:
+        sess_config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+    return sess_config
+
+def create_saver(cfg):
+    """ A saver for all of the variables. With `ASYNC_CHECKPOINTS`, the checkpoints are written on a
+    background thread (see `async_checkpoint.AsyncSaver`), call `wait_for_checkpoints` before exiting.
+    """
+    if 'ASYNC_CHECKPOINTS' in cfg and cfg.ASYNC_CHECKPOINTS:
+        saver_cls = async_checkpoint.AsyncSaver
+    else:
+        saver_cls = tf.train.Saver
+
+    return saver_cls(
+      # Save all variables
+      max_to_keep = cfg.MAX_TO_KEEP,
+      keep_checkpoint_every_n_hours = cfg.KEEP_CHECKPOINT_EVERY_N_HOURS
+    )
+
+def checkpoint_global_step(checkpoint_path):
+    """ The global step saved in `checkpoint_path`, or 0 if there is no checkpoint (or no global step).
+    """
+    if checkpoint_path is None:
+        return 0
+    reader = tf.train.NewCheckpointReader(checkpoint_path)
+    if not reader.has_tensor('global_step'):
+        return 0
+    return int(reader.get_tensor('global_step'))
+
+def resume_skip_files(checkpoint_path, cfg, num_tfrecords, num_replicas=1):
+    """ The number of tfrecord files (counting every epoch) that each worker of the job that saved
+    `checkpoint_path` has read, estimated from its global step (see the `skip_files` argument of
+    `input_nodes`).
+    """
+    global_step = checkpoint_global_step(checkpoint_path)
+
+    num_epochs = global_step * effective_batch_size(cfg, num_replicas) / float(cfg.NUM_TRAIN_EXAMPLES)
+    return int(num_epochs * num_tfrecords)
+
+def wait_for_checkpoints(saver):
+    """ Wait for the checkpoint that an `AsyncSaver` is writing, if any.
+    """
+    if isinstance(saver, async_checkpoint.AsyncSaver):
+        saver.wait()
+
+# The end point before the final pooling / dropout / logits of each network, the default
+# CACHED_BOTTLENECK.END_POINT
+DEFAULT_BOTTLENECK_END_POINTS = {
+    'inception_v1' : 'Mixed_5c',
+    'inception_v2' : 'Mixed_5c',
+    'inception_v3' : 'PreLogits',
+    'inception_v4' : 'PreLogitsFlatten',
+    'inception_resnet_v2' : 'PreLogitsFlatten',
+    'resnet_v2_50' : 'resnet_v2_50/block4',
+    'resnet_v2_101' : 'resnet_v2_101/block4',
+    'resnet_v2_152' : 'resnet_v2_152/block4',
+    'resnet_v2_200' : 'resnet_v2_200/block4',
+    'mobilenet_v1' : 'AvgPool_1a',
+    'mobilenet_v1_075' : 'AvgPool_1a',
+    'mobilenet_v1_050' : 'AvgPool_1a',
+    'mobilenet_v1_025' : 'AvgPool_1a'
+}
+
+def _bottleneck_end_point(cfg):
+    if 'END_POINT' in cfg.CACHED_BOTTLENECK and cfg.CACHED_BOTTLENECK.END_POINT:
+        return cfg.CACHED_BOTTLENECK.END_POINT
+    if cfg.MODEL_NAME not in DEFAULT_BOTTLENECK_END_POINTS:
+        raise ValueError("There is no default CACHED_BOTTLENECK.END_POINT for %s, set one." % (cfg.MODEL_NAME,))
+    return DEFAULT_BOTTLENECK_END_POINTS[cfg.MODEL_NAME]
+
+def _get_bottleneck(end_points, end_point):
+    if end_point not in end_points:
+        raise ValueError("Unknown bottleneck end point: %s. Options are: %s" % (end_point, ', '.join(sorted(end_points.keys()))))
+    return end_points[end_point]
+
+def _cached_bottleneck_keep_prob(bottleneck, logits, cfg):
+    """The keep probability of the dropout applied to the cached features. Networks whose dropout
+    is between the bottleneck and the logits (e.g. `AvgPool_1a` of mobilenet_v1) already apply it
+    to the fed features, so the features are only dropped out when the dropout is before the bottleneck
+    (e.g. `PreLogits` of inception_v3).
+    """
+    if bottleneck_cache.has_dropout_between(bottleneck, logits):
+        return 1.
+    return cfg.DROPOUT_KEEP_PROB
+
+def _deterministic_image_processing(cfg):
+    """A copy of the `IMAGE_PROCESSING` configuration with the random augmentations turned off.
+    """
+    cfg = copy.deepcopy(cfg)
+    cfg.DO_RANDOM_CROP = 0
+    cfg.DO_RANDOM_FLIP_LEFT_RIGHT = False
+    cfg.DO_COLOR_DISTORTION = 0
+    cfg.RESIZE_FAST = True
+    if cfg.DO_CENTRAL_CROP not in (0, 1):
+        cfg.DO_CENTRAL_CROP = 0
+    if 'BBOX_CFG' in cfg and 'DO_EXPANSION' in cfg.BBOX_CFG and cfg.BBOX_CFG.DO_EXPANSION not in (0, 1):
+        cfg.BBOX_CFG.DO_EXPANSION = 0
+    return cfg
+
+def trains_head_only(cfg, trainable_scopes):
+    """Is every variable in `trainable_scopes` after the `CACHED_BOTTLENECK.END_POINT` of the network?
+    Then the bottleneck features don't change during training, and they can be cached.
+    """
+    if trainable_scopes is None:
+        return False
+
+    with tf.Graph().as_default():
+        input_size = cfg.IMAGE_PROCESSING.INPUT_SIZE
+        inputs = tf.placeholder(tf.float32, [1, input_size, input_size, 3])
+        _, end_points = build_network(inputs, cfg, is_training=True)
+        bottleneck = _get_bottleneck(end_points, _bottleneck_end_point(cfg))
+        variables_to_train = get_trainable_variables(trainable_scopes)
+        return len(variables_to_train) > 0 and len(bottleneck_cache.variables_read_by(bottleneck, variables_to_train)) == 0
+
+def extract_bottlenecks(tfrecords, cfg, checkpoint_path, restore_variables_with_moving_averages=False, read_images=False):
+    """Compute the bottleneck features of the training examples with the network restored from
+    `checkpoint_path`, and store them in `CACHED_BOTTLENECK.CACHE_DIR`. An existing store is reused.
+    Returns:
+        the directory of the feature store
+    """
+    bottleneck_cfg = cfg.CACHED_BOTTLENECK
+    end_point = _bottleneck_end_point(cfg)
+    augment = 'AUGMENT' in bottleneck_cfg and bottleneck_cfg.AUGMENT
+    if augment:
+        image_cfg = cfg.IMAGE_PROCESSING
+        num_views = bottleneck_cfg.NUM_VIEWS if 'NUM_VIEWS' in bottleneck_cfg else 1
+    else:
+        image_cfg = _deterministic_image_processing(cfg.IMAGE_PROCESSING)
+        num_views = 1
+
+    graph = tf.Graph()
+    with graph.as_default():
+
+        with tf.device('/cpu:0'):
+            batch_dict = input_nodes(
+                tfrecords=tfrecords,
+                cfg=image_cfg,
+                num_epochs=num_views,
+                batch_size=cfg.BATCH_SIZE,
+                num_threads=cfg.NUM_INPUT_THREADS,
+                shuffle_batch=False,
+                random_seed=cfg.RANDOM_SEED,
+                capacity=cfg.QUEUE_CAPACITY,
+                min_after_dequeue=cfg.QUEUE_MIN,
+                add_summaries=False,
+                input_type='train',
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES
+            )
+
+        _, end_points = build_network(normalize_inputs(batch_dict['inputs']), cfg, is_training=False)
+        bottleneck = _get_bottleneck(end_points, end_point)
+
+        # Only the variables before the bottleneck are needed
+        backbone_variables = bottleneck_cache.variables_read_by(bottleneck, slim.get_model_variables())
+        if restore_variables_with_moving_averages:
+            ema = tf.train.ExponentialMovingAverage(decay=1)
+            variables_to_restore = {ema.average_name(var) : var for var in backbone_variables}
+        else:
+            variables_to_restore = backbone_variables
+        tf.logging.info('Restoring the bottleneck variables from %s' % checkpoint_path)
+        init_fn = slim.assign_from_checkpoint_fn(checkpoint_path, variables_to_restore)
+
+        init_op = tf.group(tf.global_variables_initializer(), tf.local_variables_initializer())
+
+        with tf.Session(config=create_session_config(cfg)) as sess:
+            sess.run(init_op)
+            init_fn(sess)
+
+            key = bottleneck_cache.store_key(tfrecords, {
+                'model_name' : cfg.MODEL_NAME,
+                'end_point' : end_point,
+                'image_processing' : image_cfg,
+                'num_views' : num_views,
+                'batch_size' : cfg.BATCH_SIZE,
+                'read_images' : read_images,
+                'variables' : bottleneck_cache.variables_digest(sess, backbone_variables)
+            })
+            store_dir = os.path.join(bottleneck_cfg.CACHE_DIR, key)
+
+            if bottleneck_cache.is_complete(store_dir):
+                tf.logging.info('Using bottleneck cache %s' % (store_dir,))
+                return store_dir
+
+            tf.logging.info('Building bottleneck cache %s' % (store_dir,))
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+
+            def batches():
+                try:
+                    while True:
+                        yield sess.run([bottleneck, batch_dict['labels']])
+                except tf.errors.OutOfRangeError:
+                    pass
+
+            try:
+                num_examples = bottleneck_cache.write_feature_store(store_dir, batches())
+            finally:
+                coord.request_stop()
+                coord.join(threads)
+
+    tf.logging.info('Cached the bottleneck features of %d examples' % (num_examples,))
+
+    return store_dir
+
+def train_on_cached_bottlenecks(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=None, checkpoint_exclude_scopes=None, restore_variables_with_moving_averages=False, restore_moving_averages=False, read_images=False,
+                                profiler=None, preemption_handler=None):
+    """Train the variables in `trainable_scopes` (which must be after the bottleneck, see `trains_head_only`)
+    on cached bottleneck features, without running the rest of the network. The checkpoints contain
+    all of the variables of the network, like the checkpoints saved by `train`.
+    """
+    tf.logging.set_verbosity(tf.logging.INFO)
+
+    # The bottleneck variables are never trained, so a checkpoint in the logdir has the same
+    # values as the pretrained model.
+    checkpoint_path = tf.train.latest_checkpoint(logdir)
+    restore_bottleneck_with_moving_averages = False
+    if checkpoint_path is None and pretrained_model_path is not None:
+        if os.path.isdir(pretrained_model_path):
+            checkpoint_path = tf.train.latest_checkpoint(pretrained_model_path)
+            if checkpoint_path is None:
+                raise ValueError("No model checkpoint file found in directory %s" % (pretrained_model_path))
+        else:
+            checkpoint_path = pretrained_model_path
+        restore_bottleneck_with_moving_averages = restore_variables_with_moving_averages
+    if checkpoint_path is None:
+        raise ValueError("Training on cached bottlenecks requires --pretrained_model (or a checkpoint in the logdir).")
+
+    store_dir = extract_bottlenecks(tfrecords, cfg, checkpoint_path,
+                                    restore_variables_with_moving_averages=restore_bottleneck_with_moving_averages,
+                                    read_images=read_images)
+    features, labels = bottleneck_cache.load_feature_store(store_dir)
+
+    graph = tf.Graph()
+    with graph.as_default():
+
+        global_step = slim.get_or_create_global_step()
+
+        # The network is built on image inputs that are never fed. The bottleneck is fed instead.
+        input_size = cfg.IMAGE_PROCESSING.INPUT_SIZE
+        # The whole network isn't run, so there is no need to accumulate gradients
+        batch_size = effective_batch_size(cfg)
+        inputs = tf.placeholder(tf.float32, [batch_size, input_size, input_size, 3], name='inputs')
+        labels_placeholder = tf.placeholder(tf.int64, [batch_size], name='labels')
+
+        logits, end_points = build_network(inputs, cfg, is_training=True)
+        bottleneck = _get_bottleneck(end_points, _bottleneck_end_point(cfg))
+        feature_keep_prob = _cached_bottleneck_keep_prob(bottleneck, logits, cfg)
+
+        # Variables that are not on the path from the bottleneck to the logits (e.g. the auxiliary
+        # logits) can't be trained from the bottleneck.
+        trainable_vars = get_trainable_variables(trainable_scopes)
+        variables_to_train = bottleneck_cache.variables_read_by(logits, trainable_vars)
+        skipped_variables = [var.op.name for var in trainable_vars if var not in variables_to_train]
+        if len(skipped_variables) > 0:
+            tf.logging.warn('These variables are not trained on cached bottlenecks: %s' % (', '.join(skipped_variables),))
+
+        loss = tf.losses.softmax_cross_entropy(
+            logits=logits, onehot_labels=tf.one_hot(labels_placeholder, cfg.NUM_CLASSES),
+            label_smoothing=cfg.LABEL_SMOOTHING, weights=1.0)
+        regularization_losses = [regularization_loss for regularization_loss in tf.losses.get_regularization_losses()
+                                 if len(bottleneck_cache.variables_read_by(regularization_loss, variables_to_train)) > 0]
+        total_loss = tf.add_n([loss] + regularization_losses, name='total_loss')
+
+        lr = _configure_learning_rate(global_step, cfg)
+        optimizer = _configure_optimizer(lr, cfg)
+
+        update_ops = []
+        set_fixed_averages_op = None
+        if 'MOVING_AVERAGE_DECAY' in cfg and cfg.MOVING_AVERAGE_DECAY > 0:
+            ema = tf.train.ExponentialMovingAverage(
+                decay=cfg.MOVING_AVERAGE_DECAY,
+                num_updates=global_step
+            )
+            update_ops.append(ema.apply(variables_to_train))
+            # The other variables don't change, so their moving averages are set once
+            fixed_variables = [var for var in slim.get_model_variables() if var not in variables_to_train]
+            ema.apply(fixed_variables)
+            set_fixed_averages_op = tf.group(*[tf.assign(ema.average(var), var) for var in fixed_variables])
+        elif restore_variables_with_moving_averages or restore_moving_averages:
+            ema = tf.train.ExponentialMovingAverage(
+                decay=1,
+                num_updates=global_step
+            )
+        else:
+            ema = None
+
+        # The batch norm update ops are not run, they need the images.
+        train_op = slim.learning.create_train_op(total_loss=total_loss,
+                                                 optimizer=optimizer,
+                                                 global_step=global_step,
+                                                 update_ops=update_ops,
+                                                 variables_to_train=variables_to_train,
+                                                 clip_gradient_norm=cfg.CLIP_GRADIENT_NORM)
+
+        summary_op = tf.summary.merge([
+            tf.summary.scalar(name='losses/total_loss', tensor=total_loss),
+            tf.summary.scalar(name='learning_rate', tensor=lr)
+        ])
+
+        saver = create_saver(cfg)
+
+        init_op = tf.global_variables_initializer()
+        init_fn = get_init_function(logdir, pretrained_model_path, checkpoint_exclude_scopes, restore_variables_with_moving_averages=restore_variables_with_moving_averages, restore_moving_averages=restore_moving_averages, ema=ema)
+
+    with tf.Session(graph=graph, config=create_session_config(cfg)) as sess:
+
+        if tf.train.latest_checkpoint(logdir):
+            saver.restore(sess, tf.train.latest_checkpoint(logdir))
+        else:
+            sess.run(init_op)
+            if init_fn is not None:
+                init_fn(sess)
+            if set_fixed_averages_op is not None and not restore_moving_averages:
+                sess.run(set_fixed_averages_op)
+
+        summary_writer = tf.summary.FileWriter(logdir, graph)
+        checkpoint_prefix = os.path.join(logdir, 'model.ckpt')
+
+        batches = bottleneck_cache.random_batches(features, labels, batch_size,
+                                                  rng=np.random.RandomState(int(cfg.RANDOM_SEED)),
+                                                  keep_prob=feature_keep_prob)
+
+        step = sess.run(global_step)
+        last_summary_time = last_save_time = time.time()
+        while step < cfg.NUM_TRAIN_ITERATIONS:
+
+            if preemption_handler is not None and preemption_handler.preempted:
+                break
+
+            batch_features, batch_labels = next(batches)
+            feed_dict = {bottleneck : batch_features, labels_placeholder : batch_labels}
+
+            start_time = time.time()
+            if profiler is not None:
+                profiler.begin_step()
+                loss_value = profiler.run(sess, train_op, feed_dict)
+            else:
+                loss_value = sess.run(train_op, feed_dict)
+            step += 1
+
+            if step % cfg.LOG_EVERY_N_STEPS == 0:
+                tf.logging.info('global step %d: loss = %.4f (%.3f sec/step)' % (step, loss_value, time.time() - start_time))
+
+            if time.time() - last_summary_time >= cfg.SAVE_SUMMARY_SECS:
+                summary_writer.add_summary(sess.run(summary_op, feed_dict), step)
+                last_summary_time = time.time()
+
+            if time.time() - last_save_time >= cfg.SAVE_INTERVAL_SECS:
+                saver.save(sess, checkpoint_prefix, global_step=step)
+                last_save_time = time.time()
+
+        saver.save(sess, checkpoint_prefix, global_step=step)
+        wait_for_checkpoints(saver)
+        summary_writer.close()
+
+def progressive_resizing_stages(cfg):
+    """ The stages of `PROGRESSIVE_RESIZING.SCHEDULE`, as a list of (last step, input size). The
+    last stage trains at `IMAGE_PROCESSING.INPUT_SIZE` until `NUM_TRAIN_ITERATIONS`.
+    """
+    steps_per_epoch = cfg.NUM_TRAIN_EXAMPLES / float(effective_batch_size(cfg))
+    stages = []
+    previous_epoch = 0
+    for end_epoch, input_size in cfg.PROGRESSIVE_RESIZING.SCHEDULE:
+        if end_epoch <= previous_epoch:
+            raise ValueError("The epochs of PROGRESSIVE_RESIZING.SCHEDULE must be positive and increasing.")
+        previous_epoch = end_epoch
+        last_step = int(end_epoch * steps_per_epoch)
+        if last_step >= cfg.NUM_TRAIN_ITERATIONS:
+            stages.append((cfg.NUM_TRAIN_ITERATIONS, input_size))
+            return stages
+        stages.append((last_step, input_size))
+    stages.append((cfg.NUM_TRAIN_ITERATIONS, cfg.IMAGE_PROCESSING.INPUT_SIZE))
+    return stages
+
+def check_input_sizes(cfg, input_sizes):
+    """ Check that the variables of the network don't depend on the input size, so that the stages of
+    progressive resizing can share the checkpoints. The pooling kernels of the networks adapt to the
+    input size, but some auxiliary heads (e.g. inception_v4) have kernels the size of their input.
+    Raises:
+        ValueError: if the variables are different for some of the `input_sizes`
+    """
+    first_shapes = None
+    for input_size in input_sizes:
+        with tf.Graph().as_default():
+            inputs = tf.placeholder(tf.float32, [1, input_size, input_size, 3])
+            build_network(inputs, cfg, is_training=True)
+            shapes = {var.op.name : var.get_shape().as_list() for var in slim.get_model_variables()}
+        if first_shapes is None:
+            first_size, first_shapes = input_size, shapes
+        elif shapes != first_shapes:
+            names = sorted(set(shapes) ^ set(first_shapes) |
+                           set(name for name in shapes if name in first_shapes and shapes[name] != first_shapes[name]))
+            raise ValueError("The variables of %s differ for input sizes %d and %d, so they can't be used for progressive " \
+                             "resizing: %s" % (cfg.MODEL_NAME, first_size, input_size, ', '.join(names)))
+
+def train_progressive_resizing(tfrecords, logdir, cfg, **kwargs):
+    """ Train at each input size of `PROGRESSIVE_RESIZING.SCHEDULE` in turn (see `train` for the arguments).
+    Each stage builds the graph for its input size, resumes from the checkpoint that the previous stage
+    saved when it stopped, and trains until the last step of the stage. The learning rate schedule
+    depends on the global step, so it continues across the stages. Stages that the checkpoint in the
+    logdir has already completed are skipped.
+    """
+    stages = progressive_resizing_stages(cfg)
+    check_input_sizes(cfg, sorted(set(input_size for _, input_size in stages)))
+
+    for last_step, input_size in stages:
+        if checkpoint_global_step(tf.train.latest_checkpoint(logdir)) >= last_step:
+            continue
+        tf.logging.info('Progressive resizing: training at input size %d until step %d' % (input_size, last_step))
+
+        stage_cfg = copy.deepcopy(cfg)
+        stage_cfg.PROGRESSIVE_RESIZING.ENABLED = False
+        stage_cfg.IMAGE_PROCESSING.INPUT_SIZE = input_size
+        train(tfrecords, logdir, stage_cfg, number_of_steps=last_step, **kwargs)
+
+        # The job was preempted (or otherwise stopped early), so don't start the next stage
+        if checkpoint_global_step(tf.train.latest_checkpoint(logdir)) < last_step:
+            return
+
+def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=None, checkpoint_exclude_scopes=None, restore_variables_with_moving_averages=False, restore_moving_averages=False, read_images=False,
+          cluster=None, task_index=0, master='', profiler=None, number_of_steps=None, validation_tfrecords=None):
     """
     Args:
         tfrecords (list)
@@ -256,18 +972,98 @@ def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=N
         logdir (str)
         cfg (EasyDict)
         pretrained_model_path (str) : path to a pretrained Inception Network
+        cluster (tf.train.ClusterSpec) : If provided, then this is a worker in a distributed job. The
+            variables are placed on the `ps` tasks and the tfrecords are sharded across the workers.
+        task_index (int) : The index of this worker. Worker 0 is the chief, which initializes the
+            variables and saves the checkpoints and summaries.
+        master (str) : The address of the tensorflow server for this worker.
+        profiler (profiling.Profiler) : If provided, then trace the training steps.
+        number_of_steps (int) : The global step to stop training at, defaults to `NUM_TRAIN_ITERATIONS`.
+        validation_tfrecords (list) : If provided, then validate on these tfrecords every
+            `VALIDATION.EVERY_N_STEPS` steps (on the chief).
     """
     tf.logging.set_verbosity(tf.logging.INFO)
 
+    if 'PROGRESSIVE_RESIZING' in cfg and cfg.PROGRESSIVE_RESIZING.ENABLED:
+        if cluster is None:
+            train_progressive_resizing(tfrecords, logdir, cfg,
+                                       pretrained_model_path=pretrained_model_path,
+                                       trainable_scopes=trainable_scopes,
+                                       checkpoint_exclude_scopes=checkpoint_exclude_scopes,
+                                       restore_variables_with_moving_averages=restore_variables_with_moving_averages,
+                                       restore_moving_averages=restore_moving_averages,
+                                       read_images=read_images,
+                                       profiler=profiler,
+                                       validation_tfrecords=validation_tfrecords)
+            return
+        tf.logging.warn('PROGRESSIVE_RESIZING is not supported for distributed jobs, so the whole job trains at INPUT_SIZE.')
+
+    if number_of_steps is None:
+        number_of_steps = cfg.NUM_TRAIN_ITERATIONS
+
+    resume_checkpoint = tf.train.latest_checkpoint(logdir)
+    if resume_checkpoint is not None:
+        tf.logging.info('Resuming from %s' % (resume_checkpoint,))
+        # All of the variables are restored from the checkpoint, so skip restoring the pretrained model
+        pretrained_model_path = None
+
+    preemption_handler = None
+    if 'PREEMPTION' in cfg and cfg.PREEMPTION.ENABLED:
+        preemption_handler = preemption.PreemptionHandler(cfg.PREEMPTION.SIGNALS)
+
+    if 'CACHED_BOTTLENECK' in cfg and cfg.CACHED_BOTTLENECK.ENABLED:
+        if cluster is None and trains_head_only(cfg, trainable_scopes):
+            train_on_cached_bottlenecks(tfrecords, logdir, cfg,
+                                        pretrained_model_path=pretrained_model_path,
+                                        trainable_scopes=trainable_scopes,
+                                        checkpoint_exclude_scopes=checkpoint_exclude_scopes,
+                                        restore_variables_with_moving_averages=restore_variables_with_moving_averages,
+                                        restore_moving_averages=restore_moving_averages,
+                                        read_images=read_images,
+                                        profiler=profiler,
+                                        preemption_handler=preemption_handler)
+            if preemption_handler is not None:
+                preemption_handler.uninstall()
+            return
+        tf.logging.warn('CACHED_BOTTLENECK is enabled, but the --trainable_scopes include variables before %s ' \
+                        '(or this is a distributed job), so the whole network will be run.' % (_bottleneck_end_point(cfg),))
+
+    if cluster is not None:
+        num_workers = cluster.num_tasks('worker')
+        is_chief = task_index == 0
+        tfrecords = shard_tfrecords(tfrecords, num_workers, task_index)
+        worker_device = '/job:worker/task:%d' % task_index
+        device_setter = tf.train.replica_device_setter(worker_device=worker_device, cluster=cluster)
+        input_device = worker_device + '/cpu:0'
+    else:
+        num_workers = 1
+        is_chief = True
+        device_setter = None
+        input_device = '/cpu:0'
+
+    sync_replicas = cluster is not None and 'SYNC_REPLICAS' in cfg and cfg.SYNC_REPLICAS
+    replicas_to_aggregate = 1
+    if sync_replicas:
+        if 'REPLICAS_TO_AGGREGATE' in cfg and cfg.REPLICAS_TO_AGGREGATE:
+            replicas_to_aggregate = cfg.REPLICAS_TO_AGGREGATE
+        else:
+            replicas_to_aggregate = num_workers
+
+    # Continue the input pipeline of the job being resumed, rather than starting from the beginning
+    skip_files = 0
+    if resume_checkpoint is not None and 'PREEMPTION' in cfg and cfg.PREEMPTION.RESUME_INPUTS:
+        skip_files = resume_skip_files(resume_checkpoint, cfg, len(tfrecords), num_replicas=replicas_to_aggregate)
+        tf.logging.info('Skipping the %d tfrecord files (counting every epoch) that were read before resuming' % (skip_files,))
+
     graph = tf.Graph()
 
-    # Force all Variables to reside on the CPU.
-    with graph.as_default():
+    # Force all Variables to reside on the CPU (or on the parameter servers).
+    with graph.as_default(), tf.device(device_setter):
 
         # Create a variable to count the number of train() calls.
         global_step = slim.get_or_create_global_step()
 
-        with tf.device('/cpu:0'):
+        with tf.device(input_device):
             batch_dict = input_nodes(
                 tfrecords=tfrecords,
                 cfg=cfg.IMAGE_PROCESSING,
@@ -280,9 +1076,23 @@ def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=N
                 min_after_dequeue=cfg.QUEUE_MIN,
                 add_summaries=True,
                 input_type='train',
-                read_filenames=read_images
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                region_cache_cfg=cfg.REGION_CACHE if 'REGION_CACHE' in cfg else None,
+                uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                num_classes=cfg.NUM_CLASSES,
+                skip_files=skip_files,
+                num_examples=cfg.NUM_TRAIN_EXAMPLES
             )
 
+            # Fetch each batch with its own session run, so that the time spent waiting for the
+            # input pipeline can be measured.
+            record_step_stats = 'STEP_STATS' in cfg and cfg.STEP_STATS.ENABLED
+            if record_step_stats:
+                stage_op, batch_dict = step_stats.stage_batch(batch_dict)
+                queue_fill = queue_fill_ops(graph)
+
             batched_one_hot_labels = slim.one_hot_encoding(batch_dict['labels'],
                                                         num_classes=cfg.NUM_CLASSES)
 
@@ -291,30 +1101,42 @@ def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=N
         #                   [batch_dict['inputs'], batched_one_hot_labels], capacity=2)
         # inputs, labels = batch_queue.dequeue()
 
-        arg_scope = nets_factory.arg_scopes_map[cfg.MODEL_NAME](
-            weight_decay=cfg.WEIGHT_DECAY,
-            batch_norm_decay=cfg.BATCHNORM_MOVING_AVERAGE_DECAY,
-            batch_norm_epsilon=cfg.BATCHNORM_EPSILON
-        )
+        # Calculate the learning rate schedule.
+        lr = _configure_learning_rate(global_step, cfg, num_replicas=replicas_to_aggregate)
 
-        with slim.arg_scope(arg_scope):
-            logits, end_points = nets_factory.networks_map[cfg.MODEL_NAME](
-                inputs=batch_dict['inputs'],
-                num_classes=cfg.NUM_CLASSES,
-                dropout_keep_prob=cfg.DROPOUT_KEEP_PROB,
-                is_training=True
-            )
+        # Create an optimizer that performs gradient descent.
+        optimizer = _configure_optimizer(lr, cfg)
 
-            # Add the losses
-            if 'AuxLogits' in end_points:
-                tf.losses.softmax_cross_entropy(
-                    logits=end_points['AuxLogits'], onehot_labels=batched_one_hot_labels,
-                    label_smoothing=cfg.LABEL_SMOOTHING, weights=0.4, scope='aux_loss')
+        # Aggregate the gradients from the workers before applying them
+        sync_optimizer = None
+        if sync_replicas:
+            optimizer = tf.train.SyncReplicasOptimizer(
+                optimizer,
+                replicas_to_aggregate=replicas_to_aggregate,
+                total_num_replicas=num_workers
+            )
+            sync_optimizer = optimizer
 
-            tf.losses.softmax_cross_entropy(
-                logits=logits, onehot_labels=batched_one_hot_labels, label_smoothing=cfg.LABEL_SMOOTHING, weights=1.0)
+        num_towers = cfg.NUM_TOWERS if 'NUM_TOWERS' in cfg else 1
+        tower_device_type = cfg.TOWER_DEVICE_TYPE if 'TOWER_DEVICE_TYPE' in cfg else 'gpu'
 
+        # The recomputed blocks only differentiate the variables that they create
+        if num_towers > 1 and 'GRADIENT_CHECKPOINTING' in cfg and cfg.GRADIENT_CHECKPOINTING:
+            raise ValueError("GRADIENT_CHECKPOINTING can't be used with NUM_TOWERS > 1, use ACCUMULATION_STEPS instead.")
 
+        if num_towers > 1:
+            total_loss, grads_and_vars, update_ops = build_towers(
+                inputs=batch_dict['inputs'],
+                one_hot_labels=batched_one_hot_labels,
+                cfg=cfg,
+                optimizer=optimizer,
+                num_towers=num_towers,
+                tower_device_type=tower_device_type,
+                param_device='/cpu:0',
+                trainable_scopes=trainable_scopes
+            )
+        else:
+            add_model_losses(normalize_inputs(batch_dict['inputs']), batched_one_hot_labels, cfg)
 
         summaries = set(tf.get_collection(tf.GraphKeys.SUMMARIES))
 
@@ -327,7 +1149,8 @@ def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=N
             regularization_loss = tf.add_n(regularization_losses, name='regularization_loss')
             summaries.add(tf.summary.scalar(name='losses/regularization_loss', tensor=regularization_loss))
 
-        total_loss = tf.losses.get_total_loss()
+        if num_towers == 1:
+            total_loss = tf.losses.get_total_loss()
         summaries.add(tf.summary.scalar(name='losses/total_loss', tensor=total_loss))
 
 
@@ -350,59 +1173,162 @@ def train(tfrecords, logdir, cfg, pretrained_model_path=None, trainable_scopes=N
             ema = None
 
 
-        # Calculate the learning rate schedule.
-        lr = _configure_learning_rate(global_step, cfg)
-
-        # Create an optimizer that performs gradient descent.
-        optimizer = _configure_optimizer(lr, cfg)
-
         summaries.add(tf.summary.scalar(tensor=lr,
                                         name='learning_rate'))
 
         # Add the moving average update ops to the graph
+        ema_op = None
         if ema != None and moving_average_variables != None:
-            tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, ema.apply(moving_average_variables))
-
-        trainable_vars = get_trainable_variables(trainable_scopes)
-        train_op = slim.learning.create_train_op(total_loss=total_loss,
-                                                 optimizer=optimizer,
-                                                 global_step=global_step,
-                                                 variables_to_train=trainable_vars,
-                                                 clip_gradient_norm=cfg.CLIP_GRADIENT_NORM)
+            ema_op = ema.apply(moving_average_variables)
+            tf.add_to_collection(tf.GraphKeys.UPDATE_OPS, ema_op)
+            if num_towers > 1:
+                update_ops.append(ema_op)
+
+        accumulation_steps = cfg.ACCUMULATION_STEPS if 'ACCUMULATION_STEPS' in cfg else 1
+        train_step_fn = slim.learning.train_step
+        accumulate_op = None
+
+        if accumulation_steps > 1:
+            if num_towers == 1:
+                update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+                grads_and_vars = optimizer.compute_gradients(total_loss, var_list=get_trainable_variables(trainable_scopes))
+            # The batch norm moving averages are updated with every micro-batch, and the moving
+            # averages of the variables with every update.
+            batch_norm_update_ops = [op for op in update_ops if op is not ema_op]
+            accumulate_op, train_op = create_accumulating_train_ops(total_loss=total_loss,
+                                                                    grads_and_vars=grads_and_vars,
+                                                                    optimizer=optimizer,
+                                                                    global_step=global_step,
+                                                                    accumulation_steps=accumulation_steps,
+                                                                    update_ops=batch_norm_update_ops,
+                                                                    apply_update_ops=[ema_op] if ema_op is not None else [],
+                                                                    clip_gradient_norm=cfg.CLIP_GRADIENT_NORM)
+            train_step_fn = accumulation_train_step_fn(accumulate_op, accumulation_steps)
+        elif num_towers > 1:
+            train_op = create_train_op_from_gradients(total_loss=total_loss,
+                                                      grads_and_vars=grads_and_vars,
+                                                      optimizer=optimizer,
+                                                      global_step=global_step,
+                                                      update_ops=update_ops,
+                                                      clip_gradient_norm=cfg.CLIP_GRADIENT_NORM)
+        else:
+            trainable_vars = get_trainable_variables(trainable_scopes)
+            train_op = slim.learning.create_train_op(total_loss=total_loss,
+                                                     optimizer=optimizer,
+                                                     global_step=global_step,
+                                                     variables_to_train=trainable_vars,
+                                                     clip_gradient_norm=cfg.CLIP_GRADIENT_NORM)
+
+        # Validate with a copy of the network that shares the variables
+        validator = None
+        if validation_tfrecords and is_chief and 'VALIDATION' in cfg and cfg.VALIDATION.EVERY_N_STEPS > 0:
+            with tf.device(input_device):
+                validation_batch_dict = input_nodes(
+                    tfrecords=validation_tfrecords,
+                    cfg=_deterministic_image_processing(cfg.IMAGE_PROCESSING),
+                    num_epochs=None,
+                    batch_size=cfg.BATCH_SIZE,
+                    num_threads=cfg.NUM_INPUT_THREADS,
+                    shuffle_batch=False,
+                    random_seed=cfg.RANDOM_SEED,
+                    capacity=cfg.QUEUE_CAPACITY,
+                    min_after_dequeue=cfg.QUEUE_MIN,
+                    add_summaries=False,
+                    input_type='test',
+                    read_filenames=read_images,
+                    pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                    uint8_inputs=cfg.UINT8_INPUTS if 'UINT8_INPUTS' in cfg else False,
+                    read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None,
+                    num_classes=cfg.NUM_CLASSES
+                )
+            with tf.name_scope('validation'), tf.variable_scope(tf.get_variable_scope(), reuse=True):
+                validation_logits, validation_end_points = build_network(normalize_inputs(validation_batch_dict['inputs']), cfg, is_training=False)
+            validator = validation.Validator(validation_logits,
+                                             validation_end_points['Predictions'],
+                                             validation_batch_dict['labels'],
+                                             every_n_steps=cfg.VALIDATION.EVERY_N_STEPS,
+                                             num_batches=cfg.VALIDATION.NUM_BATCHES,
+                                             output_dir=os.path.join(logdir, 'validation'),
+                                             accuracy_at_k=cfg.VALIDATION.ACCURACY_AT_K_METRIC if 'ACCURACY_AT_K_METRIC' in cfg.VALIDATION else (),
+                                             patience=cfg.VALIDATION.EARLY_STOPPING_PATIENCE if 'EARLY_STOPPING_PATIENCE' in cfg.VALIDATION else 0,
+                                             min_delta=cfg.VALIDATION.EARLY_STOPPING_MIN_DELTA if 'EARLY_STOPPING_MIN_DELTA' in cfg.VALIDATION else 0.)
+
+        trace_every_n_steps = None
+        if 'STEP_STATS' in cfg:
+            if record_step_stats:
+                if cluster is not None and task_index > 0:
+                    step_stats_dir = os.path.join(logdir, 'step_stats_worker_%d' % task_index)
+                else:
+                    step_stats_dir = os.path.join(logdir, 'step_stats')
+                tensors_to_log = {'queue_fill/%s' % name : fill_op for name, fill_op in queue_fill.items()}
+                tensors_to_log['learning_rate'] = lr
+                log_memory = 'LOG_MEMORY' in cfg.STEP_STATS and cfg.STEP_STATS.LOG_MEMORY
+                if log_memory and tower_device_type == 'gpu':
+                    tensors_to_log.update(memory_stats.device_memory_ops(['/gpu:%d' % i for i in range(num_towers)]))
+                step_recorder = step_stats.StepStats(stage_op,
+                                                     examples_per_step=cfg.BATCH_SIZE * accumulation_steps,
+                                                     log_every_n_steps=cfg.LOG_EVERY_N_STEPS,
+                                                     output_dir=step_stats_dir,
+                                                     tensors_to_log=tensors_to_log,
+                                                     log_host_memory=log_memory)
+                train_step_fn = instrumented_train_step_fn(step_recorder, accumulate_op, accumulation_steps)
+
+            # Save a full trace of a step (RunMetadata and a chrome timeline) in the logdir
+            if 'TRACE_EVERY_N_STEPS' in cfg.STEP_STATS and cfg.STEP_STATS.TRACE_EVERY_N_STEPS > 0:
+                trace_every_n_steps = cfg.STEP_STATS.TRACE_EVERY_N_STEPS
+
+        if preemption_handler is not None:
+            train_step_fn = preemption_handler.wrap_train_step_fn(train_step_fn)
+
+        if validator is not None:
+            train_step_fn = validator.wrap_train_step_fn(train_step_fn)
+
+        if profiler is not None:
+            train_step_fn = profiler.wrap_train_step_fn(train_step_fn)
+
+        saver = create_saver(cfg)
+
+        # Write the final checkpoint before slim.learning.train returns
+        if isinstance(saver, async_checkpoint.AsyncSaver):
+            train_step_fn = saver.wrap_train_step_fn(train_step_fn)
 
         # Merge all of the summaries
         summaries |= set(tf.get_collection(tf.GraphKeys.SUMMARIES))
         summary_op = tf.summary.merge(inputs=list(summaries), name='summary_op')
 
-        sess_config = tf.ConfigProto(
-          log_device_placement=cfg.SESSION_CONFIG.LOG_DEVICE_PLACEMENT,
-          allow_soft_placement = True,
-          gpu_options = tf.GPUOptions(
-              per_process_gpu_memory_fraction=cfg.SESSION_CONFIG.PER_PROCESS_GPU_MEMORY_FRACTION
-          ),
-          intra_op_parallelism_threads=cfg.SESSION_CONFIG.INTRA_OP_PARALLELISM_THREADS if 'INTRA_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None,
-          inter_op_parallelism_threads=cfg.SESSION_CONFIG.INTER_OP_PARALLELISM_THREADS if 'INTER_OP_PARALLELISM_THREADS' in cfg.SESSION_CONFIG else None
-        )
+        sess_config = create_session_config(cfg)
 
-        saver = tf.train.Saver(
-          # Save all variables
-          max_to_keep = cfg.MAX_TO_KEEP,
-          keep_checkpoint_every_n_hours = cfg.KEEP_CHECKPOINT_EVERY_N_HOURS
-        )
+        # Create a virtual cpu device for each tower
+        if num_towers > 1 and tower_device_type == 'cpu':
+            sess_config.device_count['CPU'] = num_towers
+
+        # Only talk to the parameter servers and this worker
+        if cluster is not None:
+            sess_config.device_filters.extend(['/job:ps', '/job:worker/task:%d' % task_index])
 
         # Run training.
-        slim.learning.train(
-            train_op=train_op,
-            logdir=logdir,
-            init_fn=get_init_function(logdir, pretrained_model_path, checkpoint_exclude_scopes, restore_variables_with_moving_averages=restore_variables_with_moving_averages, restore_moving_averages=restore_moving_averages, ema=ema),
-            number_of_steps=cfg.NUM_TRAIN_ITERATIONS,
-            save_summaries_secs=cfg.SAVE_SUMMARY_SECS,
-            save_interval_secs=cfg.SAVE_INTERVAL_SECS,
-            saver=saver,
-            session_config=sess_config,
-            summary_op = summary_op,
-            log_every_n_steps = cfg.LOG_EVERY_N_STEPS
-        )
+        try:
+            slim.learning.train(
+                train_op=train_op,
+                logdir=logdir,
+                init_fn=get_init_function(logdir, pretrained_model_path, checkpoint_exclude_scopes, restore_variables_with_moving_averages=restore_variables_with_moving_averages, restore_moving_averages=restore_moving_averages, ema=ema),
+                number_of_steps=number_of_steps,
+                save_summaries_secs=cfg.SAVE_SUMMARY_SECS,
+                save_interval_secs=cfg.SAVE_INTERVAL_SECS,
+                saver=saver,
+                session_config=sess_config,
+                summary_op = summary_op,
+                log_every_n_steps = cfg.LOG_EVERY_N_STEPS,
+                master=master,
+                is_chief=is_chief,
+                sync_optimizer=sync_optimizer,
+                train_step_fn=train_step_fn,
+                trace_every_n_steps=trace_every_n_steps
+            )
+        finally:
+            wait_for_checkpoints(saver)
+            if preemption_handler is not None:
+                preemption_handler.uninstall()
 
 def parse_args():
 
@@ -412,6 +1338,10 @@ def parse_args():
                         help='Paths to tfrecord files.', type=str,
                         nargs='+', required=True)
 
+    parser.add_argument('--validation_tfrecords', dest='validation_tfrecords',
+                        help='Paths to validation tfrecord files. The model is validated on them every VALIDATION.EVERY_N_STEPS steps in the training process.', type=str,
+                        nargs='+', required=False, default=None)
+
     parser.add_argument('--logdir', dest='logdir',
                           help='path to directory to store summary files and checkpoint files', type=str,
                           required=True)
@@ -464,6 +1394,34 @@ def parse_args():
                         help='Read the images from the file system using the `filename` field rather than using the `encoded` field of the tfrecord.',
                         action='store_true', default=False)
 
+    parser.add_argument('--ps_hosts', dest='ps_hosts',
+                        help='Comma separated list of hostname:port for the parameter server jobs. Only needed for distributed training.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--worker_hosts', dest='worker_hosts',
+                        help='Comma separated list of hostname:port for the worker jobs. Only needed for distributed training.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--job_name', dest='job_name',
+                        help='Either `ps` or `worker`. Only needed for distributed training.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--task_index', dest='task_index',
+                        help='The index of the task within its job. Only needed for distributed training.',
+                        required=False, type=int, default=0)
+
+    parser.add_argument('--profile_dir', dest='profile_dir',
+                        help='If provided, then trace --profile_steps steps (after skipping --profile_start_step steps) and save the chrome timelines and the per op time and memory tables to this directory.',
+                        required=False, type=str, default=None)
+
+    parser.add_argument('--profile_start_step', dest='profile_start_step',
+                        help='The number of steps to run before tracing with --profile_dir.',
+                        required=False, type=int, default=10)
+
+    parser.add_argument('--profile_steps', dest='profile_steps',
+                        help='The number of steps to trace with --profile_dir.',
+                        required=False, type=int, default=5)
+
     args = parser.parse_args()
     return args
 
@@ -472,6 +1430,24 @@ def main():
 
     cfg = parse_config_file(args.config_file)
 
+    cluster = None
+    master = ''
+    if args.ps_hosts != None or args.worker_hosts != None:
+        if args.ps_hosts == None or args.worker_hosts == None or args.job_name not in ('ps', 'worker'):
+            raise ValueError("Distributed training requires --ps_hosts, --worker_hosts and --job_name (`ps` or `worker`).")
+
+        cluster = tf.train.ClusterSpec({
+            'ps' : args.ps_hosts.split(','),
+            'worker' : args.worker_hosts.split(',')
+        })
+        server = tf.train.Server(cluster, job_name=args.job_name, task_index=args.task_index)
+
+        if args.job_name == 'ps':
+            server.join()
+            return
+
+        master = server.target
+
     # Replace cfg parameters with the command line values
     if args.max_number_of_steps != None:
         cfg.NUM_TRAIN_ITERATIONS = args.max_number_of_steps
@@ -488,6 +1464,10 @@ def main():
     if args.model_name != None:
         cfg.MODEL_NAME = args.model_name
 
+    profiler = None
+    if args.profile_dir != None:
+        profiler = profiling.Profiler(args.profile_dir, start_step=args.profile_start_step, num_steps=args.profile_steps)
+
     train(
         tfrecords=args.tfrecords,
         logdir=args.logdir,
@@ -497,7 +1477,12 @@ def main():
         checkpoint_exclude_scopes = args.checkpoint_exclude_scopes,
         restore_variables_with_moving_averages=args.restore_variables_with_moving_averages,
         restore_moving_averages=args.restore_moving_averages,
-        read_images=args.read_images
+        read_images=args.read_images,
+        validation_tfrecords=args.validation_tfrecords,
+        cluster=cluster,
+        task_index=args.task_index,
+        master=master,
+        profiler=profiler
     )
 
 if __name__ == '__main__':
@@ -0,0 +1,436 @@
+"""Tests for the multi-tower, distributed and cached bottleneck training in train.py, the step stats and preemption."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from easydict import EasyDict
+import numpy as np
+import tensorflow as tf
+import yaml
+
+import bottleneck_cache
+import preemption
+import step_stats
+import train
+
+
+def _tower_cfg():
+  return EasyDict({
+      'MODEL_NAME' : 'mobilenet_v1_025',
+      'NUM_CLASSES' : 10,
+      'DROPOUT_KEEP_PROB' : 0.5,
+      'LABEL_SMOOTHING' : 0.,
+      'WEIGHT_DECAY' : 0.00004,
+      'BATCHNORM_MOVING_AVERAGE_DECAY' : 0.9997,
+      'BATCHNORM_EPSILON' : 0.001,
+      'CLIP_GRADIENT_NORM' : 0
+  })
+
+
+def _build_train_op(num_towers, batch_size=4, image_size=64):
+  cfg = _tower_cfg()
+  global_step = tf.train.get_or_create_global_step()
+  inputs = tf.random_uniform([batch_size, image_size, image_size, 3], minval=-1., maxval=1.)
+  labels = tf.one_hot(tf.random_uniform([batch_size], maxval=cfg.NUM_CLASSES, dtype=tf.int32),
+                      cfg.NUM_CLASSES)
+  optimizer = tf.train.GradientDescentOptimizer(0.01)
+  total_loss, grads_and_vars, update_ops = train.build_towers(
+      inputs, labels, cfg, optimizer, num_towers=num_towers, tower_device_type='cpu')
+  train_op = train.create_train_op_from_gradients(
+      total_loss, grads_and_vars, optimizer, global_step, update_ops)
+  return train_op, grads_and_vars, update_ops
+
+
+class AverageGradientsTest(tf.test.TestCase):
+
+  def testAverageGradients(self):
+    with self.test_session() as sess:
+      var = tf.Variable([1., 2.])
+      tower_grads = [[(tf.constant([1., 3.]), var)], [(tf.constant([3., 5.]), var)]]
+      average_grads = train._average_gradients(tower_grads)
+      self.assertEqual(len(average_grads), 1)
+      self.assertIs(average_grads[0][1], var)
+      self.assertAllClose(sess.run(average_grads[0][0]), [2., 4.])
+
+  def testNoneGradients(self):
+    var = tf.Variable([1., 2.])
+    average_grads = train._average_gradients([[(None, var)], [(None, var)]])
+    self.assertIsNone(average_grads[0][0])
+
+
+class MultiTowerTest(tf.test.TestCase):
+
+  def testTowersShareVariables(self):
+    with tf.Graph().as_default():
+      _build_train_op(num_towers=1)
+      num_single_tower_variables = len(tf.global_variables())
+
+    with tf.Graph().as_default():
+      _, grads_and_vars, _ = _build_train_op(num_towers=2)
+      self.assertEqual(len(tf.global_variables()), num_single_tower_variables)
+      self.assertEqual(len(grads_and_vars), len(tf.trainable_variables()))
+
+  def testUpdateOpsFromFirstTower(self):
+    with tf.Graph().as_default():
+      _, _, update_ops = _build_train_op(num_towers=2)
+      self.assertTrue(len(update_ops) > 0)
+      for op in update_ops:
+        self.assertTrue(op.name.startswith('tower_0/'))
+
+  def testBatchSizeMustBeDivisible(self):
+    with tf.Graph().as_default():
+      with self.assertRaises(ValueError):
+        _build_train_op(num_towers=3, batch_size=4)
+
+  def testTrainStepOnVirtualCpus(self):
+    with tf.Graph().as_default():
+      train_op, _, _ = _build_train_op(num_towers=2)
+      global_step = tf.train.get_global_step()
+      config = tf.ConfigProto(device_count={'CPU' : 2}, allow_soft_placement=True)
+      with tf.Session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        loss = sess.run(train_op)
+        self.assertTrue(np.isfinite(loss))
+        self.assertEqual(sess.run(global_step), 1)
+
+
+class LearningRateTest(tf.test.TestCase):
+
+  def _learning_rate_cfg(self, decay_type):
+    return EasyDict({
+        'NUM_TRAIN_EXAMPLES' : 1000,
+        'BATCH_SIZE' : 100,
+        'NUM_TRAIN_ITERATIONS' : 110,
+        'NUM_EPOCHS_PER_DELAY' : 1,
+        'LEARNING_RATE_DECAY_TYPE' : decay_type,
+        'INITIAL_LEARNING_RATE' : 0.1,
+        'END_LEARNING_RATE' : 0.,
+        'WARMUP_EPOCHS' : 1
+    })
+
+  def _learning_rates(self, cfg, steps):
+    with tf.Graph().as_default():
+      global_step = tf.placeholder(tf.int64, [])
+      lr = train._configure_learning_rate(global_step, cfg)
+      with self.test_session() as sess:
+        return [sess.run(lr, {global_step : step}) for step in steps]
+
+  def testWarmup(self):
+    cfg = self._learning_rate_cfg('fixed')
+    self.assertAllClose(self._learning_rates(cfg, [0, 4, 9, 10, 50]), [0.01, 0.05, 0.1, 0.1, 0.1])
+
+  def testCosineDecayAfterWarmup(self):
+    cfg = self._learning_rate_cfg('cosine')
+    self.assertAllClose(self._learning_rates(cfg, [10, 60, 110, 200]), [0.1, 0.05, 0., 0.])
+
+  def testLinearScaling(self):
+    cfg = self._learning_rate_cfg('fixed')
+    cfg.WARMUP_EPOCHS = 0
+    cfg.SCALE_LEARNING_RATE = True
+    cfg.BASE_BATCH_SIZE = 50
+    cfg.ACCUMULATION_STEPS = 2
+    self.assertAllClose(self._learning_rates(cfg, [0]), [0.4])
+
+
+class GradientAccumulationTest(tf.test.TestCase):
+
+  def testAccumulatedUpdate(self):
+    with tf.Graph().as_default():
+      global_step = tf.train.get_or_create_global_step()
+      var = tf.Variable(0.)
+      grad_placeholder = tf.placeholder(tf.float32, [])
+      total_loss = var * grad_placeholder
+      optimizer = tf.train.GradientDescentOptimizer(1.)
+      grads_and_vars = optimizer.compute_gradients(total_loss, var_list=[var])
+      counter = tf.Variable(0)
+      update_op = tf.assign_add(counter, 1)
+
+      accumulate_op, train_op = train.create_accumulating_train_ops(
+          total_loss, grads_and_vars, optimizer, global_step, accumulation_steps=2, update_ops=[update_op])
+
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+
+        sess.run(accumulate_op, {grad_placeholder : 1.})
+        self.assertEqual(sess.run(global_step), 0)
+        self.assertAllClose(sess.run(var), 0.)
+
+        sess.run(train_op, {grad_placeholder : 3.})
+        self.assertEqual(sess.run(global_step), 1)
+        self.assertAllClose(sess.run(var), -2.)
+        self.assertEqual(sess.run(counter), 2)
+
+        # The accumulators are reset after each update
+        sess.run(accumulate_op, {grad_placeholder : 1.})
+        sess.run(train_op, {grad_placeholder : 1.})
+        self.assertAllClose(sess.run(var), -3.)
+
+
+def _free_port():
+  sock = socket.socket()
+  sock.bind(('localhost', 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+
+def _write_distributed_config(config_path, num_steps):
+  """A small synchronous training job on the synthetic input pipeline."""
+  repo_dir = os.path.dirname(os.path.abspath(__file__))
+  with open(os.path.join(repo_dir, 'config', 'config_train.yaml')) as f:
+    cfg = yaml.load(f)
+  cfg['MODEL_NAME'] = 'mobilenet_v1_025'
+  cfg['NUM_CLASSES'] = 10
+  cfg['BATCH_SIZE'] = 2
+  cfg['NUM_TRAIN_ITERATIONS'] = num_steps
+  cfg['TOWER_DEVICE_TYPE'] = 'cpu'
+  cfg['SYNC_REPLICAS'] = True
+  cfg['INPUT_PIPELINE'] = 'synthetic'
+  cfg['IMAGE_PROCESSING']['INPUT_SIZE'] = 64
+  cfg['LOG_EVERY_N_STEPS'] = 1
+  with open(config_path, 'w') as f:
+    yaml.dump(cfg, f)
+
+
+class DistributedTest(tf.test.TestCase):
+
+  def testShardTfrecords(self):
+    tfrecords = ['train-%d' % i for i in range(5)]
+    shards = [train.shard_tfrecords(tfrecords, 2, i) for i in range(2)]
+    self.assertEqual(shards[0], ['train-0', 'train-2', 'train-4'])
+    self.assertEqual(shards[1], ['train-1', 'train-3'])
+
+  def testTooFewTfrecords(self):
+    with self.assertRaises(ValueError):
+      train.shard_tfrecords(['train-0'], 2, 0)
+
+  def testTrainStepOnLocalCluster(self):
+    workers, _ = tf.test.create_local_cluster(num_workers=2, num_ps=1)
+    cluster = tf.train.ClusterSpec(workers[0].server_def.cluster)
+    with tf.Graph().as_default():
+      device_setter = tf.train.replica_device_setter(worker_device='/job:worker/task:0', cluster=cluster)
+      with tf.device(device_setter):
+        train_op, _, _ = _build_train_op(num_towers=1)
+      for var in tf.global_variables():
+        self.assertTrue(var.device.startswith('/job:ps'))
+      with tf.Session(workers[0].target) as sess:
+        sess.run(tf.global_variables_initializer())
+        self.assertTrue(np.isfinite(sess.run(train_op)))
+
+  def testSyncReplicasProcesses(self):
+    num_steps = 3
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    config_path = os.path.join(self.get_temp_dir(), 'config_sync_replicas.yaml')
+    _write_distributed_config(config_path, num_steps)
+    ps_hosts = 'localhost:%d' % _free_port()
+    worker_hosts = 'localhost:%d,localhost:%d' % (_free_port(), _free_port())
+    logdirs = [os.path.join(self.get_temp_dir(), 'sync_replicas_worker_%d' % i) for i in range(2)]
+
+    def start(job_name, task_index, logdir):
+      return subprocess.Popen([sys.executable, os.path.join(repo_dir, 'train.py'),
+                               '--tfrecords', 'train-0', 'train-1',
+                               '--logdir', logdir,
+                               '--config', config_path,
+                               '--ps_hosts', ps_hosts,
+                               '--worker_hosts', worker_hosts,
+                               '--job_name', job_name,
+                               '--task_index', str(task_index)], cwd=repo_dir)
+
+    processes = [start('ps', 0, os.path.join(self.get_temp_dir(), 'sync_replicas_ps'))]
+    try:
+      processes += [start('worker', i, logdir) for i, logdir in enumerate(logdirs)]
+      chief = processes[1]
+      deadline = time.time() + 600
+      while chief.poll() is None and time.time() < deadline:
+        time.sleep(1)
+      self.assertEqual(chief.poll(), 0)
+    finally:
+      # The other worker can be left waiting for a sync token once the chief has stopped
+      for process in processes:
+        if process.poll() is None:
+          process.kill()
+          process.wait()
+
+    # The chief aggregated the gradients of both workers for every step and saved the checkpoints
+    checkpoint_path = tf.train.latest_checkpoint(logdirs[0])
+    self.assertIsNotNone(checkpoint_path)
+    self.assertGreaterEqual(train.checkpoint_global_step(checkpoint_path), num_steps)
+    self.assertIsNone(tf.train.latest_checkpoint(logdirs[1]))
+
+
+class CachedBottleneckTest(tf.test.TestCase):
+
+  def _bottleneck_cfg(self):
+    cfg = _tower_cfg()
+    cfg.IMAGE_PROCESSING = EasyDict({'INPUT_SIZE' : 64})
+    cfg.CACHED_BOTTLENECK = EasyDict({'ENABLED' : True, 'END_POINT' : 'AvgPool_1a'})
+    return cfg
+
+  def testTrainsHeadOnly(self):
+    cfg = self._bottleneck_cfg()
+    self.assertTrue(train.trains_head_only(cfg, ['MobilenetV1/Logits']))
+    self.assertFalse(train.trains_head_only(cfg, ['MobilenetV1/Logits', 'MobilenetV1/Conv2d_13_pointwise']))
+    self.assertFalse(train.trains_head_only(cfg, None))
+
+  def testUnknownEndPoint(self):
+    cfg = self._bottleneck_cfg()
+    cfg.CACHED_BOTTLENECK.END_POINT = 'NotAnEndPoint'
+    with self.assertRaises(ValueError):
+      train.trains_head_only(cfg, ['MobilenetV1/Logits'])
+
+  def testDefaultEndPoints(self):
+    for model_name, end_point in train.DEFAULT_BOTTLENECK_END_POINTS.items():
+      cfg = self._bottleneck_cfg()
+      cfg.MODEL_NAME = model_name
+      cfg.IMAGE_PROCESSING.INPUT_SIZE = 299 if model_name.startswith('inception') else 224
+      cfg.CACHED_BOTTLENECK.END_POINT = None
+      self.assertEqual(train._bottleneck_end_point(cfg), end_point)
+      with tf.Graph().as_default():
+        inputs = tf.placeholder(tf.float32, [1, cfg.IMAGE_PROCESSING.INPUT_SIZE, cfg.IMAGE_PROCESSING.INPUT_SIZE, 3])
+        _, end_points = train.build_network(inputs, cfg, is_training=True)
+        self.assertIn(end_point, end_points)
+
+  def testDropoutAppliedOnce(self):
+    cfg = self._bottleneck_cfg()
+    batch_size = 4
+    with tf.Graph().as_default():
+      inputs = tf.placeholder(tf.float32, [batch_size, 64, 64, 3])
+      logits, end_points = train.build_network(inputs, cfg, is_training=True)
+      bottleneck = end_points['AvgPool_1a']
+      dropped_out = tf.get_default_graph().get_operation_by_name('MobilenetV1/Logits/Conv2d_1c_1x1/Conv2D').inputs[0]
+      # AvgPool_1a is before the dropout of mobilenet_v1, so the cached features are not dropped out
+      keep_prob = train._cached_bottleneck_keep_prob(bottleneck, logits, cfg)
+      self.assertEqual(keep_prob, 1.)
+      self.assertEqual(train._cached_bottleneck_keep_prob(dropped_out, logits, cfg), cfg.DROPOUT_KEEP_PROB)
+
+      features = np.ones([batch_size] + bottleneck.get_shape().as_list()[1:], dtype=np.float32)
+      batch_features, _ = next(bottleneck_cache.random_batches(
+          features, np.arange(batch_size), batch_size, np.random.RandomState(0), keep_prob=keep_prob))
+      with self.test_session():
+        kept = np.mean(dropped_out.eval({bottleneck : batch_features}) > 0)
+    self.assertNear(kept, cfg.DROPOUT_KEEP_PROB, 0.1)
+
+  def testFeatureStore(self):
+    store_dir = os.path.join(self.get_temp_dir(), 'store')
+    features = np.random.rand(10, 1, 1, 8).astype(np.float32)
+    labels = np.arange(10)
+    batches = [(features[:4], labels[:4]), (features[4:], labels[4:])]
+    self.assertEqual(bottleneck_cache.write_feature_store(store_dir, batches), 10)
+    self.assertTrue(bottleneck_cache.is_complete(store_dir))
+
+    stored_features, stored_labels = bottleneck_cache.load_feature_store(store_dir)
+    self.assertAllEqual(stored_features, features)
+    self.assertAllEqual(stored_labels, labels)
+
+    batch_features, batch_labels = next(bottleneck_cache.random_batches(
+        stored_features, stored_labels, 4, np.random.RandomState(0)))
+    self.assertEqual(batch_features.shape, (4, 1, 1, 8))
+    self.assertAllEqual(batch_features, features[batch_labels])
+
+
+class StepStatsTest(tf.test.TestCase):
+
+  def testStagedBatch(self):
+    with tf.Graph().as_default():
+      counter = tf.Variable(0.)
+      next_inputs = tf.fill([2, 3], counter.assign_add(1.))
+      batch_dict = {'inputs' : next_inputs, 'labels' : tf.constant([0, 1]), 'ids' : tf.constant(['a', 'b'])}
+      stage_op, staged_batch_dict = step_stats.stage_batch(batch_dict)
+      self.assertIs(staged_batch_dict['ids'], batch_dict['ids'])
+
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        sess.run(stage_op)
+        # Reading the staged batch doesn't dequeue a new batch
+        self.assertAllClose(sess.run(staged_batch_dict['inputs']), np.ones([2, 3]))
+        self.assertAllClose(sess.run(staged_batch_dict['inputs']), np.ones([2, 3]))
+        sess.run(stage_op)
+        self.assertAllClose(sess.run(staged_batch_dict['inputs']), 2 * np.ones([2, 3]))
+
+  def testWritesJsonl(self):
+    output_dir = os.path.join(self.get_temp_dir(), 'step_stats')
+    with tf.Graph().as_default():
+      global_step = tf.train.get_or_create_global_step()
+      stage_op, _ = step_stats.stage_batch({'inputs' : tf.zeros([2, 3]), 'labels' : tf.zeros([2])})
+      recorder = step_stats.StepStats(stage_op, examples_per_step=2, log_every_n_steps=2,
+                                      output_dir=output_dir, tensors_to_log={'learning_rate' : tf.constant(0.1)})
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        for _ in range(4):
+          step_start_time = time.time()
+          recorder.stage_batch(sess)
+          recorder.end_step(sess, global_step, step_start_time)
+
+    with open(os.path.join(output_dir, step_stats.JSONL_FILE)) as f:
+      lines = [json.loads(line) for line in f]
+    self.assertEqual(len(lines), 2)
+    self.assertAllClose(lines[0]['learning_rate'], 0.1)
+    self.assertTrue(lines[0]['examples_per_sec'] > 0)
+    self.assertTrue(lines[0]['input_wait_fraction'] <= 1.)
+
+
+class PreemptionTest(tf.test.TestCase):
+
+  def testStopsAfterSignal(self):
+    handler = preemption.PreemptionHandler(['SIGUSR1'])
+    try:
+      train_step_fn = handler.wrap_train_step_fn(lambda sess, train_op, global_step, kwargs: (1., False))
+      self.assertEqual(train_step_fn(None, None, None, {}), (1., False))
+      os.kill(os.getpid(), signal.SIGUSR1)
+      self.assertEqual(train_step_fn(None, None, None, {}), (1., True))
+    finally:
+      handler.uninstall()
+
+  def testResumeSkipFiles(self):
+    logdir = os.path.join(self.get_temp_dir(), 'resume')
+    with tf.Graph().as_default():
+      global_step = tf.train.get_or_create_global_step()
+      saver = tf.train.Saver()
+      with self.test_session() as sess:
+        sess.run(global_step.assign(25))
+        checkpoint_path = saver.save(sess, os.path.join(logdir, 'model.ckpt'), global_step=global_step)
+
+    # 25 steps of 40 examples is 2.5 epochs of 400 examples
+    cfg = EasyDict({'BATCH_SIZE' : 20, 'ACCUMULATION_STEPS' : 2, 'NUM_TRAIN_EXAMPLES' : 400})
+    self.assertEqual(train.resume_skip_files(checkpoint_path, cfg, num_tfrecords=4), 10)
+
+
+
+class ProgressiveResizingTest(tf.test.TestCase):
+
+  def _resizing_cfg(self):
+    cfg = _tower_cfg()
+    cfg.BATCH_SIZE = 10
+    cfg.NUM_TRAIN_EXAMPLES = 100
+    cfg.NUM_TRAIN_ITERATIONS = 100
+    cfg.IMAGE_PROCESSING = EasyDict({'INPUT_SIZE' : 128})
+    cfg.PROGRESSIVE_RESIZING = EasyDict({'ENABLED' : True, 'SCHEDULE' : [[2, 64], [5, 96]]})
+    return cfg
+
+  def testStages(self):
+    cfg = self._resizing_cfg()
+    # 10 steps per epoch
+    self.assertEqual(train.progressive_resizing_stages(cfg), [(20, 64), (50, 96), (100, 128)])
+
+    # The schedule ends after NUM_TRAIN_ITERATIONS
+    cfg.PROGRESSIVE_RESIZING.SCHEDULE = [[5, 64], [20, 96]]
+    self.assertEqual(train.progressive_resizing_stages(cfg), [(50, 64), (100, 96)])
+
+    cfg.PROGRESSIVE_RESIZING.SCHEDULE = [[5, 64], [2, 96]]
+    with self.assertRaises(ValueError):
+      train.progressive_resizing_stages(cfg)
+
+  def testVariablesDontDependOnInputSize(self):
+    train.check_input_sizes(self._resizing_cfg(), [64, 96, 128])
+
+if __name__ == '__main__':
+  tf.test.main()
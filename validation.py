@@ -0,0 +1,119 @@
+"""
+Validate the model in the training process (see `VALIDATION` in the training config).
+
+The validation network is built in the training graph and shares the variables of the training
+network, so a validation is a few session runs on the current values of the variables, rather than a
+separate `test.py` process that builds its own graph and restores a checkpoint. Every
+`every_n_steps` steps the streaming metrics are reset and accumulated over `num_batches` batches of
+the validation tfrecords, and written as tensorboard summaries.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import time
+
+import tensorflow as tf
+import tensorflow.contrib.slim as slim
+
+
+class Validator(object):
+
+    def __init__(self, logits, predictions, labels, every_n_steps, num_batches, output_dir,
+                 accuracy_at_k=(), patience=0, min_delta=0.):
+        """
+        Args:
+            logits: the logits of the validation network
+            predictions: the class probabilities of the validation network
+            labels: the (int) labels of the validation batch
+            every_n_steps: validate after every N training steps
+            num_batches: the number of validation batches to compute the metrics on
+            output_dir: the directory for the summaries
+            accuracy_at_k: also compute the top-k accuracy for each k
+            patience: stop training when the accuracy hasn't improved for this many validations,
+                0 to never stop early
+            min_delta: the smallest increase of the accuracy that counts as an improvement
+        """
+        self.every_n_steps = every_n_steps
+        self.num_batches = num_batches
+        self.output_dir = output_dir
+        self.patience = patience
+        self.min_delta = min_delta
+
+        with tf.variable_scope('validation_metrics') as scope:
+            loss = tf.reduce_mean(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=logits))
+            metric_map = {
+                'Accuracy' : tf.metrics.accuracy(labels=labels, predictions=tf.argmax(predictions, 1)),
+                'Loss' : tf.metrics.mean(loss)
+            }
+            num_classes = predictions.get_shape().as_list()[1]
+            for k in accuracy_at_k:
+                if k <= 1 or k > num_classes:
+                    continue
+                in_top_k = tf.nn.in_top_k(predictions=predictions, targets=labels, k=k)
+                metric_map['Accuracy_at_%s' % k] = tf.metrics.mean(tf.cast(in_top_k, tf.float32))
+            metric_variables = tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES, scope=scope.name)
+
+        self._names_to_values, names_to_updates = slim.metrics.aggregate_metric_map(metric_map)
+        self._update_op = tf.group(*names_to_updates.values())
+        self._reset_op = tf.variables_initializer(metric_variables)
+
+        self._summary_writer = None
+        self._steps_since_validation = 0
+        self.best_accuracy = None
+        self._validations_without_improvement = 0
+        self.stopped_early = False
+
+    def validate(self, sess, global_step):
+        """ Compute the metrics on `num_batches` validation batches and write them as summaries.
+        Args:
+            global_step: the global step tensor
+        Returns:
+            a dictionary of the metric values
+        """
+        start_time = time.time()
+        sess.run(self._reset_op)
+        for _ in range(self.num_batches):
+            sess.run(self._update_op)
+        values, global_step = sess.run([self._names_to_values, global_step])
+
+        if self._summary_writer is None:
+            self._summary_writer = tf.summary.FileWriter(self.output_dir)
+        summary = tf.Summary()
+        for name, value in sorted(values.items()):
+            summary.value.add(tag='validation/%s' % name, simple_value=float(value))
+        self._summary_writer.add_summary(summary, global_step)
+        self._summary_writer.flush()
+
+        tf.logging.info('global step %d: validation %s (%.1f sec)' % (
+            global_step, ', '.join('%s %.4f' % (name, value) for name, value in sorted(values.items())),
+            time.time() - start_time))
+
+        self._update_early_stopping(values['Accuracy'])
+        return values
+
+    def _update_early_stopping(self, accuracy):
+        if self.best_accuracy is None or accuracy > self.best_accuracy + self.min_delta:
+            self.best_accuracy = accuracy
+            self._validations_without_improvement = 0
+        else:
+            self._validations_without_improvement += 1
+
+        if self.patience > 0 and self._validations_without_improvement >= self.patience:
+            tf.logging.info('The validation accuracy has not improved on %.4f for %d validations, stopping.' % (
+                self.best_accuracy, self._validations_without_improvement))
+            self.stopped_early = True
+
+    def wrap_train_step_fn(self, train_step_fn):
+        """ Wrap a `train_step_fn` for `slim.learning.train` so that it validates every `every_n_steps`
+        steps, and stops training when the accuracy has plateaued.
+        """
+        def validating_train_step_fn(sess, train_op, global_step, train_step_kwargs):
+            total_loss, should_stop = train_step_fn(sess, train_op, global_step, train_step_kwargs)
+            self._steps_since_validation += 1
+            if self._steps_since_validation >= self.every_n_steps and not should_stop:
+                self._steps_since_validation = 0
+                self.validate(sess, global_step)
+            return total_loss, should_stop or self.stopped_early
+        return validating_train_step_fn
@@ -0,0 +1,51 @@
+"""Tests for validation.py."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+import validation
+
+
+class ValidatorTest(tf.test.TestCase):
+
+  def _validator(self, patience=0):
+    global_step = tf.train.get_or_create_global_step()
+    # The top class is right for 2 of the 4 examples, and the top 2 classes for 3 of them
+    logits = tf.constant([[3., 2., 1.], [3., 2., 1.], [1., 3., 2.], [2., 1., 3.]])
+    labels = tf.constant([0, 1, 1, 1], dtype=tf.int64)
+    validator = validation.Validator(logits, tf.nn.softmax(logits), labels, every_n_steps=2, num_batches=3,
+                                     output_dir=os.path.join(self.get_temp_dir(), 'validation'),
+                                     accuracy_at_k=[2], patience=patience)
+    return validator, global_step
+
+  def testMetrics(self):
+    with tf.Graph().as_default():
+      validator, global_step = self._validator()
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        for _ in range(2):
+          values = validator.validate(sess, global_step)
+          # The metrics are reset before each validation
+          self.assertAllClose(values['Accuracy'], 0.5)
+          self.assertAllClose(values['Accuracy_at_2'], 0.75)
+
+  def testValidatesEveryNStepsAndStopsEarly(self):
+    with tf.Graph().as_default():
+      validator, global_step = self._validator(patience=2)
+      train_step_fn = validator.wrap_train_step_fn(lambda sess, train_op, global_step, kwargs: (1., False))
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        should_stops = [train_step_fn(sess, None, global_step, {})[1] for _ in range(6)]
+
+    # Validations after steps 2, 4 and 6; the accuracy doesn't improve after the first
+    self.assertEqual(should_stops, [False, False, False, False, False, True])
+    self.assertAllClose(validator.best_accuracy, 0.5)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -34,7 +34,9 @@ def visualize_train_inputs(tfrecords, cfg, show_text_labels=False, read_images=F
                 add_summaries=False,
                 input_type='visualize',
                 fetch_text_labels=show_text_labels,
-                read_filenames=read_images
+                read_filenames=read_images,
+                pipeline=cfg.INPUT_PIPELINE if 'INPUT_PIPELINE' in cfg else 'queue',
+                read_cfg=cfg.READ_IMAGES_CFG if 'READ_IMAGES_CFG' in cfg else None
             )
 
         # Convert float images to uint8 images